@@ -10,7 +10,7 @@ from django.conf import settings
 
 
 from django.db import models
-from django.db.models import ManyToManyField, ForeignKey
+from django.db.models import ManyToManyField, ForeignKey, Q
 from peach.django.json import JsonEncoder
 
 from peach.misc.encrypt import AESCipher
@@ -205,3 +205,67 @@ class DataclassField(DictField):
 
 def paginate(query, page_no, page_size):
     return query[((page_no - 1) * page_size) : page_no * page_size]
+
+
+def keyset_paginate(query, cursor, page_size, order_by=("pk",)):
+    """
+    游标(keyset)分页, 按排序字段的值定位下一页, 不使用OFFSET, 每一页的查询代价都一样,
+    适合导出等需要顺序读取全部数据的场景
+
+    :param query: QuerySet, 可以是values()
+    :param cursor: 上一页返回的游标, 第一页为None
+    :param page_size: 每页数量
+    :param order_by: 排序字段, "-"开头表示倒序, 最后一个字段必须唯一, 字段值不能为NULL;
+        pk会换成主键的字段名, values()时结果中必须包含排序字段, 不支持values_list()
+    :return: (本页数据, 下一页的游标), 没有下一页时游标为None
+    """
+    pk = query.model._meta.pk.attname
+    order_by = [
+        ("-" if e.startswith("-") else "") + pk if e.lstrip("-") == "pk" else e
+        for e in order_by
+    ]
+    fields = [e.lstrip("-") for e in order_by]
+    query = query.order_by(*order_by)
+    if cursor:
+        query = query.filter(_keyset_filter(order_by, _decode_cursor(cursor)))
+    items = list(query[:page_size])
+    # 最后一页也检查一次, values()/values_list()用错时第一页就报错
+    values = _keyset_values(items[-1], fields) if items else None
+    if len(items) < page_size:
+        return items, None
+    return items, _encode_cursor(values)
+
+
+def _keyset_values(item, fields):
+    if isinstance(item, dict):
+        missing = [field for field in fields if field not in item]
+        if missing:
+            raise ValueError(f"keyset_paginate: values() must include {missing}")
+        return [item[field] for field in fields]
+    if isinstance(item, models.Model):
+        return [getattr(item, field) for field in fields]
+    raise ValueError("keyset_paginate does not support values_list(), use values()")
+
+
+def _keyset_filter(order_by, values):
+    # (a, b) > (x, y) 展开成 a > x OR (a = x AND b > y)
+    condition = Q()
+    equals = {}
+    for e, value in zip(order_by, values):
+        field = e.lstrip("-")
+        lookup = "lt" if e.startswith("-") else "gt"
+        condition |= Q(**equals, **{f"{field}__{lookup}": value})
+        equals[field] = value
+    return condition
+
+
+def _encode_cursor(values):
+    # datetime保留微秒和时区, 查询时由字段自己解析字符串
+    data = json.dumps(
+        values, default=lambda o: o.isoformat() if hasattr(o, "isoformat") else str(o)
+    )
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
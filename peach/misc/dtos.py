@@ -47,6 +47,8 @@ class PaginationCriteriaDTO:
     page_size: int = 30
     return_total: bool = True
     export: bool = False
+    cursor: Optional[str] = None
+    """游标分页(keyset_paginate)时上一页返回的next_cursor, 不为空时忽略page_no"""
 
 
 T = TypeVar("T")
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+报表导出的基准测试: 按指定的行数/列数/类型生成数据, 分别测试各个导出引擎和完整的ReportClient导出流程
+(桩report函数 + 本地桩服务端), 输出rows/sec、峰值RSS和文件大小, 可以和之前保存的结果对比.
+
+每个用例在单独fork出的子进程中执行, 峰值RSS互不影响.
+
+    python manage.py bench_report --rows 200000 --cols 20 --output bench.json
+    python manage.py bench_report --rows 200000 --cols 20 --baseline bench.json
+"""
+import datetime
+import decimal
+import http.server
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from .engines import Csv, CsvGz, Xlsx
+
+ENGINES = {"csv": Csv, "csv.gz": CsvGz, "xlsx": Xlsx}
+
+TYPES = ("int", "float", "str", "datetime", "decimal", "none")
+
+_BASE_TIME = datetime.datetime(2022, 1, 1)
+
+
+def _value(type_name, row, col):
+    if type_name == "int":
+        return row * 31 + col
+    if type_name == "float":
+        return row / 7 + col
+    if type_name == "str":
+        return f"value-{row}-{col}-中文"
+    if type_name == "datetime":
+        return _BASE_TIME + datetime.timedelta(seconds=row * 13 + col)
+    if type_name == "decimal":
+        return decimal.Decimal(row * 100 + col) / 100
+    return None
+
+
+def make_header(cols):
+    return {f"field_{i}": f"字段{i}" for i in range(cols)}
+
+
+def make_page(page_no, page_size, rows, cols, types):
+    """第page_no页(从1开始)的数据, 第i列的类型为types[i % len(types)]"""
+    start = (page_no - 1) * page_size
+    return [
+        [_value(types[col % len(types)], row, col) for col in range(cols)]
+        for row in range(start, min(start + page_size, rows))
+    ]
+
+
+def _peak_rss():
+    # linux下ru_maxrss的单位是KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def bench_engine(engine, rows, cols, page_size, types, work_dir, include_fields=None):
+    """单独测试导出引擎, 数据在计时之外生成, 只统计process_page和export的耗时"""
+    file_name = os.path.join(work_dir, f"{uuid.uuid4().hex}.{engine}")
+    exporter = ENGINES[engine](file_name, mode="w")
+    header = make_header(cols)
+    process_cost = 0.0
+    page_no = 1
+    while True:
+        items = make_page(page_no, page_size, rows, cols, types)
+        start = time.perf_counter()
+        exporter.process_page(items, header=header, include_fields=include_fields)
+        process_cost += time.perf_counter() - start
+        if not items:
+            break
+        page_no += 1
+    start = time.perf_counter()
+    exporter.export()
+    export_cost = time.perf_counter() - start
+    total = process_cost + export_cost
+    return dict(
+        case=f"engine:{engine}",
+        rows=rows,
+        seconds=round(total, 4),
+        rows_per_sec=round(rows / total, 1) if total else None,
+        process_page_seconds=round(process_cost, 4),
+        export_seconds=round(export_cost, 4),
+        peak_rss=_peak_rss(),
+        file_size=os.path.getsize(file_name),
+    )
+
+
+class _StubHandler(http.server.BaseHTTPRequestHandler):
+    """桩服务端, 接收上传的文件并丢弃"""
+
+    def do_POST(self):
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1024 * 1024)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b'{"data": true}')
+
+    do_PUT = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_client(engine, rows, cols, page_size, types, work_dir, prefetch_pages=0):
+    """通过ReportClient.executor()完整执行一个导出任务, 包括查询(桩函数)/写文件/上传(本地桩服务端)"""
+    from .client import MAX_PAGE_NUMS, ReportClient, ReportTaskInfo
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    header = make_header(cols)
+
+    def report(filter_params):
+        items = make_page(
+            filter_params["page_no"], filter_params["page_size"], rows, cols, types
+        )
+        return len(items), header, items
+
+    report.prefetch_pages = prefetch_pages
+    report_type = f"bench_{uuid.uuid4().hex}"
+    ReportClient.report_types[report_type] = report
+    client = ReportClient(
+        f"http://127.0.0.1:{server.server_port}/",
+        "bench",
+        "bench",
+        temp_file_dir=work_dir,
+    )
+    file_name = f"{uuid.uuid4().hex}.{engine}"
+    client.cur_task = {
+        1: ReportTaskInfo(
+            1, report_type, engine, file_name, 1, page_size, None, None, None
+        )
+    }
+    start = time.perf_counter()
+    try:
+        client.executor()
+    finally:
+        server.shutdown()
+        server.server_close()
+        ReportClient.report_types.pop(report_type, None)
+    total = time.perf_counter() - start
+    file_path = os.path.join(client.export_file_dir, file_name)
+    # 按page_no分页时最多导出MAX_PAGE_NUMS页
+    rows = min(rows, MAX_PAGE_NUMS * page_size)
+    return dict(
+        case=f"client:{engine}"
+        + (f":prefetch{prefetch_pages}" if prefetch_pages else ""),
+        rows=rows,
+        seconds=round(total, 4),
+        rows_per_sec=round(rows / total, 1) if total else None,
+        peak_rss=_peak_rss(),
+        file_size=os.path.getsize(file_path),
+    )
+
+
+def _run_case(func, kwargs):
+    work_dir = tempfile.mkdtemp(prefix="bench_report_")
+    try:
+        return func(work_dir=work_dir, **kwargs)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run(
+    rows=100000,
+    cols=20,
+    page_size=1000,
+    types=TYPES,
+    engines=("csv", "xlsx"),
+    client=True,
+    prefetch_pages=0,
+):
+    """执行所有用例, 返回结果列表"""
+    cases = []
+    common = dict(rows=rows, cols=cols, page_size=page_size, types=tuple(types))
+    for engine in engines:
+        cases.append((bench_engine, dict(common, engine=engine)))
+        if client:
+            cases.append((bench_client, dict(common, engine=engine)))
+            if prefetch_pages > 1:
+                cases.append(
+                    (
+                        bench_client,
+                        dict(common, engine=engine, prefetch_pages=prefetch_pages),
+                    )
+                )
+
+    results = []
+    ctx = multiprocessing.get_context("fork")
+    for func, kwargs in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            results.append(pool.submit(_run_case, func, kwargs).result())
+    return results
+
+
+def compare(results, baseline):
+    """和基准结果对比rows_per_sec, 返回{case: 变化百分比}"""
+    base = {e["case"]: e for e in baseline}
+    diff = {}
+    for result in results:
+        old = base.get(result["case"])
+        if old and old.get("rows_per_sec") and result.get("rows_per_sec"):
+            diff[result["case"]] = round(
+                (result["rows_per_sec"] / old["rows_per_sec"] - 1) * 100, 1
+            )
+    return diff
+
+
+def format_results(results, baseline=None):
+    diff = compare(results, baseline) if baseline else {}
+    lines = [
+        f"{'case':<32}{'rows':>10}{'seconds':>10}{'rows/sec':>12}{'peak rss(MB)':>14}{'file(MB)':>10}{'vs base':>10}"
+    ]
+    for e in results:
+        change = diff.get(e["case"])
+        lines.append(
+            f"{e['case']:<32}{e['rows']:>10}{e['seconds']:>10.2f}{e['rows_per_sec'] or 0:>12.0f}"
+            f"{e['peak_rss'] / 1024 / 1024:>14.1f}{e['file_size'] / 1024 / 1024:>10.2f}"
+            f"{'' if change is None else f'{change:+.1f}%':>10}"
+        )
+    return "\n".join(lines)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from peach.django.json import JsonEncoder
+
+# 不影响导出内容的查询参数
+_IGNORED_PARAMS = ("page_size",)
+
+
+class ExportCache:
+    """
+    导出文件缓存, 同一个report_type、查询参数、导出字段、文件类型和数据版本的导出在过期前直接复用之前生成的文件
+
+    缓存文件和导出文件在同一个磁盘上时用硬链接, 不会额外占用空间.
+    每个缓存文件旁边有一个同名的.json记录report_type、导出行数和过期时间, 用于按report_type失效和上传.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(report_type, filter_params, include_fields, file_type, version=None):
+        params = {k: v for k, v in filter_params.items() if k not in _IGNORED_PARAMS}
+        data = json.dumps(
+            [report_type, params, include_fields, file_type, version],
+            cls=JsonEncoder,
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get(self, key, file_name):
+        """
+        缓存未过期时把缓存文件复制到file_name, 返回导出行数, 没有命中返回None
+        """
+        meta = self._read_meta(key)
+        if meta is None or meta["expires_at"] <= time.time():
+            return None
+        try:
+            _link_or_copy(self._file(key), file_name)
+        except FileNotFoundError:
+            return None
+        return meta["items_count"]
+
+    def put(self, key, report_type, file_name, items_count, ttl):
+        self.purge()
+        # 临时文件名唯一, 多个线程同时写入同一个key时互不影响, 最后一次replace生效
+        tmp_file = self._mkstemp()
+        try:
+            _link_or_copy(file_name, tmp_file)
+            os.replace(tmp_file, self._file(key))
+        finally:
+            _remove_file(tmp_file)
+        meta = dict(
+            report_type=report_type,
+            items_count=items_count,
+            expires_at=time.time() + ttl,
+        )
+        tmp_file = self._mkstemp()
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp_file, self._meta_file(key))
+        finally:
+            _remove_file(tmp_file)
+
+    def invalidate(self, report_type=None):
+        """删除report_type(为None时删除全部)的缓存, 返回删除的数量"""
+        count = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[: -len(".json")]
+            meta = self._read_meta(key)
+            if report_type is None or (meta and meta["report_type"] == report_type):
+                self._remove(key)
+                count += 1
+        return count
+
+    def purge(self):
+        """删除已经过期的缓存"""
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                key = name[: -len(".json")]
+                meta = self._read_meta(key)
+                if meta is None or meta["expires_at"] <= now:
+                    self._remove(key)
+
+    def _mkstemp(self):
+        # 以.tmp结尾, 不会被invalidate/purge当成缓存
+        fd, path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        os.close(fd)
+        return path
+
+    def _file(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _meta_file(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_file(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _remove(self, key):
+        for path in (self._meta_file(key), self._file(key)):
+            _remove_file(path)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
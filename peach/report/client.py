@@ -5,10 +5,12 @@ import json
 import logging
 import os
 import pickle
+import threading
 import typing
 import uuid
 import dataclasses
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from enum import unique, Enum
 from functools import wraps
@@ -16,12 +18,13 @@ from typing import Type, Any
 
 import requests
 from dacite import from_dict, Config
+from django import db
 from requests import RequestException
 
-from . import filelock
+from . import cache, filelock, upload
 from .const import SEPARATOR
 from .dtos import TaskListCriteria, TaskExecutor
-from .engines import Csv, Xlsx
+from .engines import Csv, CsvGz, CsvZst, ExportRowLimitExceeded, Xlsx
 
 from peach.django.json import JsonEncoder
 from peach.misc import dt, retry
@@ -32,17 +35,30 @@ MAX_PAGE_NUMS = 200
 MAX_RETRY_COUNT = 3
 
 
+class ReportTaskLimitExceeded(Exception):
+    """任务超过了task_timeout或max_task_rows, 不再重试"""
+
+
 @unique
 class _FileType(Enum):
     CSV = "csv"
     XLSX = "xlsx"
+    CSV_GZ = "csv.gz"
+    CSV_ZST = "csv.zst"
 
 
-_ENGINES = {_FileType.CSV: Csv, _FileType.XLSX: Xlsx}
+_ENGINES = {
+    _FileType.CSV: Csv,
+    _FileType.XLSX: Xlsx,
+    _FileType.CSV_GZ: CsvGz,
+    _FileType.CSV_ZST: CsvZst,
+}
 
 _FILE_EXTENSION = {
     _FileType.CSV: ".csv",
     _FileType.XLSX: ".xlsx",
+    _FileType.CSV_GZ: ".csv.gz",
+    _FileType.CSV_ZST: ".csv.zst",
 }
 
 ReportTaskInfo = namedtuple(
@@ -57,9 +73,27 @@ ReportTaskInfo = namedtuple(
         "filter_params",
         "executor",
         "include_fields",
+        "checkpoint",
+    ],
+    defaults=[None],
+)
+
+ReportCheckpoint = namedtuple(
+    "ReportCheckpoint",
+    [
+        "page_no",  # 下一页的page_no
+        "cursor",  # 下一页的游标, 按page_no分页时为None
+        "items_count",  # 已经导出的行数
+        "file_size",  # 已经写入的文件大小, 恢复时截断到这个位置
     ],
 )
 
+_Page = namedtuple(
+    "_Page",
+    ["page_no", "count", "header", "items", "query_cost", "next_cursor"],
+    defaults=[None],
+)
+
 
 class ReportClient:
     """
@@ -70,11 +104,37 @@ class ReportClient:
     report_types: typing.Dict[str, typing.Callable] = dict()
 
     def __init__(
-        self, server_host, app_key, app_secret, temp_file_dir=None, debug=False
+        self,
+        server_host,
+        app_key,
+        app_secret,
+        temp_file_dir=None,
+        debug=False,
+        max_concurrent_tasks=1,
+        task_timeout=None,
+        max_task_rows=None,
+        large_task_rows=100000,
+        max_task_wait=600,
     ):
+        """
+        :param max_concurrent_tasks: 同时执行的导出任务数, 大于1时TaskProcessThread使用线程池并发执行
+        :param task_timeout: 单个任务的最长执行时间(秒), 超过后任务失败且不再重试
+        :param max_task_rows: 单个任务最多导出的行数, 超过后任务失败且不再重试
+        :param large_task_rows: 同一个report_type最近导出的行数超过这个值时认为是大任务,
+            并发执行时大任务最多占用max_concurrent_tasks - 1个位置, 小任务不会被大任务阻塞
+        :param max_task_wait: 并发执行时任务等待超过这个时间(秒)后按等待时间优先调度, 大任务不会一直被小任务插队,
+            为None时始终按大小调度
+        """
 
         self.debug = debug
         self.cur_task = dict()  # key task_id, value ReportTaskInfo
+        self.max_concurrent_tasks = max(max_concurrent_tasks, 1)
+        self.task_timeout = task_timeout
+        self.max_task_rows = max_task_rows
+        self.large_task_rows = large_task_rows
+        self.max_task_wait = max_task_wait
+        self._rows_estimate = dict()  # key report_type, value 最近导出行数的加权平均
+        self._lock = threading.RLock()
 
         if self.debug:
             _LOGGER.warning("Report is running under DEBUG mode")
@@ -98,6 +158,7 @@ class ReportClient:
         )
 
         self.meta_file = os.path.join(temp_file_dir, "meta")
+        self.export_cache = cache.ExportCache(os.path.join(temp_file_dir, "cache/"))
 
         self.engines = _ENGINES
 
@@ -147,8 +208,8 @@ class ReportClient:
         self._load_conf_from_local()
         self.fetch_task()
 
-    def fetch_task(self):
-        self._rpc_fetch_task()
+    def fetch_task(self, nums=1):
+        self._rpc_fetch_task(nums)
 
     def executor(self):
         self._executor()
@@ -158,138 +219,326 @@ class ReportClient:
             f"[ReportTask] executor undo_tasks count: {len(self.cur_task)} now: {dt.local_now()}"
         )
         for task_id in list(self.cur_task.keys()):
-            try_count = 0
-            success = False
-            while try_count < MAX_RETRY_COUNT and not success:
-                task_start = dt.now_ts()
-                try:
-                    report_task_info = self.cur_task[task_id]
-
-                    self._register_executor(
-                        TaskExecutor(
-                            report_type=report_task_info.report_type,
-                            executor=report_task_info.executor,
-                        )
+            self.execute_task(task_id)
+
+    def execute_task(self, task_id):
+        """执行一个任务(包括重试), 执行完从cur_task中删除, 并发执行时在各自的线程中调用"""
+        try_count = 0
+        success = False
+        report_task_info = self.cur_task[task_id]
+        items_count = 0
+        while try_count < MAX_RETRY_COUNT and not success:
+            task_start = dt.now_ts()
+            engine = None
+            try:
+                self._register_executor(
+                    TaskExecutor(
+                        report_type=report_task_info.report_type,
+                        executor=report_task_info.executor,
                     )
-
-                    func = ReportClient.report_types[report_task_info.report_type]
-                    task_id = report_task_info.id
-
-                    file_name = os.path.join(
-                        self.export_file_dir, report_task_info.file_name
+                )
+
+                func = ReportClient.report_types[report_task_info.report_type]
+                file_name = os.path.join(
+                    self.export_file_dir, report_task_info.file_name
+                )
+
+                if report_task_info.filter_params:
+                    filter_params = json.loads(report_task_info.filter_params)
+                else:
+                    filter_params = dict()
+                filter_params["page_no"] = report_task_info.page_no
+                filter_params["page_size"] = report_task_info.page_size
+                items_count = 0
+
+                cache_key = self._cache_key(func, report_task_info, filter_params)
+                if cache_key:
+                    cached_count = self.export_cache.get(cache_key, file_name)
+                    if cached_count is not None:
+                        _LOGGER.info(
+                            f"[ReportTask] task: {task_id} hit export cache: {cache_key}"
+                        )
+                        items_count = cached_count
+                        # 缓存文件已经覆盖了之前导出的一部分, 断点不再有效
+                        if self.cur_task[task_id].checkpoint:
+                            self._save_checkpoint(task_id, None)
+                        self._upload_file(task_id, items_count)
+                        success = True
+                        continue
+
+                engine = self.engines[self.FileType(report_task_info.file_type)](
+                    file_name, mode="a+"
+                )
+                checkpoint = self.cur_task[task_id].checkpoint
+                if (
+                    checkpoint
+                    and engine.resumable
+                    and os.path.exists(file_name)
+                    and os.path.getsize(file_name) >= checkpoint.file_size
+                ):
+                    # 从上一次写入成功的页之后继续导出
+                    engine.resume(checkpoint.file_size)
+                    filter_params["page_no"] = checkpoint.page_no
+                    if checkpoint.cursor is not None:
+                        filter_params["cursor"] = checkpoint.cursor
+                    items_count = checkpoint.items_count
+                    _LOGGER.info(
+                        f"[ReportTask] resume task: {task_id} from checkpoint: {checkpoint}"
                     )
+                else:
                     if os.path.exists(file_name):
                         os.remove(file_name)
-
-                    engine = self.engines[self.FileType(report_task_info.file_type)](
-                        file_name, mode="a+"
+                    if checkpoint:
+                        self._save_checkpoint(task_id, None)
+
+                _LOGGER.info(
+                    f"[ReportTask] start task: {task_id} - {report_task_info.report_type} - {report_task_info.file_name}, "
+                    f"try_count: {try_count}, now: {dt.local_now()}"
+                )
+                for page in self._iter_pages(func, filter_params):
+                    save_start = dt.now_ts()
+                    engine.process_page(
+                        page.items,
+                        header=page.header,
+                        include_fields=report_task_info.include_fields,
                     )
-
-                    if report_task_info.filter_params:
-                        filter_params = json.loads(report_task_info.filter_params)
-                    else:
-                        filter_params = dict()
-                    filter_params["page_no"] = report_task_info.page_no
-                    filter_params["page_size"] = report_task_info.page_size
-                    items_count = 0
+                    save_end = dt.now_ts()
 
                     _LOGGER.info(
-                        f"[ReportTask] start task: {task_id} - {report_task_info.report_type} - {report_task_info.file_name}, "
-                        f"try_count: {try_count}, now: {dt.local_now()}"
+                        f"[ReportTask] task: {task_id}, page_no: {page.page_no}, count: {page.count}, "
+                        f"query cost: {page.query_cost}s, save cost: {save_end - save_start}s"
                     )
-                    while True:
-                        query_start = dt.now_ts()
-                        count, header, items = func(filter_params)
-                        query_end = dt.now_ts()
-
-                        save_start = dt.now_ts()
-                        engine.process_page(
-                            items,
-                            header=header,
-                            include_fields=report_task_info.include_fields,
-                        )
-                        save_end = dt.now_ts()
 
-                        _LOGGER.info(
-                            f"[ReportTask] task: {task_id}, page_no: {filter_params['page_no']}, count: {count}, "
-                            f"query cost: {query_end - query_start}s, save cost: {save_end - save_start}s"
-                        )
+                    if page.items:
+                        items_count += page.count
+                        if engine.resumable:
+                            self._save_checkpoint(
+                                task_id,
+                                ReportCheckpoint(
+                                    page.page_no + 1,
+                                    page.next_cursor,
+                                    items_count,
+                                    engine.flush(),
+                                ),
+                            )
+                    self._check_task_limits(task_id, task_start, items_count)
+
+                export_start = dt.now_ts()
+                engine.export()
+                _LOGGER.info(
+                    f"[ReportTask] task: {task_id}, items_count:{items_count}, export cost: {dt.now_ts() - export_start}s"
+                )
+
+                self._upload_file(task_id, items_count)
+                success = True
+                if cache_key:
+                    self._put_cache(
+                        cache_key, func, report_task_info, file_name, items_count
+                    )
+            except (ReportTaskLimitExceeded, ExportRowLimitExceeded) as e:
+                try_count = MAX_RETRY_COUNT
+                self._abort_engine(engine)
+                _LOGGER.error(
+                    f"[ReportTask] {e}, task: {task_id} - {report_task_info.report_type} - {report_task_info.file_name}"
+                )
+            except Exception as e:
+                try_count += 1
+                self._abort_engine(engine)
+                _LOGGER.exception(
+                    f"[ReportTask] cached {e}, task: {task_id} - {report_task_info.report_type} - {report_task_info.file_name}, "
+                    f"try_count: {try_count}, now: {dt.local_now()}, total cost: {dt.now_ts() - task_start}s",
+                    exc_info=True,
+                )
+        if success:
+            self._record_task_rows(report_task_info.report_type, items_count)
+        else:
+            self._rpc_update_task(task_id)
+        with self._lock:
+            del self.cur_task[task_id]
+            undo_tasks = len(self.cur_task)
+            self._save_conf_to_local()
+        _LOGGER.info(
+            f"[ReportTask] {'success' if success else 'failed'} export task: {task_id} - {report_task_info.report_type} - {report_task_info.file_name}, "
+            f"undo_tasks: {undo_tasks}, try_count: {try_count}, now: {dt.local_now()}, total cost: {dt.now_ts() - task_start}s"
+        )
+        return success
+
+    def _cache_key(self, func, report_task_info, filter_params):
+        """report函数声明了cache_ttl时返回导出缓存的key, 否则返回None"""
+        if not getattr(func, "cache_ttl", 0):
+            return None
+        version = getattr(func, "cache_version", None)
+        if callable(version):
+            version = version(dict(filter_params))
+        return self.export_cache.key(
+            report_task_info.report_type,
+            filter_params,
+            report_task_info.include_fields,
+            report_task_info.file_type,
+            version,
+        )
 
-                        if not items:
-                            break
-                        items_count += count
-                        filter_params["page_no"] += 1
-                        if filter_params["page_no"] > MAX_PAGE_NUMS:
-                            break
+    def _put_cache(self, cache_key, func, report_task_info, file_name, items_count):
+        try:
+            self.export_cache.put(
+                cache_key,
+                report_task_info.report_type,
+                file_name,
+                items_count,
+                func.cache_ttl,
+            )
+        except OSError:
+            _LOGGER.exception(f"[ReportTask] save export cache failed: {cache_key}")
 
-                    export_start = dt.now_ts()
-                    engine.export()
-                    _LOGGER.info(
-                        f"[ReportTask] task: {task_id}, items_count:{items_count}, export cost: {dt.now_ts() - export_start}s"
-                    )
+    def invalidate_cache(self, report_type=None):
+        """
+        数据变化后删除report_type(为None时删除全部)的导出缓存, 只影响本机的缓存,
+        跨机器的失效可以用cache_version
+        """
+        if self.debug:
+            return 0
+        return self.export_cache.invalidate(report_type)
 
-                    self._upload_file(task_id, items_count)
-                    success = True
-                except Exception as e:
-                    try_count += 1
-                    _LOGGER.exception(
-                        f"[ReportTask] cached {e}, task: {task_id} - {report_task_info.report_type} - {report_task_info.file_name}, "
-                        f"try_count: {try_count}, now: {dt.local_now()}, total cost: {dt.now_ts() - task_start}s",
-                        exc_info=True,
-                    )
-            if not success:
-                self._rpc_update_task(task_id)
-            del self.cur_task[task_id]
-            _LOGGER.info(
-                f"[ReportTask] {'success' if success else 'failed'} export task: {task_id} - {report_task_info.report_type} - {report_task_info.file_name}, "
-                f"undo_tasks: {len(self.cur_task)}, try_count: {try_count}, now: {dt.local_now()}, total cost: {dt.now_ts() - task_start}s"
+    @staticmethod
+    def _abort_engine(engine):
+        # 先关闭文件, 避免还没写入的缓冲区在续传截断之后才写入
+        if engine is None or not hasattr(engine, "abort"):
+            return
+        try:
+            engine.abort()
+        except Exception:
+            _LOGGER.exception("[ReportTask] abort export engine failed")
+
+    def _save_checkpoint(self, task_id, checkpoint):
+        with self._lock:
+            self.cur_task[task_id] = self.cur_task[task_id]._replace(
+                checkpoint=checkpoint
             )
             self._save_conf_to_local()
 
+    def _check_task_limits(self, task_id, task_start, items_count):
+        """每写完一页检查一次, 流式导出时内存只和单页大小有关, 用行数限制任务的规模"""
+        if self.task_timeout and dt.now_ts() - task_start > self.task_timeout:
+            raise ReportTaskLimitExceeded(
+                f"task {task_id} exceeded task_timeout: {self.task_timeout}s"
+            )
+        if self.max_task_rows and items_count > self.max_task_rows:
+            raise ReportTaskLimitExceeded(
+                f"task {task_id} exceeded max_task_rows: {self.max_task_rows}"
+            )
+
+    def _record_task_rows(self, report_type, items_count):
+        with self._lock:
+            estimate = self._rows_estimate.get(report_type)
+            self._rows_estimate[report_type] = (
+                items_count if estimate is None else (estimate + items_count) / 2
+            )
+
+    def estimate_rows(self, report_task_info):
+        """按同一个report_type最近导出的行数估算任务大小, 没有执行过的按0算"""
+        return self._rows_estimate.get(report_task_info.report_type, 0)
+
+    def is_large_task(self, report_task_info):
+        return self.estimate_rows(report_task_info) >= self.large_task_rows
+
+    @staticmethod
+    def _iter_pages(func, filter_params):
+        """
+        按顺序返回每一页的数据(_Page), 返回空页后结束
+
+        report函数返回(count, header, items)时按page_no分页, 最多MAX_PAGE_NUMS页;
+        返回(count, header, items, next_cursor)时按游标分页, 下一页的filter_params["cursor"]为next_cursor,
+        next_cursor为None时结束, 不限制页数;
+        report函数声明了prefetch_pages时, 在线程池中提前并发查询后面的页(只支持page_no分页)
+        """
+        prefetch = getattr(func, "prefetch_pages", 0) or 0
+        if prefetch > 1:
+            yield from _prefetch_pages(func, filter_params, prefetch)
+            return
+
+        while True:
+            page_no = filter_params["page_no"]
+            query_start = dt.now_ts()
+            count, header, items, *cursor = func(filter_params)
+            next_cursor = cursor[0] if cursor else None
+            yield _Page(
+                page_no, count, header, items, dt.now_ts() - query_start, next_cursor
+            )
+            if not items:
+                return
+            if cursor:
+                if next_cursor is None:
+                    return
+                if next_cursor == filter_params.get("cursor"):
+                    raise ValueError(f"report cursor does not advance: {next_cursor}")
+                filter_params["cursor"] = next_cursor
+            elif page_no >= MAX_PAGE_NUMS:
+                return
+            filter_params["page_no"] += 1
+
     def _update_cur_task(self, tasks):
-        self.cur_task.update(tasks)
-        self._save_conf_to_local()
+        with self._lock:
+            for task_id, info in tasks.items():
+                # 服务端重新下发的任务没有断点, 保留本地已经保存的断点
+                old = self.cur_task.get(task_id)
+                if old is not None and old.checkpoint and info.checkpoint is None:
+                    info = info._replace(checkpoint=old.checkpoint)
+                self.cur_task[task_id] = info
+            self._save_conf_to_local()
 
     def _save_conf_to_local(self):
         """
-        保存任务数据到本机磁盘
+        保存任务数据到本机磁盘, 先写临时文件再rename, 不会读到写了一半的文件
         """
-        with filelock.FileLock(self.meta_file):
-            with open(self.meta_file, "wb") as meta_f:
-                meta_f.write(pickle.dumps(self.cur_task))
+        with self._lock:
+            data = _dump_tasks(self.cur_task)
+            tmp_file = f"{self.meta_file}.{os.getpid()}.tmp"
+            with filelock.FileLock(self.meta_file):
+                with open(tmp_file, "wb") as meta_f:
+                    meta_f.write(data)
+                    meta_f.flush()
+                    os.fsync(meta_f.fileno())
+                os.replace(tmp_file, self.meta_file)
 
     def _load_conf_from_local(self):
         """
         从本机磁盘加载配置
         """
         try:
-            with filelock.FileLock(self.meta_file):
-                with open(self.meta_file, "rb") as meta_f:
-                    self.cur_task = pickle.loads(meta_f.read())
+            with open(self.meta_file, "rb") as meta_f:
+                data = meta_f.read()
         except FileNotFoundError:
             return False
+        with self._lock:
+            self.cur_task = _load_tasks(data)
         return True
 
+    @retry.retry(RequestException, logger=_LOGGER)
     def _upload_file(self, task_id, items_count=None):
-        url = "upload_file/"
+        """
+        流式上传导出文件, 超时时间按文件大小计算, 上传失败只重试上传
+        """
+        url = self.server_host + "upload_file/"
         file_path = os.path.join(self.export_file_dir, self.cur_task[task_id].file_name)
-        _LOGGER.info(f"upload file: {file_path}")
-        with open(file_path, "rb") as f:
-            files = {"export_file": f}
-
-            self._do_post(
-                self.server_host + url,
-                dict(task_id=task_id, items_count=items_count),
-                files=files,
+        file_size = os.path.getsize(file_path)
+        params = dict(task_id=task_id, items_count=items_count)
+        self._add_sign(params)
+        _LOGGER.info(f"upload file: {file_path}, size: {file_size}")
+        with upload.MultipartFileStream(params, "export_file", file_path) as body:
+            resp = requests.post(
+                url,
+                data=body,
+                headers={"Content-Type": body.content_type},
+                timeout=upload.upload_timeout(file_size),
             )
+        return self._decode_response(url, params, resp)
 
     def _rpc_list_task(self, criteria: TaskListCriteria):
         url = "task/"
         return self._do_get(self.server_host + url, dataclasses.asdict(criteria))
 
-    def _rpc_fetch_task(self):
+    def _rpc_fetch_task(self, nums=1):
         url = "fetch_task/"
-        nums = 1
         try:
             tasks = self._do_get(self.server_host + url, dict(nums=nums))
         except Exception:
@@ -420,7 +669,15 @@ class ReportClient:
         )
 
     @classmethod
-    def decorator(cls, data_class):
+    def decorator(cls, data_class, prefetch_pages=0, cache_ttl=0, cache_version=None):
+        """
+        :param data_class: 查询参数的dataclass
+        :param prefetch_pages: 大于1时表示每一页的查询互不依赖(只依赖page_no), 导出时最多并发查询prefetch_pages页,
+            写入文件的顺序不变, 内存中最多同时有prefetch_pages页数据
+        :param cache_ttl: 大于0时开启导出缓存, 相同的report_type/查询参数/导出字段/文件类型/cache_version
+            在cache_ttl秒内直接上传之前生成的文件, 不再查询
+        :param cache_version: 数据版本, 字符串或者func(filter_params) -> str, 数据变化后版本不同, 缓存自然失效
+        """
         assert dataclasses.is_dataclass(data_class)
 
         def report_decorator(func):
@@ -428,6 +685,9 @@ class ReportClient:
             def wrapper(filter_params):
                 return func(_dict_to_dto(filter_params, data_class=data_class))
 
+            wrapper.prefetch_pages = prefetch_pages
+            wrapper.cache_ttl = cache_ttl
+            wrapper.cache_version = cache_version
             return wrapper
 
         return report_decorator
@@ -442,6 +702,74 @@ class ReportClient:
 
 
 ##################################################################################
+def _prefetch_pages(func, filter_params, prefetch):
+    def fetch(params):
+        try:
+            query_start = dt.now_ts()
+            count, header, items, *cursor = func(params)
+            if cursor:
+                raise ValueError("cursor pagination does not support prefetch_pages")
+            return _Page(
+                params["page_no"], count, header, items, dt.now_ts() - query_start
+            )
+        finally:
+            # 线程池中的线程各自持有数据库连接, 查询完就关闭
+            db.connections.close_all()
+
+    next_page = filter_params["page_no"]
+    last_page = max(MAX_PAGE_NUMS, next_page)
+    pending = deque()
+    with ThreadPoolExecutor(
+        max_workers=prefetch, thread_name_prefix="report_prefetch"
+    ) as pool:
+        try:
+            while True:
+                while len(pending) < prefetch and next_page <= last_page:
+                    params = dict(filter_params, page_no=next_page)
+                    pending.append(pool.submit(fetch, params))
+                    next_page += 1
+                if not pending:
+                    return
+                future = pending.popleft()
+                page = future.result()
+                yield page
+                if not page.items:
+                    return
+        finally:
+            # 遇到空页或者异常, 后面还没开始的页不再查询
+            for future in pending:
+                future.cancel()
+
+
+def _dump_tasks(tasks):
+    return json.dumps(
+        [
+            dict(
+                info._asdict(),
+                checkpoint=info.checkpoint._asdict() if info.checkpoint else None,
+            )
+            for info in tasks.values()
+        ],
+        cls=JsonEncoder,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def _load_tasks(data):
+    if data.startswith(b"\x80"):
+        # 兼容旧版本pickle格式的meta文件
+        return pickle.loads(data)
+    tasks = dict()
+    for task in json.loads(data):
+        checkpoint = task.pop("checkpoint", None)
+        info = ReportTaskInfo(**task)
+        if checkpoint:
+            info = info._replace(checkpoint=ReportCheckpoint(**checkpoint))
+        tasks[info.id] = info
+    return tasks
+
+
 def _dict_to_dto(data: dict, data_class: Type) -> Any:
     return from_dict(
         data_class=data_class,
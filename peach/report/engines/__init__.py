@@ -1,4 +1,5 @@
-from ._csv import Csv
+from ._csv import Csv, CsvGz, CsvZst
 from ._xlsx import Xlsx
+from .base import ExportRowLimitExceeded  # noqa: F401
 
-available = (Csv, Xlsx)
+available = (Csv, CsvGz, CsvZst, Xlsx)
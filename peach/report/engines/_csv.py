@@ -1,6 +1,87 @@
-from .base import ExportDataABC
+import csv
+import gzip
+import os
 
+from .base import StreamingExportABC
 
-class Csv(ExportDataABC):
-    def export(self):
-        self.export_data.to_csv(self._file_name, index=False, encoding="utf-8")
+
+class Csv(StreamingExportABC):
+    """逐行写入csv, 和之前DataFrame.to_csv(index=False)的输出一致"""
+
+    resumable = True
+
+    def open(self):
+        mode = "w" if "w" in self._mode else "a"
+        self._file = self._open_file(mode)
+        # csv.writer默认用\r\n换行, DataFrame.to_csv用的是\n
+        self._writer = csv.writer(self._file, lineterminator="\n")
+
+    def _open_file(self, mode):
+        return open(self._file_name, mode, encoding="utf-8", newline="")
+
+    def flush(self):
+        if not self.resumable:
+            return super().flush()
+        self._file.flush()
+        return os.fstat(self._file.fileno()).st_size
+
+    def resume(self, file_size):
+        if not self.resumable:
+            return super().resume(file_size)
+        with open(self._file_name, "r+b") as f:
+            f.truncate(file_size)
+        self._mode = "a"
+        self.open()
+        self._opened = True
+
+    def write_header(self, header):
+        self._writer.writerow(header)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class CsvGz(Csv):
+    """
+    写入时gzip压缩的csv, 压缩流不能截断后续写, 不支持断点续传
+    """
+
+    resumable = False
+    compresslevel = 6
+
+    def _open_file(self, mode):
+        return gzip.open(
+            self._file_name,
+            mode + "t",
+            compresslevel=self.compresslevel,
+            encoding="utf-8",
+            newline="",
+        )
+
+
+class CsvZst(Csv):
+    """
+    写入时zstd压缩的csv, 需要安装zstandard, 不支持断点续传
+    """
+
+    resumable = False
+    level = 3
+
+    def _open_file(self, mode):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                "csv.zst export requires zstandard: pip install zstandard"
+            )
+
+        return zstandard.open(
+            self._file_name,
+            mode,
+            cctx=zstandard.ZstdCompressor(level=self.level),
+            encoding="utf-8",
+            newline="",
+        )
@@ -1,8 +1,58 @@
-from .base import ExportDataABC
-
-
-class Xlsx(ExportDataABC):
-    def export(self):
-        self.export_data.to_excel(
-            self._file_name, index=False, encoding="utf-8", engine="xlsxwriter"
-        )
+import xlsxwriter
+
+from .base import ExportRowLimitExceeded, StreamingExportABC
+
+
+class Xlsx(StreamingExportABC):
+    """
+    使用xlsxwriter的constant_memory模式逐行写入, 写完一行就刷到临时文件,
+    只能按行号递增的顺序写, 超过xlsx的行数上限(1048576行)时抛出ExportRowLimitExceeded
+    """
+
+    def open(self):
+        self._workbook = xlsxwriter.Workbook(
+            self._file_name,
+            {
+                "constant_memory": True,
+                "remove_timezone": True,
+                "default_date_format": "yyyy-mm-dd hh:mm:ss",
+            },
+        )
+        self._worksheet = self._workbook.add_worksheet()
+        self._header_format = self._workbook.add_format(
+            {"bold": True, "border": 1, "align": "center", "valign": "top"}
+        )
+        self._row = 0
+
+    def write_header(self, header):
+        self._check_row()
+        self._worksheet.write_row(self._row, 0, header, self._header_format)
+        self._row += 1
+
+    def write_rows(self, rows):
+        for row in rows:
+            self._check_row()
+            try:
+                self._worksheet.write_row(self._row, 0, row)
+            except TypeError:
+                # xlsxwriter不支持的类型(dict, list, UUID等)转成字符串
+                self._worksheet.write_row(
+                    self._row, 0, [self._to_cell(value) for value in row]
+                )
+            self._row += 1
+
+    def _check_row(self):
+        # 超过上限时write_row只返回-1, 不检查的话会上传一个被截断的文件
+        if self._row >= self._worksheet.xls_rowmax:
+            raise ExportRowLimitExceeded(
+                f"xlsx supports at most {self._worksheet.xls_rowmax} rows"
+            )
+
+    @staticmethod
+    def _to_cell(value):
+        if value is None or isinstance(value, (str, int, float, bool)):
+            return value
+        return str(value)
+
+    def close(self):
+        self._workbook.close()
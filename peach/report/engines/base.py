@@ -2,8 +2,8 @@ import abc
 import os
 import pickle
 from abc import ABC
+from operator import itemgetter
 
-import numpy as np
 import pandas as pd
 
 from peach.report.const import SEPARATOR
@@ -20,6 +20,7 @@ class ExportDataABC(ABC):
         self._header = None
         self._del_col_index_list = None
         self._page_data = None
+        self._projector = None
         self._first = True
 
     def process_page(self, page_data, **kwargs):
@@ -54,6 +55,9 @@ class ExportDataABC(ABC):
                 self._del_col_index_list = self._del_col_index(
                     header, _include_fields_list
                 )
+                self._projector = self._row_projector(
+                    len(header), self._del_col_index_list
+                )
                 self._page_data = self._del_col_data(page_data)
             else:
                 # include_fields 为空时, 过滤掉所有字段
@@ -123,4 +127,85 @@ class ExportDataABC(ABC):
         if not self._del_col_index_list:
             return page_data
 
-        return np.delete(page_data, self._del_col_index_list, axis=1)
+        return [self._projector(row) for row in page_data]
+
+    @staticmethod
+    def _row_projector(col_num, del_col_index_list):
+        """
+        按保留的列生成行投影函数, 只在第一页计算一次,
+        取出的值保持原来的Python类型, 不像np.delete那样把整页转成数组
+        """
+        del_cols = set(del_col_index_list)
+        keep = [i for i in range(col_num) if i not in del_cols]
+        if not keep:
+            return lambda row: ()
+        if len(keep) == 1:
+            index = keep[0]
+            return lambda row: (row[index],)
+        return itemgetter(*keep)
+
+
+class ExportRowLimitExceeded(Exception):
+    """导出的行数超过了文件格式的上限, 重试也不会成功"""
+
+
+class StreamingExportABC(ExportDataABC):
+    """
+    流式导出: 每处理一页就直接写入文件, 不再先pickle再整体构建DataFrame,
+    内存占用只和单页数据量有关, 和报表总大小无关
+    """
+
+    resumable = False
+    """是否支持从上一次写入的位置继续导出(resume)"""
+
+    def __init__(self, file_name, mode="a+"):
+        super().__init__(file_name, mode)
+        self._opened = False
+        self.rows_written = 0
+
+    def do_process_page(self):
+        if not self._opened:
+            self.open()
+            self._opened = True
+            if self._header:
+                self.write_header(self._header)
+        if self._header and len(self._page_data):
+            self.write_rows(self._page_data)
+            self.rows_written += len(self._page_data)
+
+    def export(self):
+        if not self._opened:
+            # 没有任何分页数据时也要生成文件
+            self.open()
+            self._opened = True
+        self.close()
+
+    def abort(self):
+        """导出失败时关闭文件, 最后一个断点之后写入的内容在resume时截断"""
+        if self._opened:
+            self._opened = False
+            self.close()
+
+    def flush(self):
+        """把已经处理的页写入磁盘, 返回文件大小, 用于断点续传; 不支持断点续传时返回None"""
+        return None
+
+    def resume(self, file_size):
+        """从断点续传: 文件截断到file_size, 之后的页追加写入, 不再写表头; 调用前先检查resumable"""
+        raise ValueError(f"{type(self).__name__} export is not resumable")
+
+    @abc.abstractmethod
+    def open(self):
+        pass
+
+    @abc.abstractmethod
+    def write_header(self, header):
+        pass
+
+    @abc.abstractmethod
+    def write_rows(self, rows):
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        pass
@@ -2,6 +2,7 @@
 import logging
 import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from django import db
 
@@ -13,12 +14,16 @@ class TaskProcessThread(threading.Thread):
         super().__init__()
         self.shutdown_signal = shutdown_signal
         self.second_of_wait_task = second_of_wait_task
+        self._waiting_since = dict()  # key task_id, value 开始等待的时间
 
     def stop(self):
         self.shutdown_signal = True
 
     def run(self):
         logging.info("start the report processor.....")
+        if report_client.max_concurrent_tasks > 1:
+            self._run_concurrent()
+            return
         while not self.shutdown_signal:
             report_client.load_cur_task()
 
@@ -32,6 +37,99 @@ class TaskProcessThread(threading.Thread):
         else:
             logging.info("the task executor had shutdown")
 
+    def _run_concurrent(self):
+        """
+        并发执行多个任务, 每个任务在线程池中独立执行(独立的文件/数据库连接/重试)
+        空闲位置按需从服务端拉取任务, 按估算的大小从小到大调度,
+        大任务最多占用max_concurrent_tasks - 1个位置, 等待超过max_task_wait的任务优先执行
+        """
+        slots = report_client.max_concurrent_tasks
+        running = dict()  # key task_id, value (future, 是否大任务)
+        report_client._load_conf_from_local()
+        with ThreadPoolExecutor(slots, thread_name_prefix="report_task") as pool:
+            while not self.shutdown_signal:
+                for task_id, (future, _) in list(running.items()):
+                    if future.done():
+                        del running[task_id]
+
+                self._submit(pool, running, slots)
+                # 有空闲位置时再拉取新任务, 等待中的任务最多保留slots个
+                free = slots - len(running)
+                if free and len(report_client.cur_task) < slots * 2:
+                    report_client.fetch_task(nums=free)
+                    self._submit(pool, running, slots)
+
+                if running:
+                    wait(
+                        [future for future, _ in running.values()],
+                        timeout=self.second_of_wait_task,
+                        return_when=FIRST_COMPLETED,
+                    )
+                else:
+                    time.sleep(self.second_of_wait_task)
+            logging.info("the task executor is shutting down, wait running tasks")
+        logging.info("the task executor had shutdown")
+
+    def _submit(self, pool, running, slots):
+        for task_id, large in self._schedule(running, slots, self._waiting_since):
+            running[task_id] = (pool.submit(self._execute_task, task_id), large)
+
+    @staticmethod
+    def _schedule(running, slots, waiting_since=None, now=None):
+        """
+        从等待中的任务里选出可以开始执行的任务: [(task_id, 是否大任务)]
+
+        waiting_since记录每个任务开始等待的时间, 等待超过report_client.max_task_wait秒的任务
+        按等待时间排在最前面, 不会因为一直有更小的任务而饿死
+        """
+        now = time.monotonic() if now is None else now
+        waiting_since = dict() if waiting_since is None else waiting_since
+        waiting = [
+            (task_id, info)
+            for task_id, info in list(report_client.cur_task.items())
+            if task_id not in running
+        ]
+        waiting_ids = {task_id for task_id, _ in waiting}
+        for task_id in list(waiting_since):
+            if task_id not in waiting_ids:
+                del waiting_since[task_id]
+        for task_id in waiting_ids:
+            waiting_since.setdefault(task_id, now)
+
+        max_wait = report_client.max_task_wait
+
+        def _priority(e):
+            since = waiting_since[e[0]]
+            if max_wait is not None and now - since >= max_wait:
+                return 0, since
+            return 1, report_client.estimate_rows(e[1])
+
+        waiting.sort(key=_priority)
+        free = slots - len(running)
+        large_running = sum(1 for _, large in running.values() if large)
+        selected = []
+        for task_id, info in waiting:
+            if len(selected) >= free:
+                break
+            large = report_client.is_large_task(info)
+            if large:
+                if large_running >= slots - 1:
+                    continue
+                large_running += 1
+            selected.append((task_id, large))
+        return selected
+
+    @staticmethod
+    def _execute_task(task_id):
+        db.close_old_connections()
+        try:
+            report_client.execute_task(task_id)
+        except Exception:
+            logging.exception("execute report task %s failed", task_id)
+        finally:
+            # 线程池中的数据库连接是线程独占的, 任务结束就关闭
+            db.connections.close_all()
+
 
 task = TaskProcessThread()
 
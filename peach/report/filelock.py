@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-import errno
+import fcntl
 import os
 import time
 
@@ -9,76 +9,68 @@ class FileLockException(Exception):
 
 
 class FileLock:
-    """A file locking mechanism that has context-manager support so
-    you can use it in a with statement. This should be relatively cross
-    compatible as it doesn't rely on msvcrt or fcntl for the locking.
+    """基于fcntl.flock的进程间文件锁, 支持with语句
+
+    - timeout=None时由内核排队唤醒, 不需要轮询
+    - 进程退出(包括崩溃)时内核自动释放锁, 不会留下失效的锁
+    - 锁文件在被锁文件的同一目录下(file_name + ".lock"), 不会删除
     """
 
     def __init__(self, file_name, timeout=10, delay=0.05):
-        """Prepare the file locker. Specify the file to lock and optionally
-        the maximum timeout and the delay between each attempt to lock.
+        """
+        :param file_name: 需要加锁的文件
+        :param timeout: 最多等待timeout秒, 每delay秒尝试一次, 超时抛出FileLockException; 传None表示一直等待直到获得锁
         """
         if timeout is not None and delay is None:
             raise ValueError("If timeout is not None, then delay must not be None.")
         self.is_locked = False
-        self.lockfile = os.path.join(os.getcwd(), "%s.lock" % file_name)
+        self.lockfile = os.path.abspath("%s.lock" % file_name)
         self.file_name = file_name
         self.timeout = timeout
         self.delay = delay
         self.fd = None
 
     def acquire(self):
-        """Acquire the lock, if possible. If the lock is in use, it check again
-        every `wait` seconds. It does this until it either gets the lock or
-        exceeds `timeout` number of seconds, in which case it throws
-        an exception.
-        """
+        fd = os.open(self.lockfile, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            if self.timeout is None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                self._acquire_with_timeout(fd)
+        except BaseException:
+            os.close(fd)
+            raise
+        self.fd = fd
+        self.is_locked = True
+
+    def _acquire_with_timeout(self, fd):
         start_time = time.time()
         while True:
             try:
-                self.fd = os.open(self.lockfile, os.O_CREAT | os.O_EXCL | os.O_RDWR)
-                self.is_locked = True  # moved to ensure tag only when locked
-                break
-            except OSError as e:
-                if e.errno != errno.EEXIST:
-                    raise
-                if self.timeout is None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if (time.time() - start_time) >= self.timeout:
                     raise FileLockException(
                         "Could not acquire lock on {}".format(self.file_name)
                     )
-                if (time.time() - start_time) >= self.timeout:
-                    raise FileLockException("Timeout occured.")
                 time.sleep(self.delay)
 
-    #        self.is_locked = True
-
     def release(self):
-        """Get rid of the lock by deleting the lockfile.
-        When working in a `with` statement, this gets automatically
-        called at the end.
-        """
         if self.is_locked:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
             os.close(self.fd)
-            os.unlink(self.lockfile)
+            self.fd = None
             self.is_locked = False
 
     def __enter__(self):
-        """Activated when used in the with statement.
-        Should automatically acquire a lock to be used in the with block.
-        """
         if not self.is_locked:
             self.acquire()
         return self
 
     def __exit__(self, type, value, traceback):
-        """Activated at the end of the with statement.
-        It automatically releases the lock if it isn't locked.
-        """
         if self.is_locked:
             self.release()
 
     def __del__(self):
-        """Make sure that the FileLock instance doesn't leave a lockfile
-        lying around.
-        """
         self.release()
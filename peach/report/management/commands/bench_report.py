@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from peach.report import benchmark
+
+
+class Command(BaseCommand):
+    help = "Benchmark report engines and the report export pipeline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000)
+        parser.add_argument("--cols", type=int, default=20)
+        parser.add_argument("--page-size", type=int, default=1000)
+        parser.add_argument(
+            "--types",
+            default=",".join(benchmark.TYPES),
+            help="列类型, 按列循环使用: " + ",".join(benchmark.TYPES),
+        )
+        parser.add_argument(
+            "--engines",
+            default="csv,xlsx",
+            help="导出引擎: " + ",".join(benchmark.ENGINES),
+        )
+        parser.add_argument(
+            "--no-client", action="store_true", help="只测试导出引擎, 不测试ReportClient完整流程"
+        )
+        parser.add_argument("--prefetch-pages", type=int, default=0)
+        parser.add_argument("--output", help="结果保存为json, 可以作为之后的baseline")
+        parser.add_argument("--baseline", help="之前保存的结果, 对比rows/sec的变化")
+
+    def handle(self, *args, **options):
+        results = benchmark.run(
+            rows=options["rows"],
+            cols=options["cols"],
+            page_size=options["page_size"],
+            types=options["types"].split(","),
+            engines=options["engines"].split(","),
+            client=not options["no_client"],
+            prefetch_pages=options["prefetch_pages"],
+        )
+        baseline = (
+            benchmark.load_results(options["baseline"]) if options["baseline"] else None
+        )
+        self.stdout.write(benchmark.format_results(results, baseline))
+        if options["output"]:
+            benchmark.save_results(results, options["output"])
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import mimetypes
+import os
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+UPLOAD_MIN_TIMEOUT = 30
+"""上传的最小超时时间(秒)"""
+UPLOAD_MIN_SPEED = 512 * 1024
+"""按最低上传速度(字节/秒)估算超时时间"""
+
+
+def upload_timeout(file_size, connect_timeout=5):
+    """按文件大小计算上传的超时时间: (连接超时, 读超时)"""
+    return connect_timeout, max(UPLOAD_MIN_TIMEOUT, file_size / UPLOAD_MIN_SPEED)
+
+
+class MultipartFileStream:
+    """
+    流式的multipart/form-data请求体, 文件按CHUNK_SIZE分块读取, 不会整个读入内存,
+    requests.post(files=...)会先在内存中拼出完整的请求体
+
+    用法: requests.post(url, data=body, headers={"Content-Type": body.content_type})
+    """
+
+    def __init__(self, fields, file_field, file_path):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._file_path = file_path
+        self._file = None
+
+        preamble = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            preamble.append(
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            )
+        file_name = os.path.basename(file_path)
+        file_type, encoding = mimetypes.guess_type(file_name)
+        if encoding or not file_type:
+            # 压缩文件(.csv.gz等)按二进制上传
+            file_type = "application/octet-stream"
+        preamble.append(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{file_name}"\r\n'
+            f"Content-Type: {file_type}\r\n\r\n"
+        )
+        self._preamble = "".join(preamble).encode("utf-8")
+        self._epilogue = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self._length = (
+            len(self._preamble) + os.path.getsize(file_path) + len(self._epilogue)
+        )
+        self._pending = b""
+        self._parts = None
+
+    def __len__(self):
+        return self._length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _iter_parts(self):
+        yield self._preamble
+        self._file = open(self._file_path, "rb")
+        try:
+            while True:
+                chunk = self._file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+        yield self._epilogue
+
+    def read(self, size=-1):
+        if self._parts is None:
+            self._parts = self._iter_parts()
+        data = self._pending
+        while size < 0 or len(data) < size:
+            chunk = next(self._parts, None)
+            if chunk is None:
+                break
+            data += chunk
+        if size < 0:
+            self._pending = b""
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+
+from peach.sender.slack_sender.slack_helper import (
+    format_slack_user_id_list,
+    get_slack_id_by_username,
+)
+from peach.sender.slack_sender.slack_sender import send_slack_msg
+from peach.xxl_job.pyxxl.define import (
+    XXL_JOB_EXECUTE_FAIL_DIGEST_MSG,
+    XXL_JOB_EXECUTE_FAIL_MSG,
+    XXL_JOB_HANDLER_NOT_FOUND,
+    XXL_JOB_HANDLER_NOT_FOUND_DIGEST,
+)
+
+logger = logging.getLogger(__name__)
+
+FAILED = "failed"
+"""任务执行失败"""
+NOT_FOUND = "not_found"
+"""调度的handler在执行器中不存在"""
+
+
+@dataclass
+class Digest:
+    """同一个handler同一类告警在一个窗口内的汇总"""
+
+    kind: str
+    handler: str
+    first_at: float
+    log_ids: Dict[int, None] = field(default_factory=dict)
+    """去重后的logId, 保持先后顺序"""
+    authors: Dict[str, None] = field(default_factory=dict)
+
+    @property
+    def count(self) -> int:
+        return len(self.log_ids)
+
+    @property
+    def last_log_id(self) -> Optional[int]:
+        return next(reversed(self.log_ids), None) if self.log_ids else None
+
+
+class AlertSender:
+    """后台发送任务失败告警, 任务结束时只把告警放进队列, 不做任何网络请求
+
+    - 同一个handler同一类告警在window秒内汇总成一条消息, 同一个logId只算一次
+    - 同一个handler同一类告警至少间隔min_interval秒才会再次发送, 期间的告警合并到下一条
+    - 查询slack用户和发送消息都是阻塞调用, 在线程池中执行
+    """
+
+    def __init__(
+        self,
+        window: float = 60,
+        min_interval: float = 600,
+        max_queue_size: int = 10000,
+        send: Optional[Callable[[Digest], None]] = None,
+    ) -> None:
+        self.window = window
+        self.min_interval = min_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.send = send or self._send_slack
+        self.dropped = 0
+        """队列满了丢弃的告警数量"""
+        self._pending: Dict[Tuple[str, str], Digest] = {}
+        self._last_sent: Dict[Tuple[str, str], float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run(), name="pyxxl-alert")
+
+    def put(
+        self, kind: str, handler: str, author: str, log_id: Optional[int] = None
+    ) -> None:
+        """加入一条告警, 不会阻塞"""
+        if not self.running:
+            self.start()
+        try:
+            self.queue.put_nowait((kind, handler, author, log_id))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("alert queue is full, drop alert %s %s", kind, handler)
+
+    async def close(self) -> None:
+        """停止后台任务, 把还没发送的告警全部发出去"""
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        while not self.queue.empty():
+            self._add(self.queue.get_nowait())
+        for key in list(self._pending):
+            await self._flush(key)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            for key in list(self._pending):
+                if self._due_at(key) <= now:
+                    await self._flush(key)
+            due_at = min((self._due_at(key) for key in self._pending), default=None)
+            timeout = None if due_at is None else max(due_at - loop.time(), 0)
+            try:
+                self._add(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    def _add(self, item: Tuple[str, str, str, Optional[int]]) -> None:
+        kind, handler, author, log_id = item
+        key = (kind, handler)
+        digest = self._pending.get(key)
+        if digest is None:
+            digest = Digest(kind, handler, asyncio.get_running_loop().time())
+            self._pending[key] = digest
+        if log_id is not None:
+            digest.log_ids[log_id] = None
+        if author:
+            digest.authors[author] = None
+
+    def _due_at(self, key: Tuple[str, str]) -> float:
+        last_sent = self._last_sent.get(key)
+        due_at = self._pending[key].first_at + self.window
+        if last_sent is not None:
+            due_at = max(due_at, last_sent + self.min_interval)
+        return due_at
+
+    async def _flush(self, key: Tuple[str, str]) -> None:
+        loop = asyncio.get_running_loop()
+        digest = self._pending.pop(key)
+        self._last_sent[key] = loop.time()
+        try:
+            await loop.run_in_executor(None, self.send, digest)
+        except Exception:
+            logger.exception("send alert of %s failed", digest.handler)
+
+    def _send_slack(self, digest: Digest) -> None:
+        im_id = format_slack_user_id_list(
+            [get_slack_id_by_username(username=author) for author in digest.authors]
+        )
+        if digest.kind == NOT_FOUND:
+            msg = XXL_JOB_HANDLER_NOT_FOUND.format(im_id, digest.handler)
+            if digest.count > 1:
+                msg += XXL_JOB_HANDLER_NOT_FOUND_DIGEST.format(digest.count)
+        else:
+            log_url = settings.XXL_JOB[
+                "xxl_admin_web_baseurl"
+            ] + "joblog/logDetailPage?id={}".format(digest.last_log_id)
+            if digest.count > 1:
+                msg = XXL_JOB_EXECUTE_FAIL_DIGEST_MSG.format(
+                    cron_task_name=digest.handler,
+                    count=digest.count,
+                    im_uid=im_id,
+                    log_url=log_url,
+                )
+            else:
+                msg = XXL_JOB_EXECUTE_FAIL_MSG.format(
+                    cron_task_name=digest.handler,
+                    status="失败",
+                    im_uid=im_id,
+                    log_url=log_url,
+                )
+        channel = settings.IM["slack"]["xxl-job"]["channel"]
+        send_slack_msg(channel=channel, text=msg)
@@ -1,22 +1,14 @@
 from typing import Any, Optional
-import time
+import threading
 
+from peach.xxl_job.pyxxl.error import JobCancelledError
+from peach.xxl_job.pyxxl.log_buffer import ColorDict, RunLogBuffer  # noqa: F401
 from peach.xxl_job.pyxxl.schema import RunData
 from peach.helper.global_var.global_var import GlobalVar
 
 from contextvars import ContextVar
 
 
-ColorDict = {
-    "DEBUG": "black",
-    "INFO": "green",
-    "WARNING": "blue",
-    "WARN": "blue",
-    "EXCEPTION": "red",
-    "ERROR": "red",
-}
-
-
 class GlobalVars:
     @staticmethod
     def _set_var(name: str, obj: Any) -> None:
@@ -36,34 +28,14 @@ class GlobalVars:
 
     @staticmethod
     def set_xxl_run_data(trace_id, data, append=False) -> None:
-        if append:
-            handle_log = data["handle_log"]
-            time_stamp = handle_log.created  # 以2020/10/5 10:12:56为例子
-            time_tuple = time.localtime(time_stamp)
-            data_time = (
-                f'<span style="color: {ColorDict.get(str(handle_log.levelname).upper(), "black")};">'
-                f'{time.strftime("%Y-%m-%d %H:%M:%S", time_tuple)}</span>'
-            )
-            level_name = f'<span style="color: {ColorDict.get(str(handle_log.levelname).upper(), "black")};">{str(handle_log.levelname)}</span>'
-            path_name = f'<span style="color: {ColorDict.get(str(handle_log.levelname).upper(), "black")};">{str(handle_log.name)}</span>'
-            func_name = f'<span style="color: {ColorDict.get(str(handle_log.levelname).upper(), "black")};">{str(handle_log.funcName)}</span>'
-            lineno = f'<span style="color: {ColorDict.get(str(handle_log.levelname).upper(), "black")};">{str(handle_log.lineno)}</span>'
-            xxl_kwargs = g2.xxl_run_data
-            log_id = xxl_kwargs.get("run_data", {}).get("logId", "")
-            path = (
-                path_name
-                + ", in "
-                + func_name
-                + ", line "
-                + lineno
-                + ", logId="
-                + str(log_id)
-            )
-            handle_log = f"\n{level_name} {data_time} {path}\n     {handle_log.msg}"  # type: ignore
-            old_handle_log = GlobalVars.get_xxl_run_data(trace_id).get("handle_log", "")
-            new_handle_log = old_handle_log + handle_log
-            data = {"handle_log": new_handle_log}
         raw_data = GlobalVars.get_xxl_run_data(trace_id)
+        if append:
+            # handle_log是一条日志(RunLogRecord或文本), 追加到本次执行的日志缓冲区
+            log_buffer = raw_data.get("handle_log")
+            if log_buffer is None:
+                log_buffer = RunLogBuffer()
+            log_buffer.append(data["handle_log"])
+            data = {"handle_log": log_buffer}
         raw_data.update(data)
         GlobalVars._set_var(trace_id, raw_data)
         xxl_kwargs = g2.xxl_run_data
@@ -79,6 +51,20 @@ class GlobalVars:
     def get_xxl_run_data_log_id(log_id):
         return GlobalVars._get_var(log_id)
 
+    @staticmethod
+    def get_run_log_buffer(trace_id) -> RunLogBuffer:
+        """本次执行的日志缓冲区, 不存在时创建"""
+        log_buffer = GlobalVars.get_xxl_run_data(trace_id).get("handle_log")
+        if log_buffer is None:
+            log_buffer = RunLogBuffer()
+            GlobalVars.set_xxl_run_data(trace_id, {"handle_log": log_buffer})
+        return log_buffer
+
+    @staticmethod
+    def get_run_log(log_id) -> Optional[RunLogBuffer]:
+        """执行中任务的日志缓冲区, 任务结束后返回None"""
+        return GlobalVars._get_var(log_id).get("handle_log")
+
     @staticmethod
     def delete_xxl_run_data(trace_id) -> RunData:
         return GlobalVars._delete_var(trace_id)
@@ -90,10 +76,55 @@ g = GlobalVars
 _global_vars: ContextVar[dict] = ContextVar("pyxxl_vars", default={})
 
 
+class CancelToken:
+    """同步handler的协作式取消标记
+
+    asyncio只能取消包装线程的future, 线程里的handler会一直跑下去.
+    任务超时、被kill或者被COVER_EARLY覆盖时执行器会取消这个token,
+    handler可以在循环中调用check()/sleep()及时退出, pyxxl的logger打印info/warning/error/debug日志时也会自动检查.
+
+    !!! example
+
+        ```python
+        from peach.xxl_job.pyxxl.ctx import get_cancel_token
+
+        @app.handler.register(name="sync_job")
+        def sync_job():
+            token = get_cancel_token()
+            for item in items:
+                token.check()
+                process(item)
+        ```
+    """
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self.reason = ""
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        self.reason = reason
+        self._event.set()
+
+    def check(self) -> None:
+        """已被取消时抛出JobCancelledError"""
+        if self._event.is_set():
+            raise JobCancelledError("job %s" % self.reason)
+
+    def sleep(self, seconds: float) -> None:
+        """代替time.sleep, 被取消时立即抛出JobCancelledError"""
+        self._event.wait(seconds)
+        self.check()
+
+
 class GlobalVars2:
     @staticmethod
     def _set_var(name: str, obj: Any) -> None:
-        _global_vars.get()[name] = obj
+        # 不能直接修改get()返回的字典, 未set过时拿到的是所有上下文共享的default
+        _global_vars.set({**_global_vars.get(), name: obj})
 
     @staticmethod
     def _get_var(name: str) -> Any:
@@ -114,5 +145,20 @@ class GlobalVars2:
     def xxl_run_data(self):
         return self._get_var("xxl_kwargs")
 
+    @staticmethod
+    def set_cancel_token(token: CancelToken) -> None:
+        GlobalVars2._set_var("cancel_token", token)
+
 
 g2 = GlobalVars2()
+
+
+def get_cancel_token() -> Optional[CancelToken]:
+    """当前线程中执行的同步handler的取消标记, 不在handler中时返回None"""
+    return g2.try_get("cancel_token")
+
+
+def check_cancelled() -> None:
+    token = get_cancel_token()
+    if token is not None:
+        token.check()
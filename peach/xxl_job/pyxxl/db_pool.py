@@ -0,0 +1,55 @@
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from django import db
+
+
+class DBPool:
+    """执行器专用的数据库线程池
+
+    Django ORM是同步阻塞的, 直接在事件循环里查询会卡住/beat、/run和回调,
+    所有ORM操作都要通过run丢到这个有界线程池里执行.
+    """
+
+    def __init__(self, max_workers: int = 10) -> None:
+        self.max_workers = max_workers
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+
+    def set_max_workers(self, max_workers: int) -> None:
+        """线程池第一次使用前可以调整大小"""
+        if self._thread_pool is None:
+            self.max_workers = max_workers
+
+    @property
+    def thread_pool(self) -> ThreadPoolExecutor:
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="pyxxl_db",
+            )
+        return self._thread_pool
+
+    async def run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.thread_pool, functools.partial(self._call, func, *args, **kwargs)
+        )
+
+    @staticmethod
+    def _call(func: Callable, *args: Any, **kwargs: Any) -> Any:
+        db.close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            db.close_old_connections()
+
+    def shutdown(self) -> None:
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False)
+            self._thread_pool = None
+
+
+db_pool = DBPool()
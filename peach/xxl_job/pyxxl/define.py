@@ -5,3 +5,5 @@
 
 XXL_JOB_EXECUTE_FAIL_MSG = "定时任务【{cron_task_name}】执行【{status}】,请{im_uid}查询相关执行日志, \n{log_url}"  # type: ignore
 XXL_JOB_HANDLER_NOT_FOUND = "{}, 找不到handler: {}, 请检查!"
+XXL_JOB_EXECUTE_FAIL_DIGEST_MSG = "定时任务【{cron_task_name}】最近执行失败{count}次,请{im_uid}查询相关执行日志, 最近一次: \n{log_url}"  # type: ignore
+XXL_JOB_HANDLER_NOT_FOUND_DIGEST = " (最近{}次调度)"
@@ -31,6 +31,30 @@ class JobRegisterError(Exception):
         super().__init__(message)
 
 
+class ExecutorBusyError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+        super().__init__(message)
+
+
+class JobCancelledError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+        super().__init__(message)
+
+
+class JobTimeoutError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+        super().__init__(message)
+
+
+class JobExecuteError(Exception):
+    def __init__(self, message: str) -> None:
+        self.message = message
+        super().__init__(message)
+
+
 class ClientError(Exception):
     def __init__(self, message: str) -> None:
         self.message = message
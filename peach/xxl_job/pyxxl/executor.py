@@ -6,35 +6,46 @@ import json
 import time
 import dataclasses
 import contextvars
-
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
-from typing import Any, Callable, Dict, List, Optional
+import threading
+import weakref
+
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
 from json import JSONDecodeError
 from pytz import timezone
-from asgiref.sync import sync_to_async
 from django import db
 import traceback
 
-
-import requests
-
-from peach.xxl_job.pyxxl import error
-from peach.xxl_job.pyxxl.ctx import g
-from peach.xxl_job.pyxxl.enum import executorBlockStrategy
-from peach.xxl_job.pyxxl.schema import HandlerInfo, RunData
+from peach.xxl_job.pyxxl import alert, error, metrics
+from peach.xxl_job.pyxxl.alert import AlertSender
+from peach.xxl_job.pyxxl.ctx import CancelToken, g, g2
+from peach.xxl_job.pyxxl.db_pool import db_pool
+from peach.xxl_job.pyxxl.enum import executorBlockStrategy, executorMode
+from peach.xxl_job.pyxxl.process_pool import ProcessPool
+from peach.xxl_job.pyxxl.run_store import QUEUED, RUNNING, RunStore
+from peach.xxl_job.pyxxl.schema import (
+    BulkItemResult,
+    BulkResult,
+    HandlerInfo,
+    RunData,
+)
 from peach.xxl_job.pyxxl.setting import ExecutorConfig
+from peach.xxl_job.pyxxl.shard import ShardContext
 from peach.xxl_job.pyxxl.types import DecoratedCallable
 from peach.xxl_job.pyxxl.xxl_client import XXL
 from peach.xxl_job.pyxxl import log
 from peach.xxl_job.pyxxl.log import XxlJobLogger
-from peach.sender.slack_sender.slack_sender import send_slack_msg
-from django.conf import settings
-from peach.xxl_job.pyxxl.define import XXL_JOB_EXECUTE_FAIL_MSG
-from peach.sender.slack_sender.slack_helper import (
-    get_slack_id_by_username,
-    format_slack_user_id_list,
-)
 from peach.xxl_job.pyxxl.job_info import JobInfo
 
 logger = XxlJobLogger(__name__)
@@ -43,36 +54,203 @@ logger = XxlJobLogger(__name__)
 class JobHandler:
     _handlers: Dict[str, HandlerInfo] = {}
 
+    _admin_client: Optional[XXL] = None
+
+    @classmethod
+    def set_admin_client(cls, client: Optional[XXL]) -> None:
+        """执行器启动时设置, 动态任务接口和注册、回调共用调度中心的连接池"""
+        cls._admin_client = client
+
     @classmethod
-    def dynamic_register(cls, job_info: JobInfo):
-        cookies = {"REMOTE_COOKIE": ExecutorConfig.remote_cookie}
+    def _get_admin_client(cls) -> XXL:
+        client = cls._admin_client
+        if (
+            client is None
+            or client.session.closed
+            or client.loop is not asyncio.get_running_loop()
+        ):
+            # 不在执行器进程中调用时, 当前事件循环单独创建一个
+            config = ExecutorConfig()
+            client = XXL(
+                config.xxl_admin_k8s_baseurl + "api/",
+                token=config.access_token,
+                remote_cookie=config.remote_cookie,
+                pool_size=int(config.admin_pool_size),
+                keepalive_timeout=float(config.admin_keepalive_timeout),
+                timeout=float(config.admin_timeout),
+                retry_times=3,
+            )
+            cls._admin_client = client
+        return client
+
+    @staticmethod
+    def _job_info_payload(job_info: JobInfo) -> Dict[str, Any]:
         if type(job_info.executorHandler) != str:
             handler = job_info.executorHandler.__class__(job_info.executorHandler)
             handler_name = handler.value  # type: ignore
             job_info.executorHandler = handler_name
-        job_info = dataclasses.asdict(job_info)
-        res = requests.post(
-            url=ExecutorConfig().xxl_admin_k8s_baseurl + "jobinfo/add_by_dynamic/",
-            data=job_info,
-            cookies=cookies,
+        return dataclasses.asdict(job_info)
+
+    @classmethod
+    def dynamic_register(cls, job_info: JobInfo) -> Dict[str, Any]:
+        """adynamic_register的同步版本, 不能在事件循环中调用"""
+        return cls._run_sync(lambda: cls.adynamic_register(job_info))
+
+    @classmethod
+    def cancel_dynamic_task(cls, unique_key: str) -> Dict[str, Any]:
+        """acancel_dynamic_task的同步版本, 不能在事件循环中调用"""
+        return cls._run_sync(lambda: cls.acancel_dynamic_task(unique_key))
+
+    @classmethod
+    async def adynamic_register(cls, job_info: JobInfo) -> Dict[str, Any]:
+        """dynamic_register的异步版本, 使用调度中心客户端的连接池"""
+        return await cls._get_admin_client().dynamic_register(
+            cls._job_info_payload(job_info)
+        )
+
+    @classmethod
+    async def acancel_dynamic_task(cls, unique_key: str) -> Dict[str, Any]:
+        """cancel_dynamic_task的异步版本"""
+        return await cls._get_admin_client().cancel_dynamic_task(unique_key)
+
+    @classmethod
+    async def abulk_dynamic_register(
+        cls, job_infos: Iterable[JobInfo], concurrency: int = 20
+    ) -> BulkResult:
+        """批量动态添加任务
+
+        job_infos可以是生成器, 边读取边提交, 同时最多concurrency个请求在途,
+        返回每个任务的结果(和输入顺序一致)以及耗时/吞吐量
+        """
+        client = cls._get_admin_client()
+        return await cls._bulk(
+            (
+                (job_info.uniqueKey, cls._job_info_payload(job_info))
+                for job_info in job_infos
+            ),
+            client.dynamic_register,
+            concurrency,
         )
-        return json.loads(res.text)
 
     @classmethod
-    def cancel_dynamic_task(cls, unique_key):
-        cookies = {"REMOTE_COOKIE": ExecutorConfig.remote_cookie}
-        data = {"uniqueKey": unique_key}
-        res = requests.post(
-            url=ExecutorConfig().xxl_admin_k8s_baseurl + "jobinfo/dynamic_task/cancel/",
-            data=data,
-            cookies=cookies,
+    async def abulk_cancel_dynamic_task(
+        cls, unique_keys: Iterable[str], concurrency: int = 20
+    ) -> BulkResult:
+        """批量取消动态添加的任务"""
+        client = cls._get_admin_client()
+        return await cls._bulk(
+            ((key, key) for key in unique_keys), client.cancel_dynamic_task, concurrency
         )
-        return json.loads(res.text)
+
+    @classmethod
+    def bulk_dynamic_register(
+        cls, job_infos: Iterable[JobInfo], concurrency: int = 20
+    ) -> BulkResult:
+        """abulk_dynamic_register的同步版本, 不能在事件循环中调用"""
+        return cls._run_sync(lambda: cls.abulk_dynamic_register(job_infos, concurrency))
+
+    @classmethod
+    def bulk_cancel_dynamic_task(
+        cls, unique_keys: Iterable[str], concurrency: int = 20
+    ) -> BulkResult:
+        """abulk_cancel_dynamic_task的同步版本, 不能在事件循环中调用"""
+        return cls._run_sync(
+            lambda: cls.abulk_cancel_dynamic_task(unique_keys, concurrency)
+        )
+
+    @classmethod
+    def _run_sync(cls, coro_func: Callable[[], Awaitable[Any]]) -> Any:
+        """在调用线程中等待异步接口的结果
+
+        执行器进程中(同步任务在线程池里执行)提交到执行器的事件循环, 和注册、回调共用连接池;
+        其他进程(如web)用asyncio.run临时创建客户端, 结束时关闭
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError(
+                "sync admin api can not be called in event loop, use the async version."
+            )
+        client = cls._admin_client
+        if (
+            client is not None
+            and not client.session.closed
+            and client.loop.is_running()
+        ):
+            return asyncio.run_coroutine_threadsafe(coro_func(), client.loop).result()
+        return asyncio.run(cls._run_with_admin_client(coro_func()))
+
+    @classmethod
+    async def _run_with_admin_client(cls, coro: Awaitable[Any]) -> Any:
+        # asyncio.run的事件循环结束前关闭临时创建的客户端
+        try:
+            return await coro
+        finally:
+            client = cls._admin_client
+            if client is not None and client.loop is asyncio.get_running_loop():
+                await client.session.close()
+                cls._admin_client = None
+
+    @staticmethod
+    async def _bulk(
+        items: Iterable[Tuple[str, Any]],
+        func: Callable[[Any], Awaitable[Dict[str, Any]]],
+        concurrency: int,
+    ) -> BulkResult:
+        started = time.monotonic()
+        results: List[BulkItemResult] = []
+        iterator = enumerate(items)
+
+        async def _worker() -> None:
+            # 多个worker共用一个迭代器, 输入不会一次性读进内存
+            for index, (key, payload) in iterator:
+                try:
+                    response = await func(payload)
+                    ok = isinstance(response, dict) and response.get("code") == 200
+                    results.append(BulkItemResult(index, key, ok, response=response))
+                except (error.ClientError, error.XXLRegisterError) as e:
+                    results.append(BulkItemResult(index, key, False, error=e.message))
+                except Exception as e:
+                    # 响应不是json、payload无法序列化等, 只影响这一条, 其他的继续执行
+                    results.append(BulkItemResult(index, key, False, error=repr(e)))
+
+        await asyncio.gather(*(_worker() for _ in range(max(concurrency, 1))))
+        results.sort(key=lambda r: r.index)
+        result = BulkResult(results=results, elapsed=time.monotonic() - started)
+        logger.info(
+            "bulk {} finished: total={} succeeded={} failed={} elapsed={:.3f}s throughput={:.1f}/s".format(
+                getattr(func, "__name__", func),
+                result.total,
+                result.succeeded,
+                len(result.failed),
+                result.elapsed,
+                result.throughput,
+            )
+        )
+        return result
 
     def register(
-        self, *args: Any, name: Optional[str] = None, replace: bool = False
+        self,
+        *args: Any,
+        name: Optional[str] = None,
+        replace: bool = False,
+        sharded: bool = False,
+        executor: str = executorMode.THREAD.value,
+        max_concurrency: int = 1,
     ) -> Callable[[DecoratedCallable], DecoratedCallable]:
-        """将函数注册到可执行的job中,如果其他地方要调用该方法,replace修改为True"""
+        """将函数注册到可执行的job中,如果其他地方要调用该方法,replace修改为True
+
+        sharded为True时, 函数会收到ShardContext参数, 可以按分片广播的序号处理数据,
+        并用ShardContext.map把当前分片再拆到线程池/进程池中并行执行
+
+        executor为"process"时, 函数在执行器预先fork的子进程中执行, 不受GIL限制,
+        适合CPU密集的任务, 超时或被取消时子进程会被kill掉
+
+        max_concurrency是单个执行器上同一个jobId同时执行的任务数上限, 超过后按阻塞策略处理
+        """
+        executor = executorMode(executor).value
 
         def func_wrapper(func: DecoratedCallable) -> DecoratedCallable:
             handler_name = name or func.__name__
@@ -83,10 +261,15 @@ class JobHandler:
                 raise error.JobRegisterError(
                     "handler %s already registered." % handler_name
                 )
-            self._handlers[handler_name] = HandlerInfo(handler=func)
+            self._handlers[handler_name] = HandlerInfo(
+                handler=func,
+                sharded=sharded,
+                executor=executor,
+                max_concurrency=max(max_concurrency, 1),
+            )
             logger.info(
-                "register job {},is async: {}".format(
-                    handler_name, asyncio.iscoroutinefunction(func)
+                "register job {},is async: {}, sharded: {}, executor: {}".format(
+                    handler_name, asyncio.iscoroutinefunction(func), sharded, executor
                 )
             )
 
@@ -133,36 +316,79 @@ class Executor:
 
         self.handler: JobHandler = handler or JobHandler()
         self.loop = loop or asyncio.get_event_loop()
-        self.tasks: Dict[int, asyncio.Task] = {}
-        self.queue: Dict[int, List[RunData]] = defaultdict(list)
-        self.lock = asyncio.Lock()
+        # jobId -> {logId: task}
+        self.tasks: Dict[int, Dict[int, asyncio.Task]] = {}
+        self.running_count = 0
+        self.queue: Dict[int, Deque[RunData]] = defaultdict(deque)
+        # 没有协程持有或者等待时自动回收, 不会随着jobId的增加一直增长
+        self.locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = (
+            weakref.WeakValueDictionary()
+        )
         self.thread_pool = ThreadPoolExecutor(
             max_workers=self.config.max_workers,
             thread_name_prefix="pyxxl_pool",
         )
+        self.shard_pool = ThreadPoolExecutor(
+            max_workers=int(self.config.shard_max_workers),
+            thread_name_prefix="pyxxl_shard",
+        )
+        self._shard_process_pool: Optional[ProcessPoolExecutor] = None
+        self.zombies: Dict[int, float] = {}
+        self.queued_at: Dict[int, float] = {}
+        self.thread_busy = 0
+        """线程池中正在执行的同步任务数(包括僵尸线程)"""
+        self._busy_lock = threading.Lock()
+        self.process_pool = ProcessPool(int(self.config.process_workers))
+        if any(h.is_process for h in self.handler._handlers.values()):
+            self.process_pool.start()
+        db_pool.set_max_workers(self.config.db_max_workers)
+        self.alert_sender = AlertSender(
+            window=float(self.config.alert_window),
+            min_interval=float(self.config.alert_min_interval),
+        )
+        self.run_store: Optional[RunStore] = None
+        if self.config.run_store_path:
+            self.run_store = RunStore(self.config.run_store_path)
 
     async def shutdown(self) -> None:
-        for _, task in self.tasks.items():
+        for task in self._all_tasks():
             task.cancel()
+        self.shard_pool.shutdown(wait=False)
+        self.process_pool.shutdown()
+        if self._shard_process_pool is not None:
+            self._shard_process_pool.shutdown(wait=False)
+
+    def _get_shard_process_pool(self) -> ProcessPoolExecutor:
+        if self._shard_process_pool is None:
+            self._shard_process_pool = ProcessPoolExecutor(
+                max_workers=int(self.config.shard_process_workers)
+            )
+        return self._shard_process_pool
 
     async def run_job(self, run_data: RunData) -> None:
         handler_obj = self.handler.get(run_data.executorHandler)
         if not handler_obj:
             logger.warning("handler %s not found." % run_data.executorHandler)
+            metrics.RUN_REQUESTS.inc(
+                handler=run_data.executorHandler, result="not_found"
+            )
             raise error.JobNotFoundError(
                 "handler %s not found." % run_data.executorHandler
             )
 
-        # 一个执行器同时只能执行一个jobId相同的任务
-        async with self.lock:
-            current_task = self.tasks.get(run_data.jobId)
-            if current_task:
+        # 每个jobId一把锁, 同一个jobId同时执行的任务数不超过handler的max_concurrency
+        async with self._lock(run_data.jobId):
+            running = self.tasks.get(run_data.jobId, {})
+            if len(running) >= handler_obj.max_concurrency:
                 # 不用的阻塞策略
                 # pylint: disable=no-else-raise
                 if (
                     run_data.executorBlockStrategy
                     == executorBlockStrategy.DISCARD_LATER.value
                 ):
+                    metrics.RUN_REQUESTS.inc(
+                        handler=run_data.executorHandler, result="discarded"
+                    )
                     raise error.JobDuplicateError(
                         "The same job [%s] is already executing and this has been discarded."
                         % run_data.jobId
@@ -182,7 +408,8 @@ class Executor:
                     == executorBlockStrategy.SERIAL_EXECUTION.value
                 ):
 
-                    if len(self.queue[run_data.jobId]) >= self.config.task_queue_length:
+                    queue = self.queue[run_data.jobId]
+                    if len(queue) >= self.config.task_queue_length:
                         msg = (
                             "job {job_id} is  SERIAL, queue length more than {max_length}."
                             "logId {log_id}  discard!".format(
@@ -192,9 +419,11 @@ class Executor:
                             )
                         )
                         logger.error(msg)
+                        metrics.RUN_REQUESTS.inc(
+                            handler=run_data.executorHandler, result="discarded"
+                        )
                         raise error.JobDuplicateError(msg)
                     else:
-                        queue = self.queue[run_data.jobId]
                         logger.info(
                             "job {job_id} is in queen, logId {log_id} ranked {ranked}th [max={max_length}]...".format(
                                 job_id=run_data.jobId,
@@ -204,6 +433,14 @@ class Executor:
                             )
                         )
                         queue.append(run_data)
+                        self.queued_at[run_data.logId] = time.monotonic()
+                        metrics.RUN_REQUESTS.inc(
+                            handler=run_data.executorHandler, result="queued"
+                        )
+                        if self.run_store is not None:
+                            await self.run_store.put(
+                                run_data, QUEUED, int(time.time_ns() / 1000000)
+                            )
                         return
                 else:
                     raise error.JobParamsError(
@@ -211,35 +448,114 @@ class Executor:
                         % run_data.executorBlockStrategy,
                         executorBlockStrategy=run_data.executorBlockStrategy,
                     )
-            # 使用time.time_ns()而不是time.time(),因为使用time.time()会丢失ms精度
-            start_time = int(time.time_ns() / 1000000)
-            task = self.loop.create_task(self._run(handler_obj, start_time, run_data))
-            self.tasks[run_data.jobId] = task
+            # 全局准入限制, 执行中的任务数不超过max_workers, 让调度中心故障转移到其他执行器
+            if self.running_count >= int(self.config.max_workers):
+                msg = "executor is busy, {} jobs running, logId {} discard!".format(
+                    self.running_count, run_data.logId
+                )
+                logger.error(msg)
+                metrics.RUN_REQUESTS.inc(
+                    handler=run_data.executorHandler, result="busy"
+                )
+                raise error.ExecutorBusyError(msg)
+            metrics.RUN_REQUESTS.inc(handler=run_data.executorHandler, result="started")
+            write = self._start(handler_obj, run_data)
+            if write is not None:
+                await write
+
+    def _lock(self, job_id: int) -> asyncio.Lock:
+        lock = self.locks.get(job_id)
+        if lock is None:
+            lock = self.locks[job_id] = asyncio.Lock()
+        return lock
+
+    def _start(
+        self, handler: HandlerInfo, run_data: RunData
+    ) -> "Optional[asyncio.Future[None]]":
+        """启动任务, 返回持久化写入的Future, 由调用方在更新完状态后await"""
+        # 使用time.time_ns()而不是time.time(),因为使用time.time()会丢失ms精度
+        start_time = int(time.time_ns() / 1000000)
+        write = None
+        if self.run_store is not None:
+            # 先提交写入, 写线程按提交顺序执行, 不会晚于任务结束时的删除
+            write = self.run_store.put(run_data, RUNNING, start_time)
+        task = self.loop.create_task(self._run(handler, start_time, run_data))
+        self.tasks.setdefault(run_data.jobId, {})[run_data.logId] = task
+        self.running_count += 1
+        return write
+
+    def _pop_task(
+        self, job_id: int, log_id: int
+    ) -> "Tuple[Optional[asyncio.Task], Optional[asyncio.Future[None]]]":
+        """移除执行中的任务, 返回任务和持久化删除的Future"""
+        running = self.tasks.get(job_id)
+        task = running.pop(log_id, None) if running else None
+        write = None
+        if task is not None:
+            self.running_count -= 1
+            if self.run_store is not None:
+                write = self.run_store.remove(log_id)
+        if running is not None and not running:
+            self.tasks.pop(job_id, None)
+        return task, write
+
+    async def recover(self) -> None:
+        """执行器启动时重放持久化队列中上次没有执行完的任务
+
+        排队中的任务重新提交, 执行中的任务已经被中断, 回调执行失败
+        """
+        if self.run_store is None:
+            return
+        for status, start_time, run_data in self.run_store.load():
+            if status == RUNNING:
+                msg = (
+                    "Executor restarted while job was running, logId {} failed.".format(
+                        run_data.logId
+                    )
+                )
+            else:
+                try:
+                    await self.run_job(run_data)
+                    logger.info(
+                        "jobId={} logId={} recovered from run store".format(
+                            run_data.jobId, run_data.logId
+                        )
+                    )
+                    continue
+                except (
+                    error.JobNotFoundError,
+                    error.JobDuplicateError,
+                    error.JobParamsError,
+                    error.ExecutorBusyError,
+                ) as e:
+                    msg = "Executor restarted and job can not resume: {}".format(
+                        e.message
+                    )
+            logger.warning(msg)
+            await self.run_store.remove(run_data.logId)
+            await self.xxl_client.callback(
+                run_data.logId, start_time, code=500, msg=msg
+            )
 
     async def cancel_job(self, job_id: int) -> None:
-        async with self.lock:
+        async with self._lock(job_id):
             await self._cancel(job_id)
 
     async def is_running(self, job_id: int) -> bool:
-        return job_id in self.tasks
-
-    async def _send_slack_msg(self, msg):
-        channel = settings.IM["slack"]["xxl-job"]["channel"]
-        await sync_to_async(send_slack_msg)(channel=channel, text=msg)
-
-    async def _prepare_slack_msg(self, handler, author, log_id):
-        log_url = settings.XXL_JOB[
-            "xxl_admin_web_baseurl"
-        ] + "joblog/logDetailPage?id={}".format(log_id)
-        im_id = await sync_to_async(get_slack_id_by_username)(username=author)
-        format_im_id = format_slack_user_id_list([im_id])
-        msg = XXL_JOB_EXECUTE_FAIL_MSG.format(
-            cron_task_name=handler, status="失败", im_uid=format_im_id, log_url=log_url
-        )
-        return msg
+        return bool(self.tasks.get(job_id))
 
     async def _run(self, handler: HandlerInfo, start_time: int, data: RunData) -> None:
         handle_time = datetime.datetime.now(tz=timezone("Asia/Shanghai"))
+        # 串行队列中的任务由上一个任务的协程拉起, 需要重新绑定本次执行的上下文
+        g2.set_xxl_run_data(
+            {"trace_id": data.traceID, "run_data": dataclasses.asdict(data)}
+        )
+        run_log_handler = log.RunLogHandler(
+            data.traceID,
+            g.get_run_log_buffer(data.traceID),
+            self.config.capture_logging,
+        )
+        run_log_handler.attach()
         try:
             db.close_old_connections()
             task_status = True
@@ -256,26 +572,32 @@ class Executor:
                     start_job, data.jobId, data.logId, format_data
                 ),
             )
-            context = contextvars.copy_context()
-            func = (
-                handler.handler()
-                if handler.is_async
-                else self.loop.run_in_executor(
-                    self.thread_pool,
-                    context.run,
-                    handler.handler,
+            args = ()
+            if handler.sharded and not handler.is_process:
+                args = (
+                    ShardContext.from_run_data(
+                        data, self.shard_pool, self._get_shard_process_pool
+                    ),
                 )
-            )
+            timeout = data.executorTimeout or self.config.task_timeout
+            # 取消标记只放在同步handler的上下文中, 当前协程里的日志不受影响
+            cancel_token = CancelToken()
+            context = contextvars.copy_context()
+            context.run(g2.set_cancel_token, cancel_token)
+            if handler.is_process:
+                func = self._run_in_process(data, timeout, context, cancel_token)
+            elif handler.is_async:
+                func = handler.handler(*args)
+            else:
+                func = self._submit(data, context, cancel_token, handler.handler, *args)
             handle_time = datetime.datetime.now(tz=timezone("Asia/Shanghai"))
             await log.update_xxl_job_handle_time(data.logId, handle_time)
-            result = await asyncio.wait_for(
-                func, data.executorTimeout or self.config.task_timeout
-            )
+            result = await asyncio.wait_for(func, timeout)
             finish_job = '<span style="color: red;">Job finished</span>'
             logger.info(
                 f"{finish_job} jobId={data.jobId} logId={data.logId}",
             )
-            await self._finish(data.jobId)
+            await self._finish(data.jobId, data.logId)
             logger.info(
                 f"jobId={data.jobId}, logId={data.logId} has been removed from tasks"
             )
@@ -316,51 +638,191 @@ class Executor:
             await self.xxl_client.callback(data.logId, start_time, code=500, msg=msg)
         finally:
             db.close_old_connections()
-            await self._finish(data.jobId)
+            await self._finish(data.jobId, data.logId)
             handle_duration = (
                 time.time() * 1000 - handle_time.timestamp() * 1000
             ) / 1000
+            metrics.RUN_DURATION.observe(handle_duration, handler=data.executorHandler)
+            metrics.RUNS_FINISHED.inc(
+                handler=data.executorHandler,
+                status="success" if task_status else "failed",
+            )
             handle_duration = format(handle_duration, ".4f")
-            await log.update_xxl_job_log(data.traceID, data.logId, handle_duration)
+            try:
+                await log.update_xxl_job_log(data.traceID, data.logId, handle_duration)
+            finally:
+                run_log_handler.detach()
             g.delete_xxl_run_data(data.traceID)
             g.delete_xxl_run_data(data.logId)
             if task_status:
                 if data.dynamicAdd == 1:
                     await log.delte_xxl_job_info(data.jobId)
             else:
-                msg = await self._prepare_slack_msg(
-                    data.executorHandler, data.author, data.logId
+                self.alert_sender.put(
+                    alert.FAILED, data.executorHandler, data.author, data.logId
                 )
-                await self._send_slack_msg(msg)
 
-    async def _finish(self, job_id: int) -> None:
-        self.tasks.pop(job_id, None)
-        # 如果有队列中的任务，开始执行队列中的任务
-        queue = self.queue[job_id]
+    def _run_in_process(
+        self,
+        data: RunData,
+        timeout: int,
+        context: contextvars.Context,
+        cancel_token: CancelToken,
+    ) -> asyncio.Future:
+        """在进程池中执行, 等待结果的线程会把子进程的日志写回本次执行的日志缓冲区"""
+        self.process_pool.start()
+        run_ctx = {
+            "xxl_kwargs": data,
+            "run_data": g2.xxl_run_data.get("run_data"),
+            "capture_logging": self.config.capture_logging,
+        }
+        return self._submit(
+            data,
+            context,
+            cancel_token,
+            self.process_pool.run,
+            data.executorHandler,
+            run_ctx,
+            g.get_run_log_buffer(data.traceID),
+            timeout,
+            cancel_token,
+        )
+
+    def _submit(
+        self,
+        data: RunData,
+        context: contextvars.Context,
+        cancel_token: CancelToken,
+        func: Callable,
+        *args: Any,
+    ) -> asyncio.Future:
+        """提交到线程池执行
+
+        asyncio层面超时或者被取消时取消cancel_token, 线程没有及时退出的话记为僵尸线程,
+        直到线程真正结束
+        """
+        concurrent_future = self.thread_pool.submit(context.run, func, *args)
+        with self._busy_lock:
+            self.thread_busy += 1
+        concurrent_future.add_done_callback(self._thread_done)
+        future = asyncio.wrap_future(concurrent_future, loop=self.loop)
+
+        def _on_cancelled(f: asyncio.Future) -> None:
+            if not f.cancelled():
+                return
+            cancel_token.cancel(
+                "jobId={} logId={} cancelled".format(data.jobId, data.logId)
+            )
+            if concurrent_future.done():
+                return
+            self.zombies[data.logId] = time.monotonic()
+            logger.warning(
+                "jobId={} logId={} is still running in thread after cancelled, zombie threads: {}".format(
+                    data.jobId, data.logId, len(self.zombies)
+                )
+            )
+            concurrent_future.add_done_callback(lambda _: self._zombie_exit(data))
+
+        future.add_done_callback(_on_cancelled)
+        return future
+
+    def _thread_done(self, _: Any) -> None:
+        with self._busy_lock:
+            self.thread_busy -= 1
+
+    def _zombie_exit(self, data: RunData) -> None:
+        started = self.zombies.pop(data.logId, None)
+        if started is not None:
+            logger.warning(
+                "zombie thread of jobId={} logId={} exited after {:.3f}s, zombie threads: {}".format(
+                    data.jobId,
+                    data.logId,
+                    time.monotonic() - started,
+                    len(self.zombies),
+                )
+            )
+
+    def collect_metrics(self) -> None:
+        """/metrics被抓取时更新执行器的各项指标"""
+        metrics.RUNNING_JOBS.set(self.running_count)
+        depths = [len(queue) for queue in self.queue.values()]
+        metrics.QUEUED_JOBS.set(sum(depths))
+        metrics.MAX_QUEUE_DEPTH.set(max(depths, default=0))
+        metrics.MAX_WORKERS.set(int(self.config.max_workers))
+        metrics.THREAD_POOL_BUSY.set(self.thread_busy)
+        metrics.ZOMBIE_THREADS.set(self.zombie_count)
+        metrics.PROCESS_KILLED.set(self.process_pool.killed)
+        metrics.ALERT_DROPPED.set(self.alert_sender.dropped)
+
+    @property
+    def zombie_count(self) -> int:
+        """已经被取消但线程还没有退出的任务数量"""
+        return len(self.zombies)
+
+    async def _finish(self, job_id: int, log_id: int) -> None:
+        # 先更新状态并拉起队列中的任务, 最后才await持久化写入, 中间不让出事件循环, 不需要加锁;
+        # 成功和finally中都会调用, 第二次调用时不会重复拉起队列中的任务
+        _, write = self._pop_task(job_id, log_id)
+        writes = [write]
+        # 如果有队列中的任务且没有达到并发上限，开始执行队列中的任务
+        queue = self.queue.get(job_id)
         if queue:
-            kwargs: RunData = queue.pop(0)
+            self._start_queued(job_id, queue, writes)
+        await asyncio.gather(*(w for w in writes if w is not None))
+
+    def _start_queued(
+        self,
+        job_id: int,
+        queue: "Deque[RunData]",
+        writes: "List[Optional[asyncio.Future[None]]]",
+    ) -> None:
+        handler_obj = self.handler.get(queue[0].executorHandler)
+        max_concurrency = handler_obj.max_concurrency if handler_obj else 1
+        while queue and len(self.tasks.get(job_id, {})) < max_concurrency:
+            run_data: RunData = queue.popleft()
+            queued_at = self.queued_at.pop(run_data.logId, None)
+            if queued_at is not None:
+                metrics.QUEUE_WAIT.observe(
+                    time.monotonic() - queued_at, handler=run_data.executorHandler
+                )
             logger.info(
                 "JobId {} in queue[{}], start job with logId {}".format(
-                    kwargs.jobId, len(queue), kwargs.logId
+                    run_data.jobId, len(queue), run_data.logId
                 )
             )
-            await self.run_job(kwargs)
+            handler_obj = self.handler.get(run_data.executorHandler)
+            if handler_obj is None:
+                logger.warning("handler %s not found." % run_data.executorHandler)
+                if self.run_store is not None:
+                    writes.append(self.run_store.remove(run_data.logId))
+                continue
+            writes.append(self._start(handler_obj, run_data))
+        if not queue:
+            self.queue.pop(job_id, None)
 
     async def _cancel(self, job_id: int) -> None:
-        task = self.tasks.pop(job_id, None)
-        if task:
+        running = self.tasks.get(job_id, {})
+        for log_id in list(running):
+            task, write = self._pop_task(job_id, log_id)
+            if task is None:
+                continue
             task.cancel()
             try:
                 await task
             except asyncio.CancelledError:
                 logger.warning("Job %s cancelled." % job_id)
+            if write is not None:
+                await write
+
+    def _all_tasks(self) -> List[asyncio.Task]:
+        return [task for running in self.tasks.values() for task in running.values()]
 
     async def graceful_close(self, timeout: int = 60) -> None:
         """优雅关闭"""
 
         async def _graceful_close() -> None:
-            while len(self.tasks) > 0:
-                await asyncio.wait(self.tasks.values())
+            while self.tasks:
+                await asyncio.wait(self._all_tasks())
 
         await asyncio.wait_for(_graceful_close(), timeout=timeout)
 
@@ -3,10 +3,11 @@
 
 
 import logging
-import sys
-import os
 
 from peach.helper.singleton.singleton import singleton_decorator
+from peach.xxl_job.pyxxl.ctx import check_cancelled, g, g2
+from peach.xxl_job.pyxxl.db_pool import db_pool
+from peach.xxl_job.pyxxl.log_buffer import RunLogRecord
 from peach.xxl_job.pyxxl.model import XxlJobLog, XxlJobInfo  # type: ignore
 import pytz
 from django.conf import settings
@@ -14,8 +15,6 @@ from django.conf import settings
 print(settings.SETTINGS_MODULE)
 
 
-_srcfile = os.path.normcase(logging.addLevelName.__code__.co_filename)
-
 CRITICAL = 50
 FATAL = CRITICAL
 ERROR = 40
@@ -40,6 +39,56 @@ NOTSET = 0
 #         return True
 
 
+class RunLogHandler(logging.Handler):
+    """一次任务执行的日志handler, 任务开始时挂到root logger上, 结束时移除
+
+    只处理当前上下文属于这次执行(trace_id相同)的日志, 保存RunLogRecord(级别、时间、位置和格式化后的消息),
+    读取日志或者写入数据库时才渲染成HTML. capture_logging为False时只记录XxlJobLogger的日志,
+    为True时handler中logging.getLogger()打印的日志也会记录到任务日志里.
+    """
+
+    def __init__(
+        self, trace_id: str, log_buffer, capture_logging: bool = False
+    ) -> None:
+        super().__init__()
+        self.trace_id = trace_id
+        self.log_buffer = log_buffer
+        self.capture_logging = capture_logging
+
+    def attach(self) -> None:
+        logging.getLogger().addHandler(self)
+
+    def detach(self) -> None:
+        logging.getLogger().removeHandler(self)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # 在加锁之前过滤掉其他任务和不需要记录的日志
+        if (g2.xxl_run_data or {}).get("trace_id") != self.trace_id:
+            return False
+        if not self.capture_logging and record.name not in _xxl_logger_names:
+            return False
+        return super().filter(record)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        log_id = (g2.xxl_run_data or {}).get("run_data", {}).get("logId", "")
+        self.log_buffer.append(
+            RunLogRecord(
+                record.levelname,
+                record.name,
+                record.funcName,
+                record.lineno,
+                log_id,
+                getattr(record, "run_msg", record.msg),
+                record.args,
+                record.created,
+            )
+        )
+
+
+# XxlJobLogger对应的标准logger名称, capture_logging为False时RunLogHandler只记录这些logger的日志
+_xxl_logger_names = set()
+
+
 @singleton_decorator
 class XxlJobLogger(logging.Logger):
     def __init__(self, name):
@@ -50,41 +99,23 @@ class XxlJobLogger(logging.Logger):
         self.logger.setLevel(INFO)
         # self.logger.filters = [XxlJobFilter()]
         super().__init__(name, INFO)
+        _xxl_logger_names.add(name)
 
-    def _log(
-        self,
-        level,
-        msg,
-        args,
-        exc_info=None,
-        extra=None,
-        stack_info=False,
-        stacklevel=1,
-    ):
+    def _emit(self, level, msg, args, kwargs):
         """
-        Low-level logging routine which creates a LogRecord and then calls
-        all the handlers of this logger to handle the record.
+        先按级别过滤, 再通过标准logging打印, 当前任务的RunLogHandler把日志记录到任务日志里
         """
-        sinfo = None
-        if _srcfile:
-            # IronPython doesn't track Python frames, so findCaller raises an
-            # exception on some versions of IronPython. We trap it here so that
-            # IronPython can use logging.
-            try:
-                fn, lno, func, sinfo = self.findCaller(stack_info, stacklevel)
-            except ValueError:  # pragma: no cover
-                fn, lno, func = "(unknown file)", 0, "(unknown function)"
-        else:  # pragma: no cover
-            fn, lno, func = "(unknown file)", 0, "(unknown function)"
-        if exc_info:
-            if isinstance(exc_info, BaseException):
-                exc_info = (type(exc_info), exc_info, exc_info.__traceback__)
-            elif not isinstance(exc_info, tuple):
-                exc_info = sys.exc_info()
-        record = self.makeRecord(
-            self.name, level, fn, lno, msg, args, exc_info, func, extra, sinfo
-        )
-        return record
+        if not self.logger.isEnabledFor(level):
+            return
+        kwargs.pop("trace_id", None)
+        log_id = (g2.xxl_run_data or {}).get("run_data", {}).get("logId", "")
+        if log_id:
+            # 控制台的日志带上logId, 任务日志里保留原始的msg
+            kwargs["extra"] = dict(kwargs.get("extra") or {}, run_msg=msg)
+            msg = "logId: " + str(log_id) + "\n" + str(msg)
+        # 1: _emit, 2: info/warning/..., 3: 调用方
+        kwargs["stacklevel"] = kwargs.get("stacklevel", 1) + 2
+        self.logger.log(level, msg, *args, **kwargs)
 
     @staticmethod
     def getLogger(name):
@@ -102,96 +133,49 @@ class XxlJobLogger(logging.Logger):
     #     return True
 
     def info(self, msg, *args, **kwargs):
-        from peach.xxl_job.pyxxl.ctx import g, g2
-
-        xxl_kwargs = g2.xxl_run_data
-        trace_id = xxl_kwargs.get("trace_id", None)
-        kwargs.pop("trace_id", None)
-        if trace_id:
-            g.set_xxl_run_data(
-                trace_id,
-                {"handle_log": self._log(INFO, msg, args, **kwargs)},
-                append=True,
-            )
-        log_id = xxl_kwargs.get("run_data", {}).get("logId", "")
-        if log_id:
-            msg = "logId: " + str(log_id) + "\n" + msg
-        self.logger.info(msg, *args, **kwargs)
+        check_cancelled()
+        self._emit(INFO, msg, args, kwargs)
 
     def warning(self, msg, *args, **kwargs):
-        from peach.xxl_job.pyxxl.ctx import g, g2
-
-        xxl_kwargs = g2.xxl_run_data
-        trace_id = xxl_kwargs.get("trace_id", None)
-        kwargs.pop("trace_id", None)
-        if trace_id:
-            g.set_xxl_run_data(
-                trace_id,
-                {"handle_log": self._log(WARNING, msg, args, **kwargs)},
-                append=True,
-            )
-        log_id = xxl_kwargs.get("run_data", {}).get("logId", "")
-        if log_id:
-            msg = "logId: " + str(log_id) + "\n" + msg
-        self.logger.warning(msg, *args, **kwargs)
+        check_cancelled()
+        self._emit(WARNING, msg, args, kwargs)
 
     def warn(self, msg, *args, **kwargs):
-        self.warning(msg, *args, **kwargs)
+        check_cancelled()
+        self._emit(WARNING, msg, args, kwargs)
 
     def error(self, msg, *args, **kwargs):
-        from peach.xxl_job.pyxxl.ctx import g, g2
-
-        xxl_kwargs = g2.xxl_run_data
-        trace_id = xxl_kwargs.get("trace_id", None)
-        kwargs.pop("trace_id", None)
-        if trace_id:
-            g.set_xxl_run_data(
-                trace_id,
-                {"handle_log": self._log(ERROR, msg, args, **kwargs)},
-                append=True,
-            )
-        log_id = xxl_kwargs.get("run_data", {}).get("logId", "")
-        if log_id:
-            msg = "logId: " + str(log_id) + "\n" + msg
-        self.logger.error(msg, *args, **kwargs)
+        check_cancelled()
+        self._emit(ERROR, msg, args, kwargs)
 
     def exception(self, msg, *args, **kwargs):
-        self.error(msg, *args, exc_info=True, **kwargs)
+        kwargs.setdefault("exc_info", True)
+        self._emit(ERROR, msg, args, kwargs)
 
-    def debug(self, msg, *args, **kwargs):
-        from peach.xxl_job.pyxxl.ctx import g, g2
+    def critical(self, msg, *args, **kwargs):
+        self._emit(CRITICAL, msg, args, kwargs)
 
-        xxl_kwargs = g2.xxl_run_data
-        trace_id = xxl_kwargs.get("trace_id", None)
-        kwargs.pop("trace_id", None)
-        if trace_id:
-            g.set_xxl_run_data(
-                trace_id,
-                {"handle_log": self._log(DEBUG, msg, args, **kwargs)},
-                append=True,
-            )
-        log_id = xxl_kwargs.get("run_data", {}).get("logId", "")
-        if log_id:
-            msg = "logId: " + str(log_id) + "\n" + msg
-        self.logger.debug(msg, *args, **kwargs)
+    fatal = critical
 
+    def log(self, level, msg, *args, **kwargs):
+        self._emit(level, msg, args, kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        check_cancelled()
+        self._emit(DEBUG, msg, args, kwargs)
 
-async def prepare_handle_log(trace_id, id, handle_duration):
-    from peach.xxl_job.pyxxl.ctx import g
 
+async def prepare_handle_log(trace_id, id, handle_duration):
     data = g.get_xxl_run_data(trace_id=trace_id)
-    handle_log = data.get("handle_log")
-    if len(handle_log) > 50000:
-        handle_log = (
-            handle_log[:20000]
-            + "\n     The log exceeds the specified length(65535 chars)\n     ......\n     "
-            + handle_log[len(handle_log) - 20000 :]
-        )
+    log_buffer = data.get("handle_log")
+    handle_log = log_buffer.getvalue() if log_buffer is not None else ""
     xxl_job_log = await get_xxl_job_log(id)
     xxl_job_log.handle_time = xxl_job_log.handle_time.astimezone(pytz.timezone("UTC"))
-    handle_log_str = '<span style="color: black; font-weight:600">执行log:</span>'
+    handle_log_str = '<span style="color: black; font-weight:600">执行信息:</span>'
     execute_status = "成功" if int(xxl_job_log.handle_code) == 200 else "失败"
+    # 执行信息放在日志后面, 日志的行号和任务执行时/log接口返回的行号一致
     executor_log_params = (
+        f"{handle_log_str} \n"
         f"{'任务归属  ':10}: {xxl_job_log.author} \n"
         f"{'调度时间  ':10}: {xxl_job_log.trigger_time} \n"
         f"{'调度结果  ':10}: {xxl_job_log.trigger_code} \n"
@@ -200,10 +184,10 @@ async def prepare_handle_log(trace_id, id, handle_duration):
         f"{'执行器任务参数':8}: {xxl_job_log.executor_param if xxl_job_log.executor_param else '参数为空！'} \n"
         f"{'执行时间  ':10}: {xxl_job_log.handle_time} \n"
         f"{'执行状态  ':10}: {execute_status} \n"
-        f"{'执行耗时  ':10}: {handle_duration} s\n"
-        f"{handle_log_str} \n"
-        f"{handle_log}"
+        f"{'执行耗时  ':10}: {handle_duration} s"
     )
+    if handle_log:
+        executor_log_params = f"{handle_log}\n{executor_log_params}"
 
     return executor_log_params
 
@@ -212,19 +196,28 @@ async def update_xxl_job_log(trace_id, id, handle_duration):
     handle_log = await prepare_handle_log(
         trace_id=trace_id, id=id, handle_duration=handle_duration
     )
-    XxlJobLog.objects.using("xxl_job").filter(id=id).update(
-        handle_log=handle_log, handle_duration=handle_duration
+    await db_pool.run(
+        XxlJobLog.objects.using("xxl_job").filter(id=id).update,
+        handle_log=handle_log,
+        handle_duration=handle_duration,
     )
 
 
-async def get_xxl_job_log(id):
+def _get_xxl_job_log(id):
     res = XxlJobLog.objects.using("xxl_job").filter(id=id)
     return res[0]
 
 
+async def get_xxl_job_log(id):
+    return await db_pool.run(_get_xxl_job_log, id)
+
+
 async def update_xxl_job_handle_time(id, handle_time):
-    XxlJobLog.objects.using("xxl_job").filter(id=id).update(handle_time=handle_time)
+    await db_pool.run(
+        XxlJobLog.objects.using("xxl_job").filter(id=id).update,
+        handle_time=handle_time,
+    )
 
 
 async def delte_xxl_job_info(id):
-    XxlJobInfo.objects.using("xxl_job").filter(id=id).delete()
+    await db_pool.run(XxlJobInfo.objects.using("xxl_job").filter(id=id).delete)
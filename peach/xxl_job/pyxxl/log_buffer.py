@@ -0,0 +1,286 @@
+import re
+import threading
+import time
+
+from collections import deque
+from typing import Any, Deque, Iterable, Iterator, List, Optional, Tuple, Union
+
+
+SKIPPED_LINE = "     ...... skipped lines {}-{}"
+_SKIPPED_LINE_RE = re.compile(r"^     \.\.\.\.\.\. skipped lines (\d+)-(\d+)$")
+
+ColorDict = {
+    "DEBUG": "black",
+    "INFO": "green",
+    "WARNING": "blue",
+    "WARN": "blue",
+    "EXCEPTION": "red",
+    "ERROR": "red",
+}
+
+# 渲染后的HTML标签、时间等固定部分的大致长度, 用来估算日志占用的字符数
+_RECORD_OVERHEAD = 200
+
+
+class RunLogRecord:
+    """一条任务日志, 创建时格式化消息, 只有在读取或者写入数据库时才渲染成HTML"""
+
+    __slots__ = (
+        "levelname",
+        "created",
+        "name",
+        "func",
+        "lineno",
+        "log_id",
+        "message",
+        "size",
+        "_text",
+    )
+
+    def __init__(
+        self,
+        levelname: str,
+        name: str,
+        func: str,
+        lineno: int,
+        log_id: Any,
+        msg: Any,
+        args: tuple = (),
+        created: Optional[float] = None,
+    ) -> None:
+        self.levelname = levelname
+        self.created = time.time() if created is None else created
+        self.name = name
+        self.func = func
+        self.lineno = lineno
+        self.log_id = log_id
+        # args可能是可变对象, 需要记录打印时的值
+        message = str(msg)
+        if args:
+            try:
+                message = message % args
+            except (TypeError, ValueError):
+                message = "%s %s" % (message, args)
+        self.message = message
+        self.size = len(message) + _RECORD_OVERHEAD
+        """渲染后的估算长度, 用于缓冲区的截断"""
+        self._text: Optional[str] = None
+
+    @property
+    def line_num(self) -> int:
+        return self.message.count("\n") + 2
+
+    def render(self) -> str:
+        if self._text is None:
+            color = ColorDict.get(self.levelname.upper(), "black")
+            data_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.created))
+            self._text = (
+                f'\n<span style="color: {color};">{self.levelname}</span> '
+                f'<span style="color: {color};">{data_time}</span> '
+                f'<span style="color: {color};">{self.name}</span>, '
+                f'in <span style="color: {color};">{self.func}</span>, '
+                f'line <span style="color: {color};">{self.lineno}</span>, '
+                f"logId={self.log_id}\n     {self.message}"
+            )
+        return self._text
+
+    def __str__(self) -> str:
+        return self.render()
+
+
+Entry = Union[str, RunLogRecord]
+
+
+def _split_lines(text: str) -> List[str]:
+    # 每条日志都以换行开头, 开头的换行不单独算一行
+    if text.startswith("\n"):
+        text = text[1:]
+    return text.split("\n")
+
+
+def _text(entry: Entry) -> str:
+    return entry if isinstance(entry, str) else entry.render()
+
+
+def _size(entry: Entry) -> int:
+    return len(entry) if isinstance(entry, str) else entry.size
+
+
+def _line_num(entry: Entry) -> int:
+    if isinstance(entry, str):
+        return entry.count("\n") + (0 if entry.startswith("\n") else 1)
+    return entry.line_num
+
+
+Line = Tuple[int, int, str]
+"""(起始行号, 结束行号, 文本), 被丢弃的多行合并成一行省略号, 起始和结束行号不同"""
+
+
+def _entry_lines(entry: Entry, first_line: int, from_line: int) -> Iterator[Line]:
+    if first_line + _line_num(entry) <= from_line:
+        return
+    for line, text in enumerate(_split_lines(_text(entry)), first_line):
+        if line >= from_line:
+            yield line, line, text
+
+
+def _take_lines(lines: Iterable[Line], length: int) -> List[Line]:
+    """按顺序取总长度不超过length个字符的行, 超长的行截掉多余的字符, 省略号行不截断"""
+    taken: List[Line] = []
+    size = 0
+    for first_line, last_line, text in lines:
+        if size >= length:
+            break
+        if not _SKIPPED_LINE_RE.match(text):
+            text = text[: length - size]
+        taken.append((first_line, last_line, text))
+        size += len(text) + 1
+    return taken
+
+
+def parse_lines(text: str) -> List[Line]:
+    """把getvalue()写入数据库的文本还原成带行号的行"""
+    lines: List[Line] = []
+    line = 1
+    for text_line in text.split("\n"):
+        match = _SKIPPED_LINE_RE.match(text_line)
+        if match and int(match.group(1)) == line:
+            last_line = int(match.group(2))
+            lines.append((line, last_line, text_line))
+            line = last_line + 1
+        else:
+            lines.append((line, line, text_line))
+            line += 1
+    return lines
+
+
+def read_lines(
+    lines: Iterable[Line], from_line: int, max_lines: int
+) -> Tuple[int, List[str]]:
+    """从按顺序排列的行中读取从from_line开始的最多max_lines行, 返回(最后一行的行号, 行列表)"""
+    from_line = max(from_line, 1)
+    result: List[str] = []
+    to_line = from_line - 1
+    for _, last_line, text in lines:
+        if len(result) >= max_lines:
+            break
+        if last_line < from_line:
+            continue
+        result.append(text)
+        to_line = last_line
+    return to_line, result
+
+
+class RunLogBuffer:
+    """单次任务执行的日志缓冲区
+
+    追加是O(1)的, 只保留头部和尾部的日志片段, 内存占用有上限.
+    总长度超过max_length时, 只在读取时拼出头部head_length + 尾部tail_length个字符的文本.
+
+    日志可以是已经渲染好的文本, 也可以是RunLogRecord, 后者在读取时才渲染, 长度按估算值计算.
+    行号在读取时按顺序计算, /log接口可以按行号增量读取, 任务结束后从数据库读取时行号不变.
+    """
+
+    def __init__(
+        self,
+        max_length: int = 50000,
+        head_length: int = 20000,
+        tail_length: int = 20000,
+    ) -> None:
+        self.max_length = max_length
+        self.head_length = head_length
+        self.tail_length = tail_length
+
+        self._head: List[Entry] = []
+        self._head_size = 0
+        self._tail: Deque[Entry] = deque()
+        self._tail_size = 0
+        self._size = 0
+        # 中间被丢弃的行数
+        self._dropped_lines = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def truncated(self) -> bool:
+        return self._size > self.max_length
+
+    @property
+    def line_count(self) -> int:
+        with self._lock:
+            entries = list(self._head) + list(self._tail)
+            dropped_lines = self._dropped_lines
+        return sum(_line_num(entry) for entry in entries) + dropped_lines
+
+    def append(self, entry: Entry) -> None:
+        size = _size(entry)
+        with self._lock:
+            self._size += size
+            if self._head_size < self.head_length:
+                self._head.append(entry)
+                self._head_size += size
+                return
+
+            self._tail.append(entry)
+            self._tail_size += size
+            if self._size <= self.max_length:
+                return
+            # 超过上限后, 丢弃中间部分, 尾部至少保留tail_length个字符
+            while (
+                len(self._tail) > 1
+                and self._tail_size - _size(self._tail[0]) >= self.tail_length
+            ):
+                dropped = self._tail.popleft()
+                self._tail_size -= _size(dropped)
+                self._dropped_lines += _line_num(dropped)
+
+    def getvalue(self) -> str:
+        """写入数据库的文本, 每一行和read_lines的行号一一对应
+
+        总长度超过max_length时只保留头部head_length + 尾部tail_length个字符的整行,
+        中间的行用一行"skipped lines 起始行号-结束行号"代替, parse_lines可以还原出原来的行号.
+        """
+        lines = list(self._iter_lines())
+        if sum(len(text) + 1 for _, _, text in lines) <= self.max_length:
+            return "\n".join(text for _, _, text in lines)
+        head = _take_lines(lines, self.head_length)
+        tail = _take_lines(reversed(lines[len(head) :]), self.tail_length)[::-1]
+        middle = lines[len(head) : len(lines) - len(tail)]
+        if middle:
+            first_line, last_line = middle[0][0], middle[-1][1]
+            head.append(
+                (first_line, last_line, SKIPPED_LINE.format(first_line, last_line))
+            )
+        return "\n".join(text for _, _, text in head + tail)
+
+    def _iter_lines(self, from_line: int = 1) -> Iterator[Line]:
+        """按顺序生成行号不小于from_line的行, 之前的日志不渲染"""
+        with self._lock:
+            head_entries = list(self._head)
+            tail_entries = list(self._tail)
+            dropped_lines = self._dropped_lines
+        line = 1
+        for entry in head_entries:
+            yield from _entry_lines(entry, line, from_line)
+            line += _line_num(entry)
+        if dropped_lines:
+            if line + dropped_lines > from_line:
+                last_line = line + dropped_lines - 1
+                yield line, last_line, SKIPPED_LINE.format(line, last_line)
+            line += dropped_lines
+        for entry in tail_entries:
+            yield from _entry_lines(entry, line, from_line)
+            line += _line_num(entry)
+
+    def read_lines(self, from_line: int, max_lines: int) -> Tuple[int, List[str]]:
+        """从from_line(从1开始)开始最多读取max_lines行
+
+        被丢弃的中间部分用一行省略号代替, 返回(最后一行的行号, 行列表),
+        没有新的日志时返回(from_line - 1, [])
+        """
+        return read_lines(self._iter_lines(from_line), from_line, max_lines)
+
+    def __str__(self) -> str:
+        return self.getvalue()
@@ -6,7 +6,9 @@ from typing import AsyncGenerator, Optional
 
 from aiohttp import web
 
+from peach.xxl_job.pyxxl.db_pool import db_pool
 from peach.xxl_job.pyxxl.executor import Executor, JobHandler  # type: ignore
+from peach.xxl_job.pyxxl.monitor import LoopMonitor
 from peach.xxl_job.pyxxl.server import create_app  # type: ignore
 from peach.xxl_job.pyxxl.setting import ExecutorConfig
 from peach.xxl_job.pyxxl.xxl_client import XXL
@@ -20,6 +22,7 @@ class PyxxlRunner:
     xxl_client: Optional[XXL] = None
     executor: Optional[Executor] = None
     register_task: Optional[asyncio.Task] = None
+    loop_monitor: Optional[LoopMonitor] = None
     daemon: Optional[Process] = None
 
     def __init__(
@@ -61,7 +64,15 @@ class PyxxlRunner:
     def _get_xxl_clint(self) -> XXL:
         """for moke"""
         return XXL(
-            self.config.xxl_admin_k8s_baseurl + "api/", token=self.config.access_token
+            self.config.xxl_admin_k8s_baseurl + "api/",
+            token=self.config.access_token,
+            callback_batch_size=int(self.config.callback_batch_size),
+            callback_flush_interval=float(self.config.callback_flush_interval),
+            callback_spill_path=self.config.callback_spill_path,
+            remote_cookie=self.config.remote_cookie,
+            pool_size=int(self.config.admin_pool_size),
+            keepalive_timeout=float(self.config.admin_keepalive_timeout),
+            timeout=float(self.config.admin_timeout),
         )
 
     async def _init(self) -> None:
@@ -69,15 +80,20 @@ class PyxxlRunner:
         self.executor = Executor(
             self.xxl_client, config=self.config, handler=self.handler
         )
+        self.handler.set_admin_client(self.xxl_client)
+        await self.executor.recover()
         self.register_task = asyncio.create_task(
             self._register_task(self.xxl_client), name="pyxxl-register"
         )
+        self.loop_monitor = LoopMonitor()
+        self.loop_monitor.start()
 
     async def _cleanup_ctx(self, app: web.Application) -> AsyncGenerator:
         await self._init()
         app["xxl_client"] = self.xxl_client
         app["executor"] = self.executor
         app["register_task"] = self.register_task
+        app["loop_monitor"] = self.loop_monitor
         if self.executor and self.executor.handler:
             logger.info(
                 "register with handlers %s", list(self.executor.handler.handlers_info())
@@ -95,7 +111,13 @@ class PyxxlRunner:
             await app["executor"].graceful_close(self.config.graceful_timeout)
         else:
             await app["executor"].shutdown()
+        if app["executor"].run_store is not None:
+            app["executor"].run_store.close()
+        await app["executor"].alert_sender.close()
+        self.handler.set_admin_client(None)
         await app["xxl_client"].close()
+        app["loop_monitor"].stop()
+        db_pool.shutdown()
         logger.info("cleanup executor success.")
 
     def create_server_app(self) -> web.Application:
@@ -0,0 +1,229 @@
+import bisect
+import math
+import threading
+
+from typing import Dict, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+    600,
+    1800,
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, extra: str = "") -> str:
+        pairs = [
+            '{}="{}"'.format(name, _escape(value))
+            for name, value in zip(self.labelnames, values)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.type),
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    type = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(self._label_values(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            "{}{} {}".format(self.name, self._format_labels(key), _format_value(value))
+            for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    """当前值, 一般在/metrics被抓取时设置"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """累计分桶的直方图, 用于耗时统计"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # 标签 -> (各个桶的计数(非累计), 总和)
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(
+                key, ([0] * len(self.buckets), [0.0])
+            )
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        counts, _ = self._values.get(self._label_values(labels), ([0], [0.0]))
+        return sum(counts)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            values = [(k, list(c), t[0]) for k, (c, t) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        self.name,
+                        self._format_labels(key, 'le="%s"' % _format_value(bound)),
+                        cumulative,
+                    )
+                )
+            labels = self._format_labels(key)
+            lines.append("{}_sum{} {}".format(self.name, labels, _format_value(total)))
+            lines.append("{}_count{} {}".format(self.name, labels, cumulative))
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))  # type: ignore
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, documentation, labelnames))  # type: ignore
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore
+
+
+# 执行器
+RUN_REQUESTS = counter(
+    "pyxxl_run_requests_total",
+    "调度中心/run请求的处理结果: started/queued/discarded/busy/not_found",
+    ["handler", "result"],
+)
+RUNS_FINISHED = counter("pyxxl_runs_finished_total", "执行结束的任务数", ["handler", "status"])
+RUN_DURATION = histogram("pyxxl_run_duration_seconds", "任务执行耗时(秒)", ["handler"])
+QUEUE_WAIT = histogram("pyxxl_queue_wait_seconds", "串行队列中的任务等待开始执行的时间(秒)", ["handler"])
+RUNNING_JOBS = gauge("pyxxl_running_jobs", "执行中的任务数")
+QUEUED_JOBS = gauge("pyxxl_queued_jobs", "串行队列中等待的任务数")
+MAX_QUEUE_DEPTH = gauge("pyxxl_max_queue_depth", "单个jobId串行队列的最大长度")
+MAX_WORKERS = gauge("pyxxl_max_workers", "执行器线程池大小(max_workers)")
+THREAD_POOL_BUSY = gauge("pyxxl_thread_pool_busy", "执行器线程池中正在执行的同步任务数")
+ZOMBIE_THREADS = gauge("pyxxl_zombie_threads", "已取消但线程还没有退出的任务数")
+PROCESS_KILLED = gauge("pyxxl_process_pool_killed", "超时或取消而被kill掉的子进程数")
+
+# 调度中心
+ADMIN_REQUEST_DURATION = histogram(
+    "pyxxl_admin_request_duration_seconds",
+    "请求调度中心的耗时(秒), 包括重试",
+    ["path", "status"],
+)
+CALLBACK_QUEUE = gauge("pyxxl_callback_queue_size", "等待批量回调的执行结果数")
+ALERT_DROPPED = gauge("pyxxl_alert_dropped", "告警队列满了丢弃的告警数")
+
+# 事件循环
+LOOP_LAG = gauge("pyxxl_loop_lag_seconds", "最近一次检测到的事件循环延迟(秒)")
+LOOP_MAX_LAG = gauge("pyxxl_loop_max_lag_seconds", "事件循环的最大延迟(秒)")
+LOOP_BLOCKED = gauge("pyxxl_loop_blocked_seconds", "事件循环被阻塞的累计时间(秒)")
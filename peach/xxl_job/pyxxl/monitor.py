@@ -0,0 +1,46 @@
+import asyncio
+import logging
+
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """事件循环阻塞监控
+
+    每隔interval秒醒来一次, 实际醒来的时间比预期晚多少就是事件循环被阻塞的时间.
+    """
+
+    def __init__(self, interval: float = 0.5, warn_threshold: float = 0.2) -> None:
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.blocked_seconds = 0.0
+        """累计阻塞时间(秒)"""
+        self.max_lag = 0.0
+        """单次最大阻塞时间(秒)"""
+        self.last_lag = 0.0
+        """最近一次检测到的阻塞时间(秒)"""
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="pyxxl-loop-monitor")
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self.last_lag = lag
+            self.blocked_seconds += lag
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.warn_threshold:
+                logger.warning("Event loop was blocked for %.3fs", lag)
@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+from multiprocessing.reduction import recv_handle, send_handle
+from typing import Any, Dict, Optional, Set, Tuple
+
+from django import db
+
+from peach.xxl_job.pyxxl import error
+from peach.xxl_job.pyxxl.ctx import CancelToken
+from peach.xxl_job.pyxxl.schema import RunData
+
+logger = logging.getLogger(__name__)
+
+# 父子进程之间的消息类型
+_RUN = "run"
+_LOG = "log"
+_RESULT = "result"
+_ERROR = "error"
+
+
+class _PipeLog:
+    """子进程中代替RunLogBuffer, 每条日志都通过管道发回父进程的日志缓冲区"""
+
+    def __init__(self, conn: Connection) -> None:
+        self.conn = conn
+
+    def append(self, entry: Any) -> None:
+        # 子进程中渲染好再发送, msg和args不一定能pickle
+        self.conn.send((_LOG, str(entry)))
+
+
+def _run_handler(conn: Connection, handler_name: str, run_ctx: Dict[str, Any]) -> Any:
+    from peach.xxl_job.pyxxl.ctx import g, g2
+    from peach.xxl_job.pyxxl.executor import JobHandler
+    from peach.xxl_job.pyxxl.log import RunLogHandler
+    from peach.xxl_job.pyxxl.shard import ShardContext
+
+    handler = JobHandler._handlers[handler_name]
+    run_data: RunData = run_ctx["xxl_kwargs"]
+    g2.set_xxl_run_data({"trace_id": run_data.traceID, "run_data": run_ctx["run_data"]})
+    pipe_log = _PipeLog(conn)
+    g.set_xxl_run_data(
+        run_data.traceID, {"xxl_kwargs": run_data, "handle_log": pipe_log}
+    )
+    run_log_handler = RunLogHandler(
+        run_data.traceID, pipe_log, run_ctx.get("capture_logging", False)
+    )
+    run_log_handler.attach()
+    args: tuple = ()
+    thread_pool = None
+    if handler.sharded:
+        # 子进程是守护进程, 不能再创建进程池, 子分片只能用线程
+        thread_pool = ThreadPoolExecutor(thread_name_prefix="pyxxl_shard")
+        args = (ShardContext.from_run_data(run_data, thread_pool, lambda: thread_pool),)
+    try:
+        if handler.is_async:
+            return asyncio.run(handler.handler(*args))
+        return handler.handler(*args)
+    finally:
+        if thread_pool is not None:
+            thread_pool.shutdown(wait=False)
+        run_log_handler.detach()
+        g.delete_xxl_run_data(run_data.traceID)
+        g.delete_xxl_run_data(run_data.logId)
+
+
+def _worker_main(conn: Connection) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # fork时会带上父进程当前线程的数据库连接, 只能丢弃不能关闭, 否则会影响父进程
+    for connection in db.connections.all():
+        connection.connection = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        _, handler_name, run_ctx = message
+        db.close_old_connections()
+        try:
+            result = _run_handler(conn, handler_name, run_ctx)
+            conn.send((_RESULT, result))
+        except BaseException:
+            conn.send((_ERROR, traceback.format_exc()))
+        finally:
+            db.close_old_connections()
+
+
+def _spawner_main(conn: Connection) -> None:
+    """单线程的spawner进程, 收到请求后fork一个子进程, 把管道的父进程端和pid发回去
+
+    执行器启动线程池之后, 从多线程的进程中fork可能会带上其他线程持有的锁导致子进程死锁,
+    所以子进程都由执行器启动时fork出来的spawner进程负责fork.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # 子进程退出后自动回收, 不会变成僵尸进程
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    for connection in db.connections.all():
+        connection.connection = None
+    while True:
+        try:
+            conn.recv()
+        except EOFError:
+            return
+        parent_conn, child_conn = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            conn.close()
+            parent_conn.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            try:
+                _worker_main(child_conn)
+            finally:
+                os._exit(0)
+        child_conn.close()
+        conn.send(pid)
+        send_handle(conn, parent_conn.fileno(), os.getppid())
+        parent_conn.close()
+
+
+class _Spawner:
+    def __init__(self, ctx: Any) -> None:
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_spawner_main,
+            args=(child_conn,),
+            name="pyxxl-spawner",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self._lock = threading.Lock()
+
+    def spawn(self) -> "_Worker":
+        with self._lock:
+            self.conn.send(_RUN)
+            pid = self.conn.recv()
+            conn = Connection(recv_handle(self.conn))
+        return _Worker(pid, conn)
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class _Worker:
+    def __init__(self, pid: int, conn: Connection) -> None:
+        self.pid = pid
+        self.conn = conn
+
+    def kill(self) -> None:
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.conn.close()
+
+
+class ProcessPool:
+    """执行器管理的预先fork的进程池, 用于register(executor="process")注册的CPU密集型handler
+
+    - 启动时先fork出单线程的spawner进程, 再由它fork出max_workers个常驻子进程,
+      子进程继承父进程中已经初始化好的Django和已注册的handler
+    - 父进程中的上下文(trace_id, RunData)随任务一起发给子进程, 子进程中的日志实时发回父进程的日志缓冲区
+    - 超时或者任务被取消时直接kill掉子进程, 再由spawner fork一个新的补充进去,
+      不会在执行器的线程中fork
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        self.max_workers = max_workers
+        self._ctx = multiprocessing.get_context("fork")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: Set[_Worker] = set()
+        self._spawner: Optional[_Spawner] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.killed = 0
+        """超时或取消而被kill掉的子进程数量"""
+
+    @property
+    def started(self) -> bool:
+        return self._spawner is not None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._spawner is not None or self._closed:
+                return
+            # 不能把父进程的数据库连接带到子进程里
+            db.connections.close_all()
+            self._spawner = _Spawner(self._ctx)
+        for _ in range(self.max_workers):
+            self._spawn()
+        logger.info("process pool started with %s workers", self.max_workers)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, set()
+            spawner, self._spawner = self._spawner, None
+        for worker in workers:
+            worker.kill()
+        if spawner is not None:
+            spawner.kill()
+
+    def _spawn(self) -> None:
+        with self._lock:
+            spawner = self._spawner
+        if spawner is None:
+            return
+        worker = spawner.spawn()
+        with self._lock:
+            if self._closed:
+                worker.kill()
+                return
+            self._workers.add(worker)
+        self._idle.put(worker)
+
+    def _replace(self, worker: _Worker) -> None:
+        with self._lock:
+            self._workers.discard(worker)
+            closed = self._closed
+        worker.kill()
+        if not closed:
+            self._spawn()
+
+    def run(
+        self,
+        handler_name: str,
+        run_ctx: Dict[str, Any],
+        log_buffer: Any,
+        timeout: float,
+        cancel_token: Optional[CancelToken] = None,
+    ) -> Any:
+        """在子进程中执行handler并等待结果, 在执行器线程池的线程中调用
+
+        Args:
+            handler_name (str): 注册的handler名称
+            run_ctx (dict): 本次执行的上下文, 包括xxl_kwargs(RunData)和run_data
+            log_buffer: 子进程发回的日志写入这里
+            timeout (float): 超时时间(秒), 包括等待空闲子进程的时间
+            cancel_token (CancelToken, optional): 被取消后kill掉子进程
+        """
+        deadline = time.monotonic() + timeout
+        worker = self._acquire(deadline, cancel_token)
+        try:
+            worker.conn.send((_RUN, handler_name, run_ctx))
+            kind, payload = self._wait(worker, log_buffer, deadline, cancel_token)
+        except BaseException:
+            # 超时/取消/子进程异常退出, 子进程已经不可用
+            self._kill(worker)
+            raise
+        self._idle.put(worker)
+        if kind == _ERROR:
+            raise error.JobExecuteError(payload)
+        return payload
+
+    @staticmethod
+    def _wait(
+        worker: _Worker,
+        log_buffer: Any,
+        deadline: float,
+        cancel_token: Optional[CancelToken],
+    ) -> Tuple[str, Any]:
+        while True:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise error.JobCancelledError("job cancelled")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise error.JobTimeoutError("job timeout")
+            if not worker.conn.poll(min(remaining, 0.5)):
+                continue
+            try:
+                kind, payload = worker.conn.recv()
+            except EOFError:
+                raise error.JobExecuteError("worker process %s exited" % worker.pid)
+            if kind == _LOG:
+                log_buffer.append(payload)
+            else:
+                return kind, payload
+
+    def _kill(self, worker: _Worker) -> None:
+        logger.warning("kill worker process %s", worker.pid)
+        self.killed += 1
+        self._replace(worker)
+
+    def _acquire(self, deadline: float, cancel_token: Optional[CancelToken]) -> _Worker:
+        while True:
+            if cancel_token is not None and cancel_token.cancelled:
+                raise error.JobCancelledError("job cancelled before start")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise error.JobTimeoutError("no idle worker process")
+            try:
+                return self._idle.get(timeout=min(remaining, 0.5))
+            except queue.Empty:
+                continue
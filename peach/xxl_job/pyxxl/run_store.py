@@ -0,0 +1,126 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Tuple
+
+from peach.xxl_job.pyxxl.schema import RunData
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+
+
+class RunStore:
+    """执行器本地的持久化任务队列(SQLite)
+
+    排队中和执行中的任务在接收时写入, 结束时删除. 执行器重启后:
+
+    - 排队中的任务重新提交执行
+    - 执行中的任务已经被中断, 无法恢复, 回调调度中心执行失败
+
+    写入在单独的写线程中按调用顺序执行, 不阻塞事件循环; put/remove调用时就已经提交,
+    返回的Future需要await等待写入完成. 不用db_pool, 它有多个线程, 同一条记录的写入和删除可能乱序.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="pyxxl_run_store"
+        )
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pyxxl_run ("
+            "log_id INTEGER PRIMARY KEY, "
+            "job_id INTEGER NOT NULL, "
+            "status TEXT NOT NULL, "
+            "start_time INTEGER NOT NULL, "
+            "seq INTEGER NOT NULL, "
+            "data TEXT NOT NULL)"
+        )
+
+    def _submit(self, func: Callable, *args: Any) -> "asyncio.Future[None]":
+        if self._closed:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(None)
+            return future
+        return asyncio.wrap_future(self._writer.submit(func, *args))
+
+    def put(
+        self, run_data: RunData, status: str, start_time: int
+    ) -> "asyncio.Future[None]":
+        """写入或更新一条任务记录, seq保证重放时按接收顺序排队"""
+        data = json.dumps(dataclasses.asdict(run_data), ensure_ascii=False)
+        return self._submit(
+            self._put, run_data.logId, run_data.jobId, status, start_time, data
+        )
+
+    def remove(self, log_id: int) -> "asyncio.Future[None]":
+        return self._submit(self._remove, log_id)
+
+    def _put(
+        self, log_id: int, job_id: int, status: str, start_time: int, data: str
+    ) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._conn.execute(
+                "INSERT INTO pyxxl_run (log_id, job_id, status, start_time, seq, data) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(log_id) DO UPDATE SET "
+                "status = excluded.status, start_time = excluded.start_time",
+                (
+                    log_id,
+                    job_id,
+                    status,
+                    start_time,
+                    time.time_ns(),
+                    data,
+                ),
+            )
+
+    def _remove(self, log_id: int) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._conn.execute("DELETE FROM pyxxl_run WHERE log_id = ?", (log_id,))
+
+    def load(self) -> List[Tuple[str, int, RunData]]:
+        """按接收顺序返回所有未完成的任务: (状态, 接收时间, RunData)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, start_time, data FROM pyxxl_run ORDER BY seq"
+            ).fetchall()
+        return [
+            (status, start_time, RunData(**json.loads(data)))
+            for status, start_time, data in rows
+        ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pyxxl_run").fetchone()[0]
+
+    def close(self) -> None:
+        """关闭后忽略写入, 执行器退出时被取消的任务保留在队列中, 重启后按执行中的任务处理"""
+        # 等待已经提交的写入完成, 都是很小的单条记录
+        self._writer.shutdown(wait=True)
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._conn.close()
@@ -1,12 +1,22 @@
 import typing
 from asyncio import iscoroutinefunction
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Callable, Optional
 
 
 @dataclass
 class HandlerInfo:
     handler: Callable
+    sharded: bool = False
+    """分片handler会收到ShardContext参数"""
+    executor: str = "thread"
+    """执行方式, thread或者process"""
+    max_concurrency: int = 1
+    """同一个jobId在单个执行器上同时执行的任务数上限"""
+
+    @property
+    def is_process(self) -> bool:
+        return self.executor == "process"
 
     @property
     def is_async(self) -> bool:
@@ -47,3 +57,41 @@ class RunData:
     glueUpdatetime: Optional[int] = None
     broadcastIndex: Optional[int] = None
     broadcastTotal: Optional[int] = None
+
+
+@dataclass
+class BulkItemResult:
+    index: int
+    """在输入中的序号"""
+    key: str
+    """JobInfo的uniqueKey或者取消的uniqueKey"""
+    ok: bool
+    response: Optional[typing.Any] = None
+    """调度中心的响应"""
+    error: Optional[str] = None
+
+
+@dataclass
+class BulkResult:
+    """批量添加/取消动态任务的结果"""
+
+    results: typing.List[BulkItemResult] = field(default_factory=list)
+    elapsed: float = 0
+    """总耗时(秒)"""
+
+    @property
+    def total(self) -> int:
+        return len(self.results)
+
+    @property
+    def succeeded(self) -> int:
+        return sum(1 for r in self.results if r.ok)
+
+    @property
+    def failed(self) -> typing.List[BulkItemResult]:
+        return [r for r in self.results if not r.ok]
+
+    @property
+    def throughput(self) -> float:
+        """每秒处理的任务数"""
+        return self.total / self.elapsed if self.elapsed else 0.0
@@ -2,20 +2,13 @@
 
 from aiohttp import web
 
-from peach.xxl_job.pyxxl import error
+from peach.xxl_job.pyxxl import alert, error, metrics
 from peach.xxl_job.pyxxl.schema import RunData
 import uuid
 from peach.xxl_job.pyxxl.log import get_xxl_job_log
-from peach.xxl_job.pyxxl.define import XXL_JOB_HANDLER_NOT_FOUND
-from asgiref.sync import sync_to_async
-from django.conf import settings
-from peach.sender.slack_sender.slack_sender import send_slack_msg
-from peach.sender.slack_sender.slack_helper import (
-    get_slack_id_by_username,
-    format_slack_user_id_list,
-)
-from peach.xxl_job.pyxxl.ctx import g2
+from peach.xxl_job.pyxxl.ctx import g, g2
 from peach.xxl_job.pyxxl.log import XxlJobLogger
+from peach.xxl_job.pyxxl.log_buffer import parse_lines, read_lines
 
 logger = XxlJobLogger(__name__)
 
@@ -30,6 +23,23 @@ async def beat(request: web.Request) -> web.Response:
     return web.json_response(dict(code=200, msg=None))
 
 
+@routes.get("/metrics")
+async def metrics_view(request: web.Request) -> web.Response:
+    """Prometheus文本格式的执行器指标"""
+    request.app["executor"].collect_metrics()
+    metrics.CALLBACK_QUEUE.set(request.app["xxl_client"].callback_sender.queue.qsize())
+    loop_monitor = request.app.get("loop_monitor")
+    if loop_monitor is not None:
+        metrics.LOOP_LAG.set(loop_monitor.last_lag)
+        metrics.LOOP_MAX_LAG.set(loop_monitor.max_lag)
+        metrics.LOOP_BLOCKED.set(loop_monitor.blocked_seconds)
+    return web.Response(
+        text=metrics.registry.render(),
+        content_type="text/plain",
+        headers={"X-Content-Type-Options": "nosniff"},
+    )
+
+
 @routes.post("/idleBeat")
 async def idle_beat(request: web.Request) -> web.Response:
     trace_id = "".join(str(uuid.uuid4()).split("-"))
@@ -71,14 +81,12 @@ async def run(request: web.Request) -> web.Response:
     )
     try:
         await request.app["executor"].run_job(run_data)
-    except error.JobDuplicateError as e:
+    except (error.JobDuplicateError, error.ExecutorBusyError) as e:
         return web.json_response(dict(code=500, msg=e.message))
     except error.JobNotFoundError as e:
-        im_id = await sync_to_async(get_slack_id_by_username)(username=run_data.author)
-        format_im_id = format_slack_user_id_list([im_id])
-        msg = XXL_JOB_HANDLER_NOT_FOUND.format(format_im_id, run_data.executorHandler)
-        channel = settings.IM["slack"]["xxl-job"]["channel"]
-        await sync_to_async(send_slack_msg)(channel=channel, text=msg)
+        request.app["executor"].alert_sender.put(
+            alert.NOT_FOUND, run_data.executorHandler, run_data.author, run_data.logId
+        )
         return web.json_response(dict(code=500, msg=e.message))
 
     return web.json_response(dict(code=200, msg=None))
@@ -93,7 +101,6 @@ async def kill(request: web.Request) -> web.Response:
     return web.json_response(dict(code=200, msg=None))
 
 
-# todo
 @routes.post("/log")
 async def log(request: web.Request) -> web.Response:
     """
@@ -107,20 +114,30 @@ async def log(request: web.Request) -> web.Response:
     g2.set_xxl_run_data({"trace_id": trace_id})
     data = await request.json()
     # logger.info("log %s" % data)
-    xxl_job_log = await get_xxl_job_log(data["logId"])
-    handle_log = xxl_job_log.handle_log
-    if not handle_log:
-        from peach.xxl_job.pyxxl.ctx import g
+    from_line = max(int(data.get("fromLineNum") or 1), 1)
+    max_lines = int(request.app["executor"].config.log_page_lines)
+
+    # 任务还在执行, 从内存中按行号增量读取
+    log_buffer = g.get_run_log(data["logId"])
+    if log_buffer is not None:
+        to_line, lines = log_buffer.read_lines(from_line, max_lines)
+        is_end = False
+    else:
+        xxl_job_log = await get_xxl_job_log(data["logId"])
+        handle_log = xxl_job_log.handle_log or ""
+        # 行号和执行时从内存中读取的一致, 执行中途打开的日志可以接着读取
+        all_lines = parse_lines(handle_log) if handle_log else []
+        to_line, lines = read_lines(all_lines, from_line, max_lines)
+        is_end = bool(all_lines) and to_line >= all_lines[-1][1]
 
-        handle_log = g.get_xxl_run_data_log_id(data["logId"]).get("handle_log", "")
     response = {
         "code": 200,
         "msg": None,
         "content": {
-            "fromLineNum": 1,
-            "toLineNum": 1,
-            "logContent": handle_log,
-            "isEnd": True if xxl_job_log.handle_log else False,
+            "fromLineNum": from_line,
+            "toLineNum": to_line,
+            "logContent": "".join(line + "\n" for line in lines),
+            "isEnd": is_end,
         },
     }
 
@@ -1,6 +1,7 @@
 import inspect
 import logging
 import os
+import tempfile
 
 from dataclasses import dataclass, field
 from typing import Optional
@@ -46,11 +47,41 @@ class ExecutorConfig:
     """执行器绑定的http服务的端口,作用同host. Default: 9999"""
 
     max_workers: int = 500
-    """执行器线程池（执行同步任务时使用）. Default: 30"""
+    """执行器线程池（执行同步任务时使用）,同时也是执行器同时执行的任务数上限,超过后拒绝调度. Default: 500"""
+    process_workers: int = field(default_factory=lambda: os.cpu_count() or 1)
+    """进程模式(register(executor="process"))的常驻子进程数量. Default: CPU核数"""
+    shard_max_workers: int = 32
+    """分片任务拆分子分片时使用的线程池大小. Default: 32"""
+    shard_process_workers: int = field(default_factory=lambda: os.cpu_count() or 1)
+    """分片任务以进程模式拆分子分片时使用的进程池大小. Default: CPU核数"""
+    db_max_workers: int = 10
+    """执行器访问xxl_job数据库的线程池大小,ORM查询不会阻塞事件循环. Default: 10"""
     task_timeout: int = 60 * 10
     """任务的默认超时时间,如果调度器传了以参数executorTimeout为准. Default: 60 * 10"""
     task_queue_length: int = 30
     """任务的队列长度.单机串行的队列长度,当阻塞的任务大于此值时会抛弃. Default: 30"""
+    log_page_lines: int = 1000
+    """/log接口单次返回的最大日志行数,调度中心按fromLineNum滚动加载. Default: 1000"""
+    admin_pool_size: int = 100
+    """调度中心客户端连接池的最大连接数,注册、回调和动态任务接口共用. Default: 100"""
+    admin_keepalive_timeout: float = 30
+    """调度中心长连接的空闲保持时间(秒). Default: 30"""
+    admin_timeout: float = 30
+    """请求调度中心的超时时间(秒),超时按指数退避重试. Default: 30"""
+    callback_batch_size: int = 100
+    """执行结果批量回调调度中心时每批的最大条数. Default: 100"""
+    callback_flush_interval: float = 1.0
+    """执行结果攒批的最长等待时间(秒). Default: 1.0"""
+    callback_spill_path: str = ""
+    """调度中心不可用时回调结果落盘的文件,恢复后自动重发. Default: 临时目录下的pyxxl/callback-{executor_app_name}-{executor_port}.jsonl"""
+    run_store_path: str = ""
+    """持久化任务队列的SQLite文件,排队中和执行中的任务重启后可以恢复或回调失败,为空时不开启. Default: "" """
+    capture_logging: bool = False
+    """是否把handler中标准logging打印的日志也记录到任务日志. Default: False"""
+    alert_window: float = 60
+    """同一个handler的失败告警在窗口(秒)内汇总成一条slack消息. Default: 60"""
+    alert_min_interval: float = 600
+    """同一个handler两条失败告警之间的最小间隔(秒),期间的失败合并到下一条. Default: 600"""
     graceful_close: bool = True
     """是否优雅关闭. Default: True"""
     graceful_timeout: int = 60 * 30
@@ -90,6 +121,14 @@ class ExecutorConfig:
         self.executor_port = settings.XXL_JOB["executor_port"]
         self._valid_xxl_admin_k8s_baseurl()
         self._valid_executor_app_name()
+        if not self.callback_spill_path:
+            self.callback_spill_path = os.path.join(
+                tempfile.gettempdir(),
+                "pyxxl",
+                "callback-{}-{}.jsonl".format(
+                    self.executor_app_name, self.executor_port
+                ),
+            )
 
     def _valid_xxl_admin_k8s_baseurl(self) -> None:
         if not self.xxl_admin_k8s_baseurl:
@@ -0,0 +1,153 @@
+import asyncio
+import contextvars
+import threading
+
+from concurrent.futures import Executor as PoolExecutor
+from concurrent.futures import Future, as_completed
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any, Callable, Iterable, List, Sequence, TypeVar
+
+from peach.xxl_job.pyxxl.log import XxlJobLogger
+from peach.xxl_job.pyxxl.schema import RunData
+
+logger = XxlJobLogger(__name__)
+
+T = TypeVar("T")
+
+THREAD = "thread"
+PROCESS = "process"
+
+
+@dataclass
+class ShardContext:
+    """分片广播任务的分片上下文, 通过register(sharded=True)注册的handler会收到这个参数
+
+    !!! example
+
+        ```python
+        @app.handler.register(name="sync_users", sharded=True)
+        def sync_users(shard: ShardContext):
+            user_ids = shard.shard(get_all_user_ids())
+            shard.map(sync_user_batch, user_ids, parts=8)
+        ```
+    """
+
+    index: int
+    """当前执行器的分片序号, 从0开始"""
+    total: int
+    """分片总数(广播时为执行器数量)"""
+    run_data: RunData
+    thread_pool: PoolExecutor = field(repr=False)
+    process_pool_factory: Callable[[], PoolExecutor] = field(repr=False)
+
+    finished: int = 0
+    """已经完成的子分片数量"""
+    parts: int = 0
+    """子分片总数"""
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @classmethod
+    def from_run_data(
+        cls,
+        run_data: RunData,
+        thread_pool: PoolExecutor,
+        process_pool_factory: Callable[[], PoolExecutor],
+    ) -> "ShardContext":
+        total = run_data.broadcastTotal or 1
+        index = run_data.broadcastIndex or 0
+        return cls(
+            index=index,
+            total=total,
+            run_data=run_data,
+            thread_pool=thread_pool,
+            process_pool_factory=process_pool_factory,
+        )
+
+    def shard(self, items: Iterable[T]) -> List[T]:
+        """取出当前分片负责的数据: 第index, index + total, index + 2 * total...个元素"""
+        return list(islice(items, self.index, None, self.total))
+
+    @staticmethod
+    def split(items: Sequence[T], parts: int) -> List[Sequence[T]]:
+        """把items尽量平均地切成parts份, 不会返回空的子分片, items为空时返回[]"""
+        if not items:
+            return []
+        parts = max(min(parts, len(items)), 1)
+        size, rest = divmod(len(items), parts)
+        chunks, start = [], 0
+        for i in range(parts):
+            end = start + size + (1 if i < rest else 0)
+            chunks.append(items[start:end])
+            start = end
+        return chunks
+
+    def map(
+        self,
+        func: Callable[[Sequence[T]], Any],
+        items: Sequence[T],
+        parts: int = 4,
+        mode: str = THREAD,
+    ) -> List[Any]:
+        """把当前分片再切成parts个子分片并行执行func(子分片), 按子分片顺序返回结果
+
+        mode为"thread"时在执行器的分片线程池中执行, 适合IO密集的任务;
+        为"process"时在进程池中执行, 适合CPU密集的任务, 此时func和数据必须可以被pickle.
+        每完成一个子分片都会记录一次进度日志.
+        """
+        futures = [
+            self._submit(func, chunk, mode) for chunk in self.split(items, parts)
+        ]
+        self._start(len(futures))
+        index = {f: i for i, f in enumerate(futures)}
+        for future in as_completed(futures):
+            future.result()
+            self._report(index[future])
+        return [f.result() for f in futures]
+
+    async def amap(
+        self,
+        func: Callable[[Sequence[T]], Any],
+        items: Sequence[T],
+        parts: int = 4,
+        mode: str = THREAD,
+    ) -> List[Any]:
+        """异步handler中使用的map, 不会阻塞事件循环"""
+        futures = [
+            asyncio.wrap_future(self._submit(func, chunk, mode))
+            for chunk in self.split(items, parts)
+        ]
+        self._start(len(futures))
+
+        async def _wait(i: int, future: "asyncio.Future[Any]") -> Any:
+            result = await future
+            self._report(i)
+            return result
+
+        return list(await asyncio.gather(*(_wait(i, f) for i, f in enumerate(futures))))
+
+    def _submit(
+        self, func: Callable[[Sequence[T]], Any], chunk: Sequence[T], mode: str
+    ) -> Future:
+        if mode == THREAD:
+            # 子分片中的日志也要记录到本次执行的日志里
+            context = contextvars.copy_context()
+            return self.thread_pool.submit(context.run, func, chunk)
+        if mode == PROCESS:
+            return self.process_pool_factory().submit(func, chunk)
+        raise ValueError("unknown shard mode [%s]" % mode)
+
+    def _start(self, parts: int) -> None:
+        with self._lock:
+            self.finished = 0
+            self.parts = parts
+
+    def _report(self, part_index: int) -> None:
+        with self._lock:
+            self.finished += 1
+            finished = self.finished
+        logger.info(
+            "shard {}/{} sub-shard {} finished, progress {}/{}".format(
+                self.index + 1, self.total, part_index + 1, finished, self.parts
+            )
+        )
@@ -1,5 +1,8 @@
 import asyncio
+import json
 import logging
+import os
+import time
 
 from typing import Any, Dict, List, Optional, Union
 
@@ -7,6 +10,7 @@ import aiohttp
 
 from yarl import URL
 
+from peach.xxl_job.pyxxl import metrics
 from peach.xxl_job.pyxxl.error import ClientError, XXLRegisterError
 
 
@@ -14,6 +18,9 @@ logger = logging.getLogger(__name__)
 
 JsonType = Union[None, int, str, bool, List[Any], Dict[Any, Any]]
 
+RETRY_FOREVER = -1
+"""retry_times传这个值时一直重试直到成功"""
+
 
 class Response:
     def __init__(self, code: int, msg: Optional[str] = None, **kwargs: Any) -> None:
@@ -25,15 +32,184 @@ class Response:
         return self.code == 200
 
 
+class CallbackSender:
+    """回调结果的批量发送器
+
+    执行结果先进入队列, 攒够batch_size条或者等待flush_interval秒后一次性发给调度中心
+    (api/callback本来就接收列表). 连接失败按指数退避重试, 重试仍失败则追加写入spill_path,
+    启动时和下一次发送成功后再从磁盘重新发送, 调度中心短暂不可用或者进程重启时不会丢失回调.
+    调度中心明确拒绝(XXLRegisterError等)的回调重试也没用, 逐条重发后丢弃被拒绝的那条.
+    """
+
+    def __init__(
+        self,
+        client: "XXL",
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        retry_times: int = 3,
+        retry_interval: float = 1,
+        spill_path: Optional[str] = None,
+    ) -> None:
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_times = retry_times
+        self.retry_interval = retry_interval
+        self.spill_path = spill_path
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._task = asyncio.create_task(self._run(), name="pyxxl-callback")
+
+    async def put(self, item: Dict[str, Any]) -> None:
+        if not self.running:
+            self.start()
+        await self.queue.put(item)
+
+    async def close(self) -> None:
+        """等待队列中剩余的回调发送完后停止"""
+        if not self.running:
+            return
+        await self.queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        await self._load_spilled()
+        while True:
+            batch = await self._next_batch()
+            try:
+                if await self._flush(batch):
+                    await self._load_spilled()
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> bool:
+        """发送一批回调, 调度中心不可用时返回False"""
+        for times in range(1, self.retry_times + 1):
+            try:
+                await self.client._post("callback", batch, retry_times=1)
+                logger.debug("Callback successful. %s" % batch)
+                return True
+            except (ClientError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(
+                    "Callback %s results failed %s times: %s", len(batch), times, e
+                )
+                if times < self.retry_times:
+                    await asyncio.sleep(self.retry_interval * 2 ** (times - 1))
+            except Exception as e:
+                # 调度中心明确拒绝, 重试和落盘都没有用, 逐条重发找出被拒绝的回调后丢弃
+                if len(batch) > 1:
+                    for i, item in enumerate(batch):
+                        if not await self._flush([item]):
+                            await self._spill(batch[i + 1 :])
+                            return False
+                    return True
+                logger.error("Callback result rejected, dropped: %s, %s", batch, e)
+                return True
+        await self._spill(batch)
+        return False
+
+    async def _spill(self, batch: List[Dict[str, Any]]) -> None:
+        if not self.spill_path:
+            logger.error("Callback results lost: %s", batch)
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_spill, batch)
+        logger.error(
+            "Callback %s results failed, spilled to %s", len(batch), self.spill_path
+        )
+
+    def _write_spill(self, batch: List[Dict[str, Any]]) -> None:
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            for item in batch:
+                f.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+
+    async def _load_spilled(self) -> None:
+        if not self.spill_path:
+            return
+        reading_path = self.spill_path + ".reading"
+        if not os.path.exists(self.spill_path) and not os.path.exists(reading_path):
+            return
+        loop = asyncio.get_running_loop()
+        items = await loop.run_in_executor(None, self._read_spill, reading_path)
+        if items:
+            logger.info("Resend %s spilled callback results", len(items))
+        for start in range(0, len(items), self.batch_size):
+            if not await self._flush(items[start : start + self.batch_size]):
+                # 失败的这一批已经重新落盘, 剩下的也写回去, 下次再发
+                rest = items[start + self.batch_size :]
+                if rest:
+                    await self._spill(rest)
+                break
+        # 每一条都已经被调度中心确认或者重新落盘, 才能删除; 中途进程退出时下次启动重新发送
+        await loop.run_in_executor(None, os.remove, reading_path)
+
+    def _read_spill(self, reading_path: str) -> List[Dict[str, Any]]:
+        # 先改名再读取, 重发失败时会写入新的文件; 上次进程退出时没有发完的.reading文件优先发送
+        if not os.path.exists(reading_path):
+            os.replace(self.spill_path, reading_path)
+        items = []
+        with open(reading_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    items.append(json.loads(line))
+        return items
+
+
 class XXL:
+    """调度中心的客户端, 注册、回调和动态任务接口共用一个连接池
+
+    - 连接池有上限, 保持长连接并缓存DNS, 不会每次请求都重新建立连接
+    - 连接错误、超时和5xx按指数退避重试, retry_times为RETRY_FOREVER时一直重试
+    """
+
     def __init__(
         self,
         admin_url: str,
         token: Optional[str] = None,
         loop: Optional[asyncio.AbstractEventLoop] = None,
-        retry_times: int = 0,
-        retry_interval: int = 5,
+        retry_times: int = RETRY_FOREVER,
+        retry_interval: float = 1,
+        max_retry_interval: float = 60,
         session: Optional[aiohttp.ClientSession] = None,
+        callback_batch_size: int = 100,
+        callback_flush_interval: float = 1.0,
+        callback_spill_path: Optional[str] = None,
+        remote_cookie: Optional[str] = None,
+        pool_size: int = 100,
+        keepalive_timeout: float = 30,
+        timeout: float = 30,
         **kwargs: Any,
     ) -> None:
         self.loop = loop or asyncio.get_event_loop()
@@ -47,18 +223,36 @@ class XXL:
 
         # https://docs.aiohttp.org/en/stable/client_reference.html#baseconnector
         self.url_path = _admin_url.path
+        # 动态任务的接口不在api/下面
+        self.admin_path = (
+            self.url_path[: -len("api/")]
+            if self.url_path.endswith("/api/")
+            else self.url_path
+        )
         if not session:  # for pytest
+            kwargs.setdefault("limit", pool_size)
+            kwargs.setdefault("keepalive_timeout", keepalive_timeout)
+            kwargs.setdefault("ttl_dns_cache", 300)
             self.conn = aiohttp.TCPConnector(**kwargs)
             session = aiohttp.ClientSession(
                 base_url=_admin_url.origin(),
                 connector=self.conn,
+                timeout=aiohttp.ClientTimeout(total=timeout),
             )
 
         self.session = session
 
         self.retry_times = retry_times
         self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
         self.headers = {"XXL-JOB-ACCESS-TOKEN": token} if token else {}
+        self.cookies = {"REMOTE_COOKIE": remote_cookie} if remote_cookie else {}
+        self.callback_sender = CallbackSender(
+            self,
+            batch_size=callback_batch_size,
+            flush_interval=callback_flush_interval,
+            spill_path=callback_spill_path,
+        )
 
     async def registry(self, key: str, value: str) -> bool:
         payload = dict(registryGroup="EXECUTOR", registryKey=key, registryValue=value)
@@ -68,52 +262,114 @@ class XXL:
             return True
         except XXLRegisterError as e:
             logger.error("Registry executor failed. %s", e.message)
+        except ClientError as e:
+            # 注册是循环调用的, 连接失败等下一次
+            logger.error("Registry executor failed. %s", e.message)
         return False
 
     async def registryRemove(self, key: str, value: str) -> None:
         payload = dict(registryGroup="EXECUTOR", registryKey=key, registryValue=value)
-        await self._post("registryRemove", payload)
-        logger.info("RegistryRemove successful. %s" % payload)
+        try:
+            await self._post("registryRemove", payload, retry_times=3)
+            logger.info("RegistryRemove successful. %s" % payload)
+        except (XXLRegisterError, ClientError) as e:
+            logger.error("RegistryRemove failed. %s", e.message)
 
     async def callback(
         self, log_id: int, timestamp: int, code: int = 200, msg: str = None
     ) -> None:
-        payload = [
-            {
-                "logId": log_id,
-                "logDateTim": timestamp,
-                "handleCode": code,
-                "handleMsg": msg,
-            }
-        ]
-        await self._post("callback", payload)
-        logger.debug("Callback successful. %s" % payload)
+        """回调执行结果, 结果会进入队列由CallbackSender批量发送"""
+        payload = {
+            "logId": log_id,
+            "logDateTim": timestamp,
+            "handleCode": code,
+            "handleMsg": msg,
+        }
+        await self.callback_sender.put(payload)
+
+    async def dynamic_register(self, job_info: Dict[str, Any]) -> Dict[str, Any]:
+        """动态添加任务, 返回调度中心的响应"""
+        return await self._request(
+            self.admin_path + "jobinfo/add_by_dynamic/",
+            retry_times=3,
+            data=job_info,
+            cookies=self.cookies,
+        )
+
+    async def cancel_dynamic_task(self, unique_key: str) -> Dict[str, Any]:
+        """取消动态添加的任务, 返回调度中心的响应"""
+        return await self._request(
+            self.admin_path + "jobinfo/dynamic_task/cancel/",
+            retry_times=3,
+            data={"uniqueKey": unique_key},
+            cookies=self.cookies,
+        )
 
     async def _post(
         self, path: str, payload: JsonType, retry_times: Optional[int] = None
     ) -> Response:
+        r = Response(
+            **(
+                await self._request(
+                    self.url_path + path,
+                    retry_times=retry_times,
+                    json=payload,
+                    headers=self.headers,
+                )
+            )
+        )
+        if not r.ok:
+            raise XXLRegisterError(r.msg or "")
+        return r
+
+    async def _request(
+        self, url: str, retry_times: Optional[int] = None, **kwargs: Any
+    ) -> Any:
+        """POST请求调度中心并返回json, 4xx直接抛出XXLRegisterError, 重试用完后抛出ClientError"""
+        started = time.monotonic()
+        path = url[len(self.admin_path) :] if url.startswith(self.admin_path) else url
+        try:
+            result = await self._request_with_retry(url, retry_times, **kwargs)
+        except BaseException:
+            metrics.ADMIN_REQUEST_DURATION.observe(
+                time.monotonic() - started, path=path, status="error"
+            )
+            raise
+        metrics.ADMIN_REQUEST_DURATION.observe(
+            time.monotonic() - started, path=path, status="ok"
+        )
+        return result
+
+    async def _request_with_retry(
+        self, url: str, retry_times: Optional[int], **kwargs: Any
+    ) -> Any:
         times = 1
-        retry_times = retry_times or self.retry_times
-        while times <= retry_times or retry_times == 0:
+        if retry_times is None:
+            retry_times = self.retry_times
+        while True:
             try:
-                async with self.session.post(
-                    self.url_path + path, json=payload, headers=self.headers
-                ) as response:
+                async with self.session.post(url, **kwargs) as response:
                     if response.status == 200:
-                        r = Response(**(await response.json()))
-                        if not r.ok:
-                            raise XXLRegisterError(r.msg or "")
-                        return r
-                    raise XXLRegisterError(await response.text())
-            except aiohttp.ClientConnectionError as e:
-                logger.error(
-                    f"Connection error {times} times: {str(e)}, retry afert {self.retry_interval}"
+                        return await response.json(content_type=None)
+                    if response.status < 500:
+                        raise XXLRegisterError(await response.text())
+                    reason = "HTTP %s" % response.status
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                reason = str(e) or e.__class__.__name__
+            if retry_times != RETRY_FOREVER and times >= retry_times:
+                raise ClientError(
+                    "Connection error, retry times {}: {}".format(times, reason)
                 )
-                await asyncio.sleep(self.retry_interval)
-                times += 1
-                return True  # type: ignore
-        raise ClientError("Connection error, retry times {}".format(times))
+            interval = min(
+                self.retry_interval * 2 ** (times - 1), self.max_retry_interval
+            )
+            logger.error(
+                f"Connection error {times} times: {reason}, retry after {interval}s"
+            )
+            await asyncio.sleep(interval)
+            times += 1
 
     async def close(self) -> None:
+        await self.callback_sender.close()
         await self.session.close()
         logger.info("http session is closed.")
@@ -0,0 +1,35 @@
+import pytest
+
+from peach.admin.models import User
+from peach.django.models import keyset_paginate
+
+
+@pytest.mark.django_db(transaction=True)
+def test_keyset_paginate():
+    users = [
+        User.objects.create(name=f"keyset-{i}", password="xxxxx") for i in range(5)
+    ]
+    ids = [user.id for user in users]
+    query = User.objects.filter(name__startswith="keyset-")
+
+    page, cursor = keyset_paginate(query, None, 2)
+    assert [user.id for user in page] == ids[:2]
+    page, cursor = keyset_paginate(query, cursor, 2)
+    assert [user.id for user in page] == ids[2:4]
+    # 最后一页不满一页, 没有下一页的游标
+    page, cursor = keyset_paginate(query, cursor, 2)
+    assert [user.id for user in page] == ids[4:]
+    assert cursor is None
+
+    # values()和倒序, pk换成主键字段名后从dict中取值
+    query = query.values("id", "name")
+    page, cursor = keyset_paginate(query, None, 3, order_by=("-pk",))
+    assert [row["id"] for row in page] == ids[:1:-1]
+    page, cursor = keyset_paginate(query, cursor, 3, order_by=("-pk",))
+    assert [row["id"] for row in page] == ids[1::-1]
+    assert cursor is None
+
+    with pytest.raises(ValueError):
+        keyset_paginate(query.values("name"), None, 2)
+    with pytest.raises(ValueError):
+        keyset_paginate(query.values_list("id", "name"), None, 2)
@@ -0,0 +1,12 @@
+from peach.report import benchmark
+
+
+def test_bench_engine(tmp_path):
+    result = benchmark.bench_engine("csv", 25, 6, 10, benchmark.TYPES, str(tmp_path))
+    assert result["case"] == "engine:csv"
+    assert result["rows"] == 25
+    assert result["file_size"] > 0
+
+    baseline = [dict(result, rows_per_sec=result["rows_per_sec"] / 2)]
+    assert benchmark.compare([result], baseline) == {"engine:csv": 100.0}
+    assert "engine:csv" in benchmark.format_results([result], baseline)
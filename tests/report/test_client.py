@@ -1,11 +1,21 @@
 import json
+import os
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from enum import unique, IntEnum
 from typing import Optional
 
 from peach.misc.dtos import PaginationCriteriaDTO
-from peach.report.client import _dict_to_dto
+from peach.report import cache
+from peach.report.client import (
+    ReportCheckpoint,
+    ReportClient,
+    ReportTaskInfo,
+    _dict_to_dto,
+)
 
 
 @dataclass
@@ -61,3 +71,234 @@ def test_dict_to_dto():
     print("=============>2: ", data)
     ret = _dict_to_dto(json.loads(data), AddCoinFormCriteria)
     print("\n", ret)
+
+
+def _iter_page_nos(func, page_no=1):
+    return [
+        (page.page_no, page.items)
+        for page in ReportClient._iter_pages(func, {"page_no": page_no, "page_size": 2})
+    ]
+
+
+def test_iter_pages_prefetch():
+    requested = []
+
+    def report(filter_params):
+        page_no = filter_params["page_no"]
+        requested.append(page_no)
+        time.sleep(0.01 * (5 - page_no) if page_no < 5 else 0)
+        items = [[page_no, i] for i in range(2)] if page_no <= 3 else []
+        return len(items), ["page", "index"], items
+
+    sequential = _iter_page_nos(report)
+    assert [page for page, _ in sequential] == [1, 2, 3, 4]
+
+    requested.clear()
+    report.prefetch_pages = 3
+    assert _iter_page_nos(report) == sequential
+    # 空页之后最多多查询prefetch_pages - 1页
+    assert max(requested) <= 6
+
+
+def test_iter_pages_cursor():
+    rows = list(range(7))
+    cursors = []
+
+    def report(filter_params):
+        cursor = filter_params.get("cursor")
+        cursors.append(cursor)
+        start = 0 if cursor is None else int(cursor) + 1
+        items = [[e] for e in rows[start : start + filter_params["page_size"]]]
+        next_cursor = (
+            str(items[-1][0]) if len(items) == filter_params["page_size"] else None
+        )
+        return len(items), ["id"], items, next_cursor
+
+    pages = _iter_page_nos(report)
+    assert [items for _, items in pages] == [[[0], [1]], [[2], [3]], [[4], [5]], [[6]]]
+    assert cursors == [None, "1", "3", "5"]
+
+
+def test_execute_task_resume_from_checkpoint(tmp_path, monkeypatch):
+    client = ReportClient(
+        "http://report/", "key", "secret", temp_file_dir=str(tmp_path)
+    )
+    uploaded = []
+    monkeypatch.setattr(
+        client,
+        "_upload_file",
+        lambda task_id, items_count: uploaded.append(items_count),
+    )
+    requested = []
+
+    def report(filter_params):
+        page_no = filter_params["page_no"]
+        requested.append(page_no)
+        if page_no == 3 and requested.count(3) == 1:
+            raise RuntimeError("query failed")
+        items = [[page_no, i] for i in range(2)] if page_no <= 4 else []
+        return len(items), ["page", "index"], items
+
+    monkeypatch.setitem(ReportClient.report_types, "test_resume", report)
+    client.cur_task = {
+        1: ReportTaskInfo(1, "test_resume", "csv", "resume.csv", 1, 2, None, None, None)
+    }
+
+    assert client.execute_task(1)
+    assert requested == [1, 2, 3, 3, 4, 5]
+    assert uploaded == [8]
+    with open(tmp_path / "file" / "resume.csv", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "page,index"
+    assert lines[1:] == [f"{page},{i}" for page in range(1, 5) for i in range(2)]
+
+
+def test_fetch_task_keeps_checkpoint(tmp_path, monkeypatch):
+    client = ReportClient(
+        "http://report/", "key", "secret", temp_file_dir=str(tmp_path)
+    )
+    task = {
+        "id": 1,
+        "report_type": "a",
+        "file_type": "csv",
+        "file_name": "1.csv",
+        "page_no": 1,
+        "page_size": 1000,
+        "filter_conditions": None,
+        "executor": None,
+        "include_fields": None,
+    }
+    monkeypatch.setattr(client, "_do_get", lambda url, params: [task])
+    client._rpc_fetch_task()
+    checkpoint = ReportCheckpoint(3, None, 2000, 4096)
+    client._save_checkpoint(1, checkpoint)
+
+    # 任务失败后服务端重新下发, 从保存的断点继续
+    client._rpc_fetch_task()
+    assert client.cur_task[1].checkpoint == checkpoint
+    client.cur_task = {}
+    assert client._load_conf_from_local()
+    assert client.cur_task[1].checkpoint == checkpoint
+
+
+def test_meta_round_trip(tmp_path):
+    client = ReportClient(
+        "http://report/", "key", "secret", temp_file_dir=str(tmp_path)
+    )
+    client.cur_task = {
+        1: ReportTaskInfo(
+            1, "a", "csv", "1.csv", 1, 1000, '{"user_id": 1}', None, "id,name"
+        ),
+        2: ReportTaskInfo(
+            2,
+            "b",
+            "csv.gz",
+            "2.csv.gz",
+            1,
+            1000,
+            None,
+            "mod.func",
+            None,
+            ReportCheckpoint(3, "WzJd", 2000, 4096),
+        ),
+    }
+    client._save_conf_to_local()
+    tasks = client.cur_task
+
+    client.cur_task = {}
+    assert client._load_conf_from_local()
+    assert client.cur_task == tasks
+    assert not list(tmp_path.glob("meta.*.tmp"))
+
+    # 旧版本的pickle格式
+    with open(client.meta_file, "wb") as f:
+        f.write(pickle.dumps({1: tasks[1]}))
+    assert client._load_conf_from_local()
+    assert client.cur_task == {1: tasks[1]}
+
+
+def test_execute_task_export_cache(tmp_path, monkeypatch):
+    client = ReportClient(
+        "http://report/", "key", "secret", temp_file_dir=str(tmp_path)
+    )
+    uploaded = []
+    monkeypatch.setattr(
+        client,
+        "_upload_file",
+        lambda task_id, items_count: uploaded.append((task_id, items_count)),
+    )
+    requested = []
+
+    def report(filter_params):
+        requested.append(filter_params["page_no"])
+        items = [[1, "a"], [2, "b"]] if filter_params["page_no"] == 1 else []
+        return len(items), ["id", "name"], items
+
+    report.cache_ttl = 60
+    monkeypatch.setitem(ReportClient.report_types, "test_cache", report)
+
+    saved_checkpoints = []
+    save_checkpoint = client._save_checkpoint
+
+    def _save_checkpoint(task_id, checkpoint):
+        saved_checkpoints.append((task_id, checkpoint))
+        save_checkpoint(task_id, checkpoint)
+
+    monkeypatch.setattr(client, "_save_checkpoint", _save_checkpoint)
+
+    def run(task_id, filter_params, checkpoint=None):
+        client.cur_task = {
+            task_id: ReportTaskInfo(
+                task_id,
+                "test_cache",
+                "csv",
+                f"{task_id}.csv",
+                1,
+                1000,
+                filter_params,
+                None,
+                None,
+                checkpoint,
+            )
+        }
+        assert client.execute_task(task_id)
+        with open(tmp_path / "file" / f"{task_id}.csv", encoding="utf-8") as f:
+            return f.read()
+
+    content = run(1, '{"user_id": 1}')
+    assert run(2, '{"user_id": 1}') == content
+    assert requested == [1, 2]
+    assert uploaded == [(1, 2), (2, 2)]
+
+    run(3, '{"user_id": 2}')
+    assert requested == [1, 2, 1, 2]
+
+    # 命中缓存时清除上一次失败留下的断点
+    saved_checkpoints.clear()
+    run(5, '{"user_id": 2}', ReportCheckpoint(2, None, 1, 10))
+    assert requested == [1, 2, 1, 2]
+    assert saved_checkpoints == [(5, None)]
+
+    assert client.invalidate_cache("test_cache") == 2
+    run(4, '{"user_id": 1}')
+    assert requested == [1, 2, 1, 2, 1, 2]
+
+
+def test_export_cache_concurrent_put(tmp_path):
+    export_cache = cache.ExportCache(str(tmp_path / "cache"))
+    files = []
+    for i in range(8):
+        path = tmp_path / f"{i}.csv"
+        path.write_text("id\n1\n")
+        files.append(str(path))
+
+    # 多个线程同时写入同一个key, 临时文件互不影响
+    with ThreadPoolExecutor(8) as pool:
+        list(
+            pool.map(
+                lambda f: export_cache.put("key", "test", f, 1, 60),
+                files,
+            )
+        )
+    assert sorted(os.listdir(tmp_path / "cache")) == ["key", "key.json"]
+    assert export_cache.get("key", str(tmp_path / "out.csv")) == 1
@@ -0,0 +1,103 @@
+import csv
+import gzip
+import zipfile
+
+import pytest
+
+from peach.report.engines import Csv, CsvGz, ExportRowLimitExceeded, Xlsx
+
+HEADER = {"id": "ID", "name": "名称", "remark": "备注"}
+
+
+def _export(engine, pages, **kwargs):
+    for page in pages:
+        engine.process_page(page, **kwargs)
+    engine.export()
+
+
+def test_csv_streaming(tmp_path):
+    file_name = str(tmp_path / "report.csv")
+    engine = Csv(file_name, mode="w+")
+    pages = [[[1, "a", "x"], [2, "b,c", None]], [[3, "c", "z"]], []]
+    _export(engine, pages, header=HEADER, include_fields="id,name")
+
+    with open(file_name, encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [["ID", "名称"], ["1", "a"], ["2", "b,c"], ["3", "c"]]
+    assert engine.rows_written == 3
+
+
+def test_csv_matches_to_csv(tmp_path):
+    import pandas as pd
+
+    file_name = str(tmp_path / "report.csv")
+    engine = Csv(file_name, mode="w+")
+    pages = [[[1, "a", "x"], [2, "b,c", None]], [[3, "c\nd", "z"]]]
+    _export(engine, pages, header=HEADER)
+
+    df = pd.DataFrame(
+        [row for page in pages for row in page], columns=list(HEADER.values())
+    )
+    with open(file_name, "rb") as f:
+        assert f.read() == df.to_csv(index=False).encode("utf-8")
+
+
+def test_csv_gz_not_resumable(tmp_path):
+    engine = CsvGz(str(tmp_path / "report.csv.gz"))
+    assert engine.flush() is None
+    with pytest.raises(ValueError, match="not resumable"):
+        engine.resume(0)
+
+
+def test_csv_gz_streaming(tmp_path):
+    file_name = str(tmp_path / "report.csv.gz")
+    engine = CsvGz(file_name)
+    _export(engine, [[[1, "a", "x"]], [[2, "b", "y"]]], header=HEADER)
+
+    with gzip.open(file_name, "rt", encoding="utf-8", newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [["ID", "名称", "备注"], ["1", "a", "x"], ["2", "b", "y"]]
+
+
+def test_xlsx_streaming(tmp_path):
+    file_name = str(tmp_path / "report.xlsx")
+    engine = Xlsx(file_name, mode="w+")
+    pages = [[[1, "a", {"k": 1}]], [[2, "b", None]]]
+    _export(engine, pages, header=HEADER)
+
+    assert engine.rows_written == 2
+    with zipfile.ZipFile(file_name) as f:
+        sheet = f.read("xl/worksheets/sheet1.xml").decode()
+    assert sheet.count("<row ") == 3
+
+
+def test_xlsx_row_limit(tmp_path):
+    # 写到最后一行后再写就超过了xlsx的行数上限
+    engine = Xlsx(str(tmp_path / "limit.xlsx"), mode="w+")
+    engine.open()
+    engine._row = engine._worksheet.xls_rowmax - 1
+    engine.write_rows([[1, "a", None]])
+    with pytest.raises(ExportRowLimitExceeded):
+        engine.write_rows([[2, "b", None]])
+    engine.close()
+
+
+def test_export_without_pages(tmp_path):
+    file_name = str(tmp_path / "empty.csv")
+    Csv(file_name).export()
+    with open(file_name, encoding="utf-8") as f:
+        assert f.read() == ""
+
+
+def test_include_fields_keep_types(tmp_path):
+    engine = Csv(str(tmp_path / "report.csv"))
+    engine.pre_process(
+        [[1, "a", None], [2, "b", 1.5]], header=HEADER, include_fields="id,remark"
+    )
+    assert engine._page_data == [(1, None), (2, 1.5)]
+    engine.pre_process([[3, "c", "z"]])
+    assert engine._page_data == [(3, "z")]
+
+    engine = Csv(str(tmp_path / "report.csv"))
+    engine.pre_process([[1, "a", None]], header=HEADER, include_fields="name")
+    assert engine._page_data == [("a",)]
@@ -0,0 +1,62 @@
+from peach.report.client import ReportClient, ReportTaskInfo
+from peach.report.executor import TaskProcessThread
+
+
+def _task(task_id, report_type):
+    return ReportTaskInfo(
+        task_id, report_type, "csv", f"{task_id}.csv", 1, 1000, None, None, None
+    )
+
+
+def test_schedule_small_tasks_first(monkeypatch):
+    client = ReportClient(
+        None, None, None, debug=True, max_concurrent_tasks=3, large_task_rows=1000
+    )
+    client._record_task_rows("big", 50000)
+    client._record_task_rows("small", 10)
+    client.cur_task = {
+        1: _task(1, "big"),
+        2: _task(2, "big"),
+        3: _task(3, "big"),
+        4: _task(4, "small"),
+    }
+    monkeypatch.setattr("peach.report.executor.report_client", client)
+
+    selected = TaskProcessThread._schedule({}, 3)
+    assert selected == [(4, False), (1, True), (2, True)]
+
+    # 大任务最多占用slots - 1个位置, 剩下的位置留给小任务
+    running = {1: (None, True), 2: (None, True)}
+    assert TaskProcessThread._schedule(running, 3) == [(4, False)]
+    del client.cur_task[4]
+    assert TaskProcessThread._schedule(running, 3) == []
+
+
+def test_schedule_waiting_large_task(monkeypatch):
+    client = ReportClient(
+        None,
+        None,
+        None,
+        debug=True,
+        max_concurrent_tasks=2,
+        large_task_rows=1000,
+        max_task_wait=60,
+    )
+    client._record_task_rows("big", 50000)
+    client._record_task_rows("small", 10)
+    client.cur_task = {1: _task(1, "big"), 2: _task(2, "small")}
+    monkeypatch.setattr("peach.report.executor.report_client", client)
+
+    waiting_since = {}
+    running = {3: (None, False)}
+    assert TaskProcessThread._schedule(running, 2, waiting_since, now=0) == [(2, False)]
+    # 一直有新的小任务时, 等待超过max_task_wait的大任务优先执行
+    running = {2: (None, False), 3: (None, False)}
+    client.cur_task[4] = _task(4, "small")
+    assert TaskProcessThread._schedule(running, 2, waiting_since, now=30) == []
+    running = {}
+    client.cur_task[5] = _task(5, "small")
+    del client.cur_task[2]
+    selected = TaskProcessThread._schedule(running, 2, waiting_since, now=61)
+    assert selected == [(1, True), (4, False)]
+    assert set(waiting_since) == {1, 4, 5}
@@ -0,0 +1,27 @@
+import email
+
+from peach.report import upload
+
+
+def test_multipart_file_stream(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload, "CHUNK_SIZE", 7)
+    file_path = tmp_path / "report.csv"
+    file_path.write_bytes(b"id,name\r\n" + b"1,a\r\n" * 100)
+
+    with upload.MultipartFileStream(
+        {"task_id": 1, "items_count": None, "sign": "AB"}, "export_file", str(file_path)
+    ) as body:
+        data = b"".join(body)
+        assert len(data) == len(body)
+
+    message = email.message_from_bytes(
+        b"Content-Type: " + body.content_type.encode() + b"\r\n\r\n" + data
+    )
+    parts = {
+        part.get_param("name", header="content-disposition"): part
+        for part in message.get_payload()
+    }
+    assert list(parts) == ["task_id", "sign", "export_file"]
+    assert parts["task_id"].get_payload() == "1"
+    assert parts["export_file"].get_filename() == "report.csv"
+    assert parts["export_file"].get_payload(decode=True) == file_path.read_bytes()
@@ -22,6 +22,17 @@ REPORT_CONG = {
     "debug": "xxx",
 }
 
+IM = {
+    "slack": {"xxl-job": {"token": "x", "channel": "x"}},
+}
+
+XXL_JOB = {
+    "appname": "xxl-job-executor-test",
+    "executor_port": 9999,
+    "xxl_admin_k8s_baseurl": "http://127.0.0.1:8080/xxl-job-admin/",
+    "xxl_admin_web_baseurl": "http://127.0.0.1:8080/xxl-job-admin/",
+}
+
 USE_TZ = True
 pymysql.install_as_MySQLdb()
 DATABASES = {
@@ -34,6 +45,8 @@ DATABASES = {
     }
 }
 
+REDIS_URL = "redis://127.0.0.1:6379/0"
+
 MEMCACHED_ENABLE = True
 MEMCACHED_URL = "127.0.0.1:11211"
 
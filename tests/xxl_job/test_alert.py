@@ -0,0 +1,29 @@
+import asyncio
+
+from peach.xxl_job.pyxxl.alert import FAILED, NOT_FOUND, AlertSender
+
+
+def test_alert_digest():
+    async def _test():
+        digests = []
+        sender = AlertSender(window=0.05, min_interval=0.2, send=digests.append)
+        for log_id in [1, 2, 2, 3]:
+            sender.put(FAILED, "sync_users", "alice", log_id)
+        sender.put(NOT_FOUND, "missing", "bob", 4)
+        await asyncio.sleep(0.1)
+        # 同一个handler窗口内只发一条, 重复的logId只算一次
+        assert sorted((d.kind, d.handler, d.count) for d in digests) == [
+            (FAILED, "sync_users", 3),
+            (NOT_FOUND, "missing", 1),
+        ]
+        # 间隔min_interval内的告警合并到下一条
+        sender.put(FAILED, "sync_users", "alice", 5)
+        sender.put(FAILED, "sync_users", "carol", 6)
+        await asyncio.sleep(0.1)
+        assert len(digests) == 2
+        await sender.close()
+        assert len(digests) == 3
+        assert list(digests[-1].log_ids) == [5, 6]
+        assert list(digests[-1].authors) == ["alice", "carol"]
+
+    asyncio.run(_test())
@@ -0,0 +1,37 @@
+import contextvars
+import threading
+
+import pytest
+
+from peach.xxl_job.pyxxl.ctx import CancelToken, g2, get_cancel_token
+from peach.xxl_job.pyxxl.error import JobCancelledError
+from peach.xxl_job.pyxxl.log import XxlJobLogger
+
+logger = XxlJobLogger(__name__)
+
+
+def test_cancel_token():
+    token = CancelToken()
+    token.check()
+    token.cancel("timeout")
+    assert token.cancelled
+    with pytest.raises(JobCancelledError):
+        token.sleep(10)
+
+
+def test_cancel_token_in_context():
+    token = CancelToken()
+    context = contextvars.copy_context()
+    context.run(g2.set_cancel_token, token)
+    assert get_cancel_token() is None
+
+    def _handler():
+        assert get_cancel_token() is token
+        threading.Timer(0.05, token.cancel).start()
+        while True:
+            # logger会自动检查取消标记
+            logger.info("working")
+            token.sleep(0.01)
+
+    with pytest.raises(JobCancelledError):
+        context.run(_handler)
@@ -0,0 +1,215 @@
+import asyncio
+import threading
+
+from types import SimpleNamespace
+
+import pytest
+
+from peach.xxl_job.pyxxl import error, metrics
+from peach.xxl_job.pyxxl.enum import executorBlockStrategy
+from peach.xxl_job.pyxxl.executor import Executor, JobHandler
+from peach.xxl_job.pyxxl.run_store import QUEUED, RUNNING
+from peach.xxl_job.pyxxl.schema import RunData
+
+
+class FakeExecutor(Executor):
+    """不访问数据库和调度中心, 只记录执行顺序"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = []
+        self.release = asyncio.Event()
+
+    async def _run(self, handler, start_time, data):
+        self.started.append(data.logId)
+        try:
+            await self.release.wait()
+        finally:
+            await self._finish(data.jobId, data.logId)
+
+
+def _run_data(job_id, log_id, strategy=executorBlockStrategy.SERIAL_EXECUTION.value):
+    return RunData(
+        jobId=job_id,
+        logId=log_id,
+        executorHandler="demo",
+        executorBlockStrategy=strategy,
+        traceID=str(log_id),
+        author="",
+        dynamicAdd=0,
+    )
+
+
+class FakeClient:
+    def __init__(self):
+        self.results = []
+
+    async def callback(self, log_id, timestamp, code=200, msg=None):
+        self.results.append((log_id, code))
+
+
+def _executor(max_concurrency=1, max_workers=10, run_store_path=""):
+    handler = JobHandler()
+
+    @handler.register(name="demo", replace=True, max_concurrency=max_concurrency)
+    async def demo():
+        pass
+
+    # ExecutorConfig会读取本机网络地址, 这里只需要执行器用到的几个参数
+    config = SimpleNamespace(
+        max_workers=max_workers,
+        shard_max_workers=2,
+        shard_process_workers=1,
+        process_workers=0,
+        db_max_workers=2,
+        task_queue_length=30,
+        run_store_path=run_store_path,
+        alert_window=60,
+        alert_min_interval=600,
+        capture_logging=False,
+    )
+    return FakeExecutor(
+        FakeClient(), config, handler=handler, loop=asyncio.get_event_loop()
+    )
+
+
+def test_serial_queue_and_concurrency():
+    async def _test():
+        executor = _executor(max_concurrency=2)
+        for log_id in range(5):
+            await executor.run_job(_run_data(1, log_id))
+        await executor.run_job(_run_data(2, 10))
+        await asyncio.sleep(0)
+        # 同一个jobId最多同时执行2个, 其他的在队列里; 不同jobId互不影响
+        assert executor.started == [0, 1, 10]
+        assert len(executor.queue[1]) == 3
+        executor.release.set()
+        await executor.graceful_close(timeout=5)
+        assert sorted(executor.started) == [0, 1, 2, 3, 4, 10]
+        assert executor.running_count == 0
+        assert not executor.queue
+        # 每个jobId的锁用完后回收
+        assert not executor.locks
+        assert metrics.RUN_REQUESTS.get(handler="demo", result="queued") >= 3
+        assert metrics.QUEUE_WAIT.count(handler="demo") >= 3
+
+    asyncio.run(_test())
+
+
+def test_admission_limit():
+    async def _test():
+        executor = _executor(max_workers=2)
+        await executor.run_job(_run_data(1, 1))
+        await executor.run_job(_run_data(2, 2))
+        with pytest.raises(error.ExecutorBusyError):
+            await executor.run_job(_run_data(3, 3))
+        executor.release.set()
+        await executor.graceful_close(timeout=5)
+
+    asyncio.run(_test())
+
+
+def test_recover_from_run_store(tmp_path):
+    path = str(tmp_path / "runs.db")
+
+    async def _before_restart():
+        executor = _executor(run_store_path=path)
+        for log_id in range(3):
+            await executor.run_job(_run_data(1, log_id))
+        await asyncio.sleep(0)
+        assert len(executor.run_store) == 3
+        # 排队中的任务开始执行时更新状态和开始时间
+        executor.run_store.put(_run_data(1, 9), QUEUED, 1)
+        await executor.run_store.put(_run_data(1, 9), RUNNING, 2)
+        assert executor.run_store.load()[-1][:2] == (RUNNING, 2)
+        await executor.run_store.remove(9)
+        # 模拟进程被kill, 之后不会再写入
+        executor.run_store.close()
+        executor.run_store = None
+        executor.queue.clear()
+
+    async def _after_restart():
+        executor = _executor(run_store_path=path)
+        await executor.recover()
+        await asyncio.sleep(0)
+        # 执行中的任务回调失败, 排队中的任务按顺序重新执行
+        assert executor.xxl_client.results == [(0, 500)]
+        assert executor.started == [1]
+        executor.release.set()
+        await executor.graceful_close(timeout=5)
+        assert executor.started == [1, 2]
+        assert len(executor.run_store) == 0
+        executor.run_store.close()
+
+    asyncio.run(_before_restart())
+    asyncio.run(_after_restart())
+
+
+def test_bulk_dynamic_register():
+    async def _test():
+        in_flight = []
+
+        async def add(payload):
+            in_flight.append(payload)
+            assert len(in_flight) <= 3
+            await asyncio.sleep(0.001)
+            in_flight.remove(payload)
+            if payload == "bad":
+                raise error.ClientError("connection error")
+            if payload == "broken":
+                raise KeyError("code")
+            return {"code": 200 if payload != "exists" else 500}
+
+        keys = ["a", "bad", "b", "exists", "broken", "c", "d"]
+        return await JobHandler._bulk(((k, k) for k in keys), add, concurrency=3)
+
+    result = asyncio.run(_test())
+    assert [r.key for r in result.results] == [
+        "a",
+        "bad",
+        "b",
+        "exists",
+        "broken",
+        "c",
+        "d",
+    ]
+    assert result.succeeded == 4
+    # 其他异常也只记录在这一条的结果里
+    assert [(r.key, r.error) for r in result.failed] == [
+        ("bad", "connection error"),
+        ("exists", None),
+        ("broken", "KeyError('code')"),
+    ]
+    assert result.throughput > 0
+
+
+def test_sync_dynamic_task_uses_admin_client():
+    # 执行器的事件循环在主线程, 同步任务在线程池中调用同步接口
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    calls = []
+
+    async def cancel(unique_key):
+        calls.append((unique_key, asyncio.get_running_loop()))
+        return {"code": 200}
+
+    JobHandler.set_admin_client(
+        SimpleNamespace(
+            loop=loop, session=SimpleNamespace(closed=False), cancel_dynamic_task=cancel
+        )
+    )
+    try:
+        assert JobHandler.cancel_dynamic_task("demo") == {"code": 200}
+        assert calls == [("demo", loop)]
+
+        async def _in_loop():
+            with pytest.raises(RuntimeError):
+                JobHandler.cancel_dynamic_task("demo")
+
+        asyncio.run(_in_loop())
+    finally:
+        JobHandler.set_admin_client(None)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
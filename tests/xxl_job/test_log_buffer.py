@@ -0,0 +1,156 @@
+import contextvars
+import logging
+
+from peach.xxl_job.pyxxl.ctx import g2
+from peach.xxl_job.pyxxl.log import RunLogHandler, XxlJobLogger
+from peach.xxl_job.pyxxl.log_buffer import (
+    SKIPPED_LINE,
+    RunLogBuffer,
+    RunLogRecord,
+    parse_lines,
+    read_lines,
+)
+
+logger = XxlJobLogger(__name__)
+
+
+def test_log_buffer_keep_all():
+    buf = RunLogBuffer()
+    for i in range(100):
+        buf.append("\nline %s" % i)
+    assert buf.getvalue() == "\n".join("line %s" % i for i in range(100))
+    assert not buf.truncated
+
+
+def test_log_buffer_head_tail():
+    buf = RunLogBuffer(max_length=500, head_length=200, tail_length=200)
+    text = ""
+    for i in range(1000):
+        chunk = "\nline %04d" % i
+        buf.append(chunk)
+        text += chunk
+
+    assert buf.truncated
+    assert len(buf) == len(text)
+    value = buf.getvalue()
+    # 头部和尾部各保留200个字符的整行, 中间的行号范围用一行省略号代替
+    assert value.startswith("line 0000\nline 0001\n")
+    assert value.endswith("\nline 0998\nline 0999")
+    assert value.count("\n") < 50
+    skipped = [line for line in value.split("\n") if "skipped" in line]
+    assert skipped == [SKIPPED_LINE.format(21, 980)]
+    # 中间的日志已经丢弃, 内存占用有上限
+    assert sum(len(c) for c in buf._tail) < 200 + 20
+
+
+def test_log_buffer_read_lines():
+    buf = RunLogBuffer(max_length=500, head_length=200, tail_length=200)
+    for i in range(100):
+        buf.append("\nline %03d\n     msg %03d" % (i, i))
+    assert buf.line_count == 200
+
+    to_line, lines = buf.read_lines(1, 3)
+    assert to_line == 3
+    assert lines == ["line 000", "     msg 000", "line 001"]
+
+    # 中间被丢弃的行用省略号代替, 直接跳到尾部保留的行
+    to_line, lines = buf.read_lines(100, 3)
+    assert lines[0].startswith("     ...... skipped lines ")
+    assert to_line == int(lines[1].split()[1]) * 2 + 2
+
+    to_line, lines = buf.read_lines(199, 1000)
+    assert (to_line, lines) == (200, ["line 099", "     msg 099"])
+    assert buf.read_lines(201, 1000) == (200, [])
+
+
+def test_log_buffer_read_lines_after_finish():
+    buf = RunLogBuffer(max_length=500, head_length=200, tail_length=200)
+    live = []
+    to_line = 0
+    for i in range(100):
+        buf.append("\nline %03d\n     msg %03d" % (i, i))
+        if i % 10 == 0:
+            to_line, lines = buf.read_lines(to_line + 1, 7)
+            live.extend(lines)
+
+    # 任务结束后从数据库读取, 接着执行中读到的行号继续读, 执行信息在最后
+    text = buf.getvalue() + "\n执行信息:\n执行状态 : 成功"
+    db_lines = parse_lines(text)
+    assert db_lines[-1][1] == buf.line_count + 2
+    while True:
+        to_line, lines = read_lines(db_lines, to_line + 1, 7)
+        if not lines:
+            break
+        live.extend(lines)
+
+    assert live[:2] == ["line 000", "     msg 000"]
+    assert live[-2:] == ["执行信息:", "执行状态 : 成功"]
+    assert len(live) == len(set(live))
+    numbers = [int(line.split()[1]) for line in live if line.startswith("line ")]
+    assert numbers == sorted(numbers)
+    assert to_line == buf.line_count + 2
+
+
+def test_log_buffer_lazy_record():
+    buf = RunLogBuffer()
+    record = RunLogRecord("INFO", "demo", "handler", 10, 1, "count=%s\nnext", (3,))
+    buf.append(record)
+    buf.append("\ntext line")
+    # 追加时不渲染
+    assert record._text is None
+    assert buf.line_count == 4
+    to_line, lines = buf.read_lines(2, 10)
+    assert (to_line, lines) == (4, ["     count=3", "next", "text line"])
+    assert 'in <span style="color: green;">handler</span>' in buf.getvalue()
+
+
+def test_log_record_formats_on_create():
+    items = [1]
+    record = RunLogRecord("INFO", "demo", "handler", 10, 1, "items=%s", (items,))
+    items.append(2)
+    # 记录的是打印时的值, 长度按格式化后的消息计算
+    assert record.message == "items=[1]"
+    big = RunLogRecord("INFO", "demo", "handler", 10, 1, "%s", ("x" * 10000,))
+    assert big.size > 10000
+
+
+def test_logger_writes_run_log():
+    context = contextvars.copy_context()
+    context.run(
+        g2.set_xxl_run_data, {"trace_id": "trace-lazy", "run_data": {"logId": 7}}
+    )
+    buf = RunLogBuffer()
+    other = RunLogBuffer()
+
+    def _handler():
+        logger.debug("skipped %s", 1)
+        logger.info("hello %s", "world")
+        logger.critical("critical")
+        logger.log(logging.WARNING, "level %s", 30)
+        logging.getLogger("test.stdlib").warning("stdlib")
+
+    handler = RunLogHandler("trace-lazy", buf)
+    other_handler = RunLogHandler("trace-other", other, capture_logging=True)
+    handler.attach()
+    other_handler.attach()
+    try:
+        context.run(_handler)
+    finally:
+        handler.detach()
+        other_handler.detach()
+    # DEBUG被级别过滤, 位置是调用方而不是log.py, 不记录标准logging和其他任务的日志
+    assert [r.message for r in buf._head] == ["hello world", "critical", "level 30"]
+    record = buf._head[0]
+    assert (record.func, record.log_id) == ("_handler", 7)
+    assert not other._head
+
+    # capture_logging时也记录标准logging的日志, 移除后不再记录
+    handler = RunLogHandler("trace-lazy", buf, capture_logging=True)
+    handler.attach()
+    try:
+        context.run(logging.getLogger("test.stdlib").warning, "stdlib")
+    finally:
+        handler.detach()
+    context.run(logger.info, "detached")
+    assert buf._head[-1].message == "stdlib"
+    assert len(buf._head) == 4
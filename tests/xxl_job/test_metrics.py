@@ -0,0 +1,23 @@
+from peach.xxl_job.pyxxl.metrics import Counter, Histogram, Registry
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    runs = registry.register(Counter("runs_total", "runs", ["handler"]))
+    duration = registry.register(
+        Histogram("duration_seconds", "duration", buckets=(0.1, 1))
+    )
+    runs.inc(handler="a")
+    runs.inc(2, handler='b"c')
+    for value in (0.05, 0.5, 5):
+        duration.observe(value)
+
+    text = registry.render()
+    assert "# TYPE runs_total counter" in text
+    assert 'runs_total{handler="a"} 1' in text
+    assert 'runs_total{handler="b\\"c"} 2' in text
+    assert 'duration_seconds_bucket{le="0.1"} 1' in text
+    assert 'duration_seconds_bucket{le="1"} 2' in text
+    assert 'duration_seconds_bucket{le="+Inf"} 3' in text
+    assert "duration_seconds_sum 5.55" in text
+    assert "duration_seconds_count 3" in text
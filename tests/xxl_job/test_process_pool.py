@@ -0,0 +1,69 @@
+import os
+import time
+
+import pytest
+
+from peach.xxl_job.pyxxl import error
+from peach.xxl_job.pyxxl.executor import JobHandler
+from peach.xxl_job.pyxxl.log import XxlJobLogger
+from peach.xxl_job.pyxxl.log_buffer import RunLogBuffer
+from peach.xxl_job.pyxxl.process_pool import ProcessPool
+from peach.xxl_job.pyxxl.schema import RunData
+
+logger = XxlJobLogger(__name__)
+handler = JobHandler()
+
+
+@handler.register(name="test_process_pid", executor="process", replace=True)
+def _process_pid():
+    logger.info("run in process")
+    return os.getpid()
+
+
+@handler.register(name="test_process_ppid", executor="process", replace=True)
+def _process_ppid():
+    return os.getppid()
+
+
+@handler.register(name="test_process_sleep", executor="process", replace=True)
+def _process_sleep():
+    time.sleep(10)
+
+
+def _run_ctx(name):
+    run_data = RunData(
+        jobId=1,
+        logId=1,
+        executorHandler=name,
+        executorBlockStrategy="SERIAL_EXECUTION",
+        traceID="test-" + name,
+        author="test",
+        dynamicAdd=0,
+    )
+    return {"xxl_kwargs": run_data, "run_data": {"logId": 1}}
+
+
+@pytest.fixture
+def pool():
+    pool = ProcessPool(1)
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+def test_process_pool_run(pool):
+    log_buffer = RunLogBuffer()
+    pid = pool.run("test_process_pid", _run_ctx("test_process_pid"), log_buffer, 10)
+    assert pid != os.getpid()
+    assert "run in process" in log_buffer.getvalue()
+
+
+def test_process_pool_timeout(pool):
+    with pytest.raises(error.JobTimeoutError):
+        pool.run("test_process_sleep", _run_ctx("test_process_sleep"), None, 0.5)
+    assert pool.killed == 1
+    # 被kill的子进程会由spawner进程补充一个新的, 不在当前进程的线程中fork
+    ppid = pool.run(
+        "test_process_ppid", _run_ctx("test_process_ppid"), RunLogBuffer(), 10
+    )
+    assert ppid == pool._spawner.process.pid
@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from peach.xxl_job.pyxxl.schema import RunData
+from peach.xxl_job.pyxxl.shard import ShardContext
+
+
+def _shard_context(index, total, pool):
+    run_data = RunData(
+        jobId=1,
+        logId=1,
+        executorHandler="test",
+        executorBlockStrategy="SERIAL_EXECUTION",
+        traceID="test",
+        author="test",
+        dynamicAdd=0,
+        broadcastIndex=index,
+        broadcastTotal=total,
+    )
+    return ShardContext.from_run_data(run_data, pool, lambda: pool)
+
+
+def test_shard_split():
+    assert ShardContext.split(list(range(10)), 3) == [
+        [0, 1, 2, 3],
+        [4, 5, 6],
+        [7, 8, 9],
+    ]
+    assert ShardContext.split([1], 4) == [[1]]
+    assert ShardContext.split([], 4) == []
+
+    with ThreadPoolExecutor(2) as pool:
+        shards = [_shard_context(i, 3, pool).shard(range(10)) for i in range(3)]
+    assert shards == [[0, 3, 6, 9], [1, 4, 7], [2, 5, 8]]
+
+
+def test_shard_map():
+    with ThreadPoolExecutor(4) as pool:
+        ctx = _shard_context(1, 2, pool)
+        items = ctx.shard(range(100))
+        result = ctx.map(sum, items, parts=4)
+    assert len(result) == 4
+    assert sum(result) == sum(range(1, 100, 2))
+    assert (ctx.finished, ctx.parts) == (4, 4)
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from peach.xxl_job.pyxxl.error import ClientError, XXLRegisterError
+from peach.xxl_job.pyxxl.xxl_client import XXL, CallbackSender
+
+
+class FakeClient:
+    def __init__(self, fail=False, reject=()):
+        self.fail = fail
+        self.reject = reject
+        self.batches = []
+
+    async def _post(self, path, payload, retry_times=None):
+        if self.fail:
+            raise ClientError("connection error")
+        if any(r["logId"] in self.reject for r in payload):
+            raise XXLRegisterError("rejected")
+        self.batches.append(payload)
+
+
+def _result(log_id):
+    return {"logId": log_id, "logDateTim": 0, "handleCode": 200, "handleMsg": None}
+
+
+def test_callback_batch():
+    async def _test():
+        client = FakeClient()
+        sender = CallbackSender(client, batch_size=10, flush_interval=0.05)
+        for i in range(25):
+            await sender.put(_result(i))
+        await sender.close()
+        return client.batches
+
+    batches = asyncio.run(_test())
+    assert [len(b) for b in batches] == [10, 10, 5]
+    assert [r["logId"] for b in batches for r in b] == list(range(25))
+
+
+def test_callback_spill(tmp_path):
+    spill_path = str(tmp_path / "callback.jsonl")
+
+    async def _test():
+        client = FakeClient(fail=True)
+        sender = CallbackSender(
+            client, flush_interval=0.01, retry_interval=0.01, spill_path=spill_path
+        )
+        await sender.put(_result(1))
+        await sender.close()
+
+        # 调度中心恢复后, 落盘的回调会重新发送
+        client.fail = False
+        await sender.put(_result(2))
+        await asyncio.sleep(0.1)
+        await sender.close()
+        return client.batches
+
+    batches = asyncio.run(_test())
+    assert sorted(r["logId"] for b in batches for r in b) == [1, 2]
+
+
+def test_callback_resend_leftover_reading(tmp_path):
+    spill_path = str(tmp_path / "callback.jsonl")
+    # 上次进程在重发过程中退出, 留下了.reading文件
+    with open(spill_path + ".reading", "w") as f:
+        f.write(json.dumps(_result(1)) + "\n")
+    with open(spill_path, "w") as f:
+        f.write(json.dumps(_result(2)) + "\n")
+
+    async def _test():
+        client = FakeClient()
+        sender = CallbackSender(client, flush_interval=0.01, spill_path=spill_path)
+        await sender.put(_result(3))
+        await sender.close()
+        return client.batches
+
+    batches = asyncio.run(_test())
+    assert sorted(r["logId"] for b in batches for r in b) == [1, 2, 3]
+    assert not os.path.exists(spill_path)
+    assert not os.path.exists(spill_path + ".reading")
+
+
+def test_callback_rejected(tmp_path):
+    spill_path = str(tmp_path / "callback.jsonl")
+
+    async def _test():
+        client = FakeClient(reject=(2,))
+        sender = CallbackSender(
+            client, flush_interval=0.05, retry_interval=0.01, spill_path=spill_path
+        )
+        for i in range(5):
+            await sender.put(_result(i))
+        await sender.close()
+        return client.batches
+
+    # 被拒绝的回调逐条重发后丢弃, 不会落盘重试
+    batches = asyncio.run(_test())
+    assert [r["logId"] for b in batches for r in b] == [0, 1, 3, 4]
+    assert not os.path.exists(spill_path)
+
+
+def test_request_retry_and_dynamic_register():
+    async def _test():
+        calls = []
+
+        async def registry(request):
+            calls.append("registry")
+            if len(calls) < 3:
+                return web.Response(status=503)
+            return web.json_response({"code": 200, "msg": None})
+
+        async def add_by_dynamic(request):
+            data = await request.post()
+            return web.json_response(
+                {
+                    "code": 200,
+                    "jobDesc": data["jobDesc"],
+                    "cookie": request.cookies.get("REMOTE_COOKIE"),
+                }
+            )
+
+        app = web.Application()
+        app.router.add_post("/xxl-job-admin/api/registry", registry)
+        app.router.add_post("/xxl-job-admin/jobinfo/add_by_dynamic/", add_by_dynamic)
+        async with TestServer(app) as server:
+            client = XXL(
+                str(server.make_url("/xxl-job-admin/api/")),
+                retry_interval=0.01,
+                remote_cookie="cookie",
+            )
+            # 5xx按指数退避重试
+            assert (await client._post("registry", {}, retry_times=3)).ok
+            # 注册失败不抛异常, 等下一次循环
+            calls.clear()
+            assert await client.registry("app", "http://127.0.0.1:9999") is False
+            r = await client.dynamic_register({"jobDesc": "demo"})
+            assert r == {"code": 200, "jobDesc": "demo", "cookie": "cookie"}
+            await client.close()
+        return calls
+
+    assert asyncio.run(_test()) == ["registry"]
+
+
+def test_request_retry_times():
+    async def _test():
+        calls = []
+
+        async def registry(request):
+            calls.append("registry")
+            return web.Response(status=503)
+
+        app = web.Application()
+        app.router.add_post("/xxl-job-admin/api/registry", registry)
+        async with TestServer(app) as server:
+            client = XXL(
+                str(server.make_url("/xxl-job-admin/api/")),
+                retry_times=2,
+                retry_interval=0.01,
+            )
+            # 不传retry_times时用客户端的默认值, 0不再表示一直重试
+            for retry_times, expected in ((None, 2), (0, 1)):
+                calls.clear()
+                with pytest.raises(ClientError):
+                    await client._post("registry", {}, retry_times=retry_times)
+                assert len(calls) == expected
+            await client.close()
+
+    asyncio.run(_test())